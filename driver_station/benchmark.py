@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import logging
+import os
+import struct
+import threading
+import time
+
+# the benchmark does not need a window or physical gamepads, so use the SDL dummy video driver
+# unless a driver has been explicitly selected
+os.environ.setdefault( 'SDL_VIDEODRIVER', 'dummy' )
+
+import pygame
+
+from logger import logger
+
+from joystick_mgr import JoystickMgr
+from latency import LatencyHistogram
+from xrp_controller import XrpController
+from xrp_protocol import *
+
+#
+# Benchmark for the driver station event pipeline. Synthetic joystick axis events are posted to the
+# pygame event queue at a configurable rate for one or more synthetic gamepads. The events are
+# processed by the real JoystickMgr run loop and XrpController send path, and delivered to a local
+# stand-in robot server that decodes the received frames.
+#
+# The benchmark reports the rate at which events were injected and delivered, the number of bytes
+# on the wire, the latency from the time the event is received by the joystick manager to the time
+# it is written to the socket, and the end-to-end latency from the time the event is posted to the
+# time the robot server receives it.
+#
+
+# the synthetic gamepads use the XInput controller map, and move the stick axes
+BENCHMARK_CONTROLLER_MAP = 'XInput'
+BENCHMARK_AXES = ( (0, 'LeftJoystickX'), (1, 'LeftJoystickY'), (3, 'RightJoystickX'), (4, 'RightJoystickY') )
+
+# time to wait for the controllers to connect, and for the last events to be delivered, in seconds
+CONNECT_WAIT = 5.0
+DRAIN_WAIT = 1.0
+
+#
+# Stand-in for the XRP robot server. The server accepts a TCP connection from an XRP controller,
+# acknowledges the binary wire format if requested, and decodes the received text lines or binary
+# frames. Each decoded control value is matched against the values posted by the event source to
+# measure the end-to-end latency. Pings from the controller are answered in the same way as the XRP
+# answers them, so that the round trip time of the link is measured as well.
+#
+class RobotServer():
+    def __init__(self, loop, name):
+        self.loop = loop
+        self.name = name
+        self.server = None
+        self.port = None
+        self.bytes_received = 0
+        self.frames_received = 0
+        self.values_matched = 0
+        self.latency = LatencyHistogram( name='%s End-To-End Latency' % name )
+
+        # time each control value was posted, keyed by (control name, fixed-point value)
+        self.posted = {}
+        self.posted_lock = threading.Lock()
+
+    def start(self):
+        future = asyncio.run_coroutine_threadsafe( self.start_server(), self.loop )
+        return future.result()
+
+    async def start_server(self):
+        self.server = await asyncio.start_server( self.handle_client, '127.0.0.1', 0 )
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def stop(self):
+        if self.server:
+            self.loop.call_soon_threadsafe( self.server.close )
+
+    def record_posted(self, name, value, timestamp):
+        with self.posted_lock:
+            self.posted[(name, to_fixed(value))] = timestamp
+
+    def record_received(self, name, fixed, timestamp):
+        with self.posted_lock:
+            posted = self.posted.pop( (name, fixed), None )
+        if posted is not None:
+            self.values_matched += 1
+            self.latency.record( timestamp - posted )
+
+    async def handle_client(self, reader, writer):
+        wire_format = WIRE_FORMAT_TEXT
+        snapshot = [0] * len(CONTROL_IDS)
+        try:
+            while True:
+                if wire_format == WIRE_FORMAT_TEXT:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    self.bytes_received += len(line)
+                    command = line.decode('utf-8')
+                    if command == protocol_command(WIRE_FORMAT_BINARY):
+                        wire_format = WIRE_FORMAT_BINARY
+                        writer.write( line )
+                        await writer.drain()
+                        continue
+
+                    fields = command.strip().split(':')
+                    if len(fields) == 3 and fields[0] == PING_COMMAND:
+                        received = int(time.monotonic() * 1000)
+                        writer.write( ('%s:%s:%s:%d:%d\n' % (PONG_COMMAND, fields[1], fields[2], received,
+                                                               int(time.monotonic() * 1000))).encode('utf-8') )
+                        await writer.drain()
+                        continue
+                    if len(fields) == 3 and fields[0] == 'Event':
+                        self.frames_received += 1
+                        try:
+                            self.record_received( fields[1], to_fixed(fields[2]), time.monotonic() )
+                        except ValueError:
+                            pass
+                else:
+                    frame_type = await reader.readexactly( 1 )
+                    if frame_type[0] == FRAME_EVENT:
+                        frame = frame_type + await reader.readexactly( EVENT_FRAME_SIZE - 1 )
+                        now = time.monotonic()
+                        name, value = decode_event_frame( frame )
+                        self.record_received( name, to_fixed(value), now )
+                    elif frame_type[0] == FRAME_SNAPSHOT:
+                        frame = frame_type + await reader.readexactly( SNAPSHOT_FRAME_SIZE - 1 )
+                        now = time.monotonic()
+                        # only the controls that changed since the previous snapshot are matched
+                        for control_id, value in enumerate( decode_snapshot_frame(frame) ):
+                            fixed = to_fixed( value )
+                            if fixed != snapshot[control_id]:
+                                snapshot[control_id] = fixed
+                                self.record_received( CONTROL_IDS[control_id], fixed, now )
+                    elif frame_type[0] == FRAME_PING:
+                        frame = frame_type + await reader.readexactly( PING_FRAME_SIZE - 1 )
+                        received = int(time.monotonic() * 1000) & 0xFFFFFFFF
+                        frame_id, sequence, timestamp = struct.unpack( PING_FRAME_FORMAT, frame )
+                        writer.write( struct.pack( PONG_FRAME_FORMAT, FRAME_PONG, PONG_FRAME_SIZE, sequence, timestamp,
+                                                   received, int(time.monotonic() * 1000) & 0xFFFFFFFF ) )
+                        await writer.drain()
+                        self.bytes_received += len(frame)
+                        continue
+                    else:
+                        logger.error( '%s: Unknown frame type: %d' % (self.name, frame_type[0]) )
+                        break
+                    self.bytes_received += len(frame)
+                    self.frames_received += 1
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+        writer.close()
+
+#
+# Synthetic gamepad that posts axis motion events to the pygame event queue at the configured rate.
+# The axis value is stepped for each event so that consecutive values differ and every event is
+# sent to the XRP.
+#
+class SyntheticGamepad():
+    def __init__(self, instance_id, robot_server, rate, duration):
+        self.instance_id = instance_id
+        self.robot_server = robot_server
+        self.rate = float(rate)
+        self.duration = float(duration)
+        self.events_posted = 0
+        self.thread = threading.Thread( target=self.run, daemon=True )
+
+    def start(self):
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    def run(self):
+        period = 1.0 / self.rate
+        start = time.monotonic()
+        next_post = start
+        step = 0
+        while True:
+            now = time.monotonic()
+            if now - start >= self.duration:
+                break
+            if now < next_post:
+                time.sleep( next_post - now )
+
+            axis, name = BENCHMARK_AXES[self.events_posted % len(BENCHMARK_AXES)]
+            if self.events_posted % len(BENCHMARK_AXES) == 0:
+                step += 1
+            # step through the values -0.999 to 0.999 in thousandths
+            value = ((step % 1999) - 999) / VALUE_SCALE
+
+            self.robot_server.record_posted( name, value, time.monotonic() )
+            pygame.event.post( pygame.event.Event(pygame.JOYAXISMOTION, instance_id=self.instance_id, joy=self.instance_id,
+                                                  axis=axis, value=value) )
+            self.events_posted += 1
+            next_post += period
+
+def run_benchmark( options ):
+    # the input filter quantizes the axis values by default, which would collapse the stepped values
+    # and hide the cost of sending them, so quantization is disabled unless requested
+    input_filters = { 'default': { 'quantize': float(options.quantize) } }
+
+    joystick_mgr = JoystickMgr( scan_for_joysticks=False, max_dispatch_rate=float(options.max_dispatch_rate),
+                                input_filters=input_filters )
+
+    # the robot servers run on their own event loop, separate from the connection manager
+    server_loop = asyncio.new_event_loop()
+    server_thread = threading.Thread( target=server_loop.run_forever, daemon=True )
+    server_thread.start()
+
+    robot_servers = list()
+    controllers = list()
+    gamepads = list()
+    for instance_id in range(int(options.num_gamepads)):
+        robot_server = RobotServer( server_loop, 'Robot-%d' % instance_id )
+        port = robot_server.start()
+        robot_servers.append( robot_server )
+
+        controller = XrpController( socket_type='TCP', host='127.0.0.1', port=port, wire_format=options.wire_format.upper(),
+                                    snapshot_rate=float(options.snapshot_rate) )
+        controllers.append( controller )
+
+        joystick_mgr.register_controller( instance_id, BENCHMARK_CONTROLLER_MAP )
+        joystick_mgr.bind_device( instance_id, controller )
+
+        gamepads.append( SyntheticGamepad(instance_id, robot_server, options.rate, options.duration) )
+
+    # wait for all the controllers to connect to the robot servers
+    deadline = time.monotonic() + CONNECT_WAIT
+    while not all( controller.is_connected() for controller in controllers ):
+        if time.monotonic() > deadline:
+            logger.error( 'Controllers failed to connect to the robot servers' )
+            return False
+        time.sleep( 0.05 )
+
+    joystick_thread = threading.Thread( target=joystick_mgr.run, daemon=True )
+    joystick_thread.start()
+
+    start = time.monotonic()
+    for gamepad in gamepads:
+        gamepad.start()
+    for gamepad in gamepads:
+        gamepad.join()
+    elapsed = time.monotonic() - start
+
+    # let the last events work their way through the pipeline, then stop the joystick manager
+    time.sleep( DRAIN_WAIT )
+    pygame.event.post( pygame.event.Event(pygame.KEYDOWN, unicode='\x03', key=0, mod=0) )
+    joystick_thread.join( timeout=DRAIN_WAIT )
+
+    for controller in controllers:
+        controller.shutdown()
+    for robot_server in robot_servers:
+        robot_server.stop()
+
+    events_posted = sum( gamepad.events_posted for gamepad in gamepads )
+    frames_received = sum( robot_server.frames_received for robot_server in robot_servers )
+    values_matched = sum( robot_server.values_matched for robot_server in robot_servers )
+    bytes_received = sum( robot_server.bytes_received for robot_server in robot_servers )
+
+    print( 'Gamepads: %d, Rate: %s events/s per gamepad, Duration: %.1fs, Wire Format: %s, Snapshot Rate: %s' % \
+           (len(gamepads), options.rate, elapsed, options.wire_format.upper(), options.snapshot_rate) )
+    print( 'Events Posted:    %d (%.1f events/s)' % (events_posted, events_posted / elapsed) )
+    print( 'Frames Received:  %d (%.1f frames/s)' % (frames_received, frames_received / elapsed) )
+    print( 'Values Delivered: %d (%.1f%% of posted)' % (values_matched, 100.0 * values_matched / max(events_posted, 1)) )
+    print( 'Bytes On Wire:    %d (%.1f bytes/s, %.1f bytes/event)' % \
+           (bytes_received, bytes_received / elapsed, bytes_received / max(values_matched, 1)) )
+    for controller in controllers:
+        print( str(controller.get_latency_histogram()) )
+        print( 'Link: %s' % str(controller.get_link_stats()) )
+    for robot_server in robot_servers:
+        print( str(robot_server.latency) )
+
+    return True
+
+if __name__ == '__main__':
+
+    #
+    # parse out the command arguments
+    #
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--debug', action='store_true', dest='debug', default=False)
+    parser.add_argument('-g', '--gamepads', action='store', dest='num_gamepads', default='1')
+    parser.add_argument('-r', '--rate', action='store', dest='rate', default='250')
+    parser.add_argument('-t', '--duration', action='store', dest='duration', default='10')
+    parser.add_argument('-w', '--wire_format', action='store', dest='wire_format', default=WIRE_FORMAT_TEXT)
+    parser.add_argument('-s', '--snapshot_rate', action='store', dest='snapshot_rate', default='0')
+    parser.add_argument('-m', '--max_dispatch_rate', action='store', dest='max_dispatch_rate', default='0')
+    parser.add_argument('-q', '--quantize', action='store', dest='quantize', default='0')
+    options = parser.parse_args()
+
+    if options.debug:
+        logger.setLevel(logging.DEBUG)
+    else:
+        logger.setLevel(logging.WARNING)
+
+    run_benchmark( options )
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from logger import logger
+
+#
+# The connection manager owns the asyncio event loop that services the connections to all of the
+# XRP devices. The loop runs in a separate service thread so that connecting to, writing to, or
+# reconnecting to one XRP never blocks the joystick event processing or the connections to any
+# of the other XRPs.
+#
+# Functions that are called from other threads (e.g. the joystick event thread) must use the
+# start_task() and call_soon() functions to hand work off to the event loop.
+#
+class ConnectionMgr():
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread( target=self.run_loop, daemon=True )
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop( self.loop )
+        logger.info( 'XRP Connection Manager Started.' )
+        self.loop.run_forever()
+        logger.info( 'XRP Connection Manager Terminated.' )
+
+    #
+    # Function schedules the coroutine to run on the event loop, returning a future that can be
+    # used to cancel the task from any thread
+    #
+    def start_task(self, coro):
+        return asyncio.run_coroutine_threadsafe( coro, self.loop )
+
+    #
+    # Function schedules the callback to be invoked on the event loop. The call returns immediately.
+    #
+    def call_soon(self, callback, *args):
+        self.loop.call_soon_threadsafe( callback, *args )
+
+    def stop(self):
+        self.loop.call_soon_threadsafe( self.loop.stop )
+
+connection_mgr = None
+connection_mgr_lock = threading.Lock()
+
+#
+# Function returns the connection manager shared by all XRP controllers, creating and starting it
+# on first use
+#
+def get_connection_mgr():
+    global connection_mgr
+    with connection_mgr_lock:
+        if connection_mgr is None:
+            connection_mgr = ConnectionMgr()
+    return connection_mgr
@@ -4,6 +4,7 @@ import argparse
 import json
 import logging
 import platform
+import queue
 import requests
 import signal
 import socket
@@ -18,9 +19,17 @@ from logger import logger
 from safe_scheduler import SafeScheduler
 
 from joystick_mgr import JoystickMgr
-from xrp_controller import XrpController
+from xrp_controller import XrpController, PING_INTERVAL
 from getip import get_ip
 
+# time (in seconds) without any data on the device change feed before the connection is considered
+# lost, which is longer than the interval between the keepalive comments sent by the FMS
+FEED_READ_TIMEOUT = 45
+
+# time (in seconds) between the attempts to subscribe to the device change feed, while the devices
+# are polled from the FMS instead
+FEED_RETRY_INTERVAL = 30
+
 def joystick_service( joystick_mgr ):
     joystick_mgr.run()
 
@@ -38,6 +47,12 @@ class DriverStation():
         self.devices = list()
         self.gamepad_controllers = list()
 
+        # the changes received from the FMS device change feed, which are applied to the devices
+        # by the scheduler thread
+        self.device_changes = queue.Queue()
+        self.feed_connected = False
+        self.feed_revision = None
+
         # if an FMS is configured, then register with the first available FMS in the 
         # configuration list
         self.fms = None
@@ -57,7 +72,9 @@ class DriverStation():
                     logger.error( 'No FMS available, will try again in 30 seconds' )
                     time.sleep(30)
 
-        self.joystick_mgr = JoystickMgr(scan_for_joysticks=False)
+        self.joystick_mgr = JoystickMgr(scan_for_joysticks=False, max_dispatch_rate=self.config.get('max_dispatch_rate', 0),
+                                        input_filters=self.config.get('input_filters', None),
+                                        debug_events=self.config.get('debug_events', False))
 
         self.status_reported = 0
         self.status = 'Running'
@@ -69,6 +86,7 @@ class DriverStation():
         self.scheduler = SafeScheduler()
         self.scheduler.every(5).seconds.do(self.scan_gamepad_controllers)
         self.scheduler.every(10).seconds.do(self.scan_xrp_devices)
+        self.scheduler.every(60).seconds.do(self.report_latency)
 
     #
     # Function to register this driver station control instance with the FMS. Once registered,
@@ -114,6 +132,15 @@ class DriverStation():
             data['hardware_id'] = self.config.get('uuid', 'No UUID')
             data['status'] = self.status
 
+            # round trip time and clock offset measured to each of the connected XRPs
+            links = {}
+            for device in self.devices:
+                xrp_controller = device.get('controller', None)
+                if xrp_controller:
+                    links[device['name']] = xrp_controller.get_link_stats()
+            if links:
+                data['links'] = links
+
             url = '%s/status/' % self.fms['url_base']
             headers = {'Content-type': 'application/json'}
             try:
@@ -196,7 +223,10 @@ class DriverStation():
             bind_controller = False
             xrp_controller = device.get('controller', None)
             if xrp_controller == None:
-                xrp_controller = XrpController(socket_type=device['protocol'], host=device['ip_address'], port=int(device['port']))
+                xrp_controller = XrpController(socket_type=device['protocol'], host=device['ip_address'], port=int(device['port']),
+                                               wire_format=self.config.get('wire_format', 'TEXT'),
+                                               snapshot_rate=self.config.get('snapshot_rate', 0),
+                                               ping_interval=self.config.get('ping_interval', PING_INTERVAL))
                 device['controller'] = xrp_controller
 
                 bind_controller = True
@@ -224,60 +254,175 @@ class DriverStation():
     #
     # Function will be called periodically to look for newly discovered XRP devices and add them to the set of
     # managed devices. This function will also detect device changes or devices that are no longer reporting as healthy
-    # terminate those sessions, too
+    # terminate those sessions, too. While the device change feed is connected, the devices are kept up to date
+    # from the feed instead.
     #
     def scan_xrp_devices(self): 
-        curr_devices = self.get_xrp_devices()
+        if self.feed_connected:
+            return
+        self.apply_device_list( self.get_xrp_devices() )
 
-        if len(curr_devices) > 0:
-            # Check for newly discovered devices or devices that have had the communication parameters modified
+    #
+    # Function updates the set of managed devices from the full list of devices assigned to this instance. An empty
+    # list from polling may be the result of a failed request, so the managed devices are only removed for an empty
+    # list when the list is authoritative, as for a snapshot from the device change feed.
+    #
+    def apply_device_list(self, curr_devices, authoritative=False):
+        if len(curr_devices) == 0:
+            logger.info( 'No devices assigned to this instance' )
+            if not authoritative:
+                return
+
+        # Check for newly discovered devices or devices that have had the communication parameters modified
+        for curr_device in curr_devices:
+            self.update_device( curr_device )
+
+        # Now look to see if any of the devices are no longer being managed by this instance, and remove them
+        # from the device table
+        for device in list(self.devices):
+            found = False
             for curr_device in curr_devices:
-                found = False
-                for device in self.devices:
-                    if curr_device['hardware_id'] == device['hardware_id']:
-                        found = True
-                        break
+                if curr_device['hardware_id'] == device['hardware_id']:
+                    found = True
+                    break
 
-                if not found:
-                    logger.info( 'Found new device: %s, queuing for connection' % (curr_device['hardware_id']) )
-                    self.devices.append(curr_device)
-                else:
-                    # Update any parameters and look for meaningful changes
-                    device['name'] = curr_device['name']
-                    if device['ip_address'] != curr_device['ip_address']:
-                        self.remove_device( device, 'IP address is different (%s vs %s), terminating connection' % \
-                                            (device['ip_address'],curr_device['ip_address']) )
-                    device['ip_address'] = curr_device['ip_address']
-
-                    if device['port'] != curr_device['port']:
-                        self.remove_device( device, 'IP port is different (%s vs %s), terminating connection' % \
-                                            (device['port'],curr_device['port']) )
-                    device['port'] = curr_device['port']
-
-                    if device['protocol'] != curr_device['protocol']:
-                        self.remove_device( device, 'Protocol is different (%s vs %s), terminating connection' % \
-                                            (device['protocol'],curr_device['protocol']) )
-                    device['protocol'] = curr_device['protocol']
-
-                    if device['protocol'] != curr_device['protocol'] and curr_device['state'] == 'unknown':
-                        self.remove_device( device, 'State has changed (%s vs %s), terminating connection' % \
-                                            (device['state'],curr_device['state']) )
-                        terminate_controller_connection = True
-                    device['state'] = curr_device['state'].lower()
-
-            # Now look to see if any of the devices are no longer being managed by this instance, and remove them
-            # from the device table
-            for device in self.devices:
-                found = False
-                for curr_device in curr_devices:
-                    if curr_device['hardware_id'] == device['hardware_id']:
-                        found = True
-                        break
+            if not found:
+                self.remove_device( device, 'No longer assigned to this instance' )
+
+    #
+    # Function adds a newly discovered device to the set of managed devices, or updates the managed device. If the
+    # communication parameters have been modified, the connection is terminated and the device is queued for
+    # connection with the new parameters.
+    #
+    def update_device(self, curr_device):
+        found = False
+        for device in self.devices:
+            if curr_device['hardware_id'] == device['hardware_id']:
+                found = True
+                break
 
-                if not found:
-                    self.remove_device( device, 'No longer assigned to this instance' )
+        if not found:
+            logger.info( 'Found new device: %s, queuing for connection' % (curr_device['hardware_id']) )
+            self.devices.append(curr_device)
         else:
-            logger.info( 'No devices assigned to this instance' )
+            # Update any parameters and look for meaningful changes
+            device['name'] = curr_device['name']
+            device['state'] = curr_device['state'].lower()
+
+            msg = None
+            if device['ip_address'] != curr_device['ip_address']:
+                msg = 'IP address is different (%s vs %s)' % (device['ip_address'],curr_device['ip_address'])
+            elif device['port'] != curr_device['port']:
+                msg = 'IP port is different (%s vs %s)' % (device['port'],curr_device['port'])
+            elif device['protocol'] != curr_device['protocol']:
+                msg = 'Protocol is different (%s vs %s)' % (device['protocol'],curr_device['protocol'])
+
+            if msg:
+                self.remove_device( device, '%s, terminating connection' % msg )
+                logger.info( 'Queuing device: %s for connection' % (curr_device['hardware_id']) )
+                self.devices.append(curr_device)
+
+    #
+    # Function subscribes to the device change feed of the FMS, which streams the changes to the devices
+    # assigned to this instance as Server-Sent Events, and queues the changes to be applied by the scheduler
+    # thread. The feed is resubscribed if the connection is lost, and the devices are polled from the FMS
+    # until it is reconnected. The revision of the last change received is sent when resubscribing, so that
+    # only the changes since then are sent.
+    #
+    def device_feed_service(self):
+        logger.info( 'Device Feed Service Started.' )
+        while not self.shutdown:
+            url = '%s/feed/?type=XRP' % (self.fms['url_base'])
+            alliance = self.fms_config.get( 'alliance', None ) if self.fms_config else None
+            if alliance:
+                url += '&alliance=%s' % (alliance)
+
+            headers = {'Accept': 'text/event-stream'}
+            if self.feed_revision is not None:
+                headers['Last-Event-ID'] = str(self.feed_revision)
+
+            try:
+                with requests.get(url, headers=headers, stream=True, timeout=(5, FEED_READ_TIMEOUT)) as resp:
+                    if resp.status_code == 200:
+                        logger.info( 'Subscribed To FMS Device Feed' )
+                        self.feed_connected = True
+                        self.read_device_feed( resp )
+                    else:
+                        logger.error( 'Error Subscribing To FMS Device Feed: %d' % resp.status_code )
+            except (OSError, ValueError) as e:
+                logger.error( 'Error Reading FMS Device Feed: %s' % str(e) )
+
+            if self.feed_connected:
+                logger.info( 'FMS Device Feed Disconnected, Polling For Devices' )
+                self.feed_connected = False
+
+            retry_time = time.time() + FEED_RETRY_INTERVAL
+            while not self.shutdown and time.time() < retry_time:
+                time.sleep( 0.5 )
+
+        logger.info( 'Device Feed Service Terminated.' )
+
+    def read_device_feed(self, resp):
+        # the events are read as they arrive rather than in blocks, and are always UTF-8 encoded
+        resp.encoding = 'utf-8'
+        event = None
+        data = []
+        for line in resp.iter_lines(chunk_size=1, decode_unicode=True):
+            if self.shutdown:
+                break
+            if not line:
+                # a blank line ends the event
+                if event and data:
+                    self.device_changes.put( (event, json.loads('\n'.join(data))) )
+                event = None
+                data = []
+            elif line.startswith(':'):
+                # comment sent by the FMS to keep the connection alive
+                continue
+            else:
+                field, _, value = line.partition(':')
+                value = value[1:] if value.startswith(' ') else value
+                if field == 'event':
+                    event = value
+                elif field == 'data':
+                    data.append( value )
+                elif field == 'id':
+                    self.feed_revision = int(value)
+
+    #
+    # Function is called by the scheduler thread to apply the changes received from the device change feed
+    #
+    def process_device_changes(self):
+        while True:
+            try:
+                event, data = self.device_changes.get_nowait()
+            except queue.Empty:
+                break
+
+            logger.debug( 'Device Feed Event: %s - %s' % (event, str(data)) )
+            if event == 'snapshot':
+                self.apply_device_list( data['devices'], authoritative=True )
+            elif event == 'add' or event == 'update':
+                self.update_device( data )
+            elif event == 'remove':
+                for device in self.devices:
+                    if device['hardware_id'] == data['hardware_id']:
+                        self.remove_device( device, 'No longer assigned to this instance' )
+                        break
+
+    #
+    # Function will be called periodically to log the event latency histogram for each connected XRP. The
+    # latency is measured from the time the gamepad event is received to the time it is written to the socket.
+    #
+    def report_latency(self):
+        for device in self.devices:
+            xrp_controller = device.get('controller', None)
+            if xrp_controller:
+                logger.info( 'Device: %s - %s' % (device['name'],str(xrp_controller.get_latency_histogram())) )
+                telemetry = xrp_controller.get_telemetry()
+                if telemetry:
+                    logger.info( 'Device: %s - Telemetry: %s' % (device['name'],str(telemetry)) )
+                logger.info( 'Device: %s - Link: %s' % (device['name'],str(xrp_controller.get_link_stats())) )
 
     #
     # Utility function to remove the specified device from the table of managed devices. The device controller
@@ -290,6 +435,7 @@ class DriverStation():
             gamepad_id = xrp_controller.get_gamepad_id()
             if gamepad_id != None:
                 self.joystick_mgr.remove_device_binding(gamepad_id)
+            xrp_controller.shutdown()
         self.devices.remove( device )
                 
 #
@@ -309,6 +455,7 @@ def ds_scheduler_service( ds ):
     logger.info( 'Driver Station Scheduler Started.' )
     while not ds.shutdown:
         try:
+            ds.process_device_changes()
             ds.scheduler.run_pending()
             time.sleep( delay )
         except KeyboardInterrupt:
@@ -354,6 +501,10 @@ if __name__ == '__main__':
 
     threading.Thread( target=ds_scheduler_service, args=(ds,), daemon=True ).start()
 
+    # subscribe to the device changes from the FMS, rather than relying on polling for the devices
+    if ds.fms and config.get('device_feed', True):
+        threading.Thread( target=ds.device_feed_service, daemon=True ).start()
+
     ds.joystick_mgr.run()
 
     shutdown_all()
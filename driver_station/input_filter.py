@@ -0,0 +1,172 @@
+import time
+
+#
+# Input filter stage applied to the decoded axis events before they are dispatched to the bound
+# XRP controller. Each axis control can be configured with the following parameters, specified
+# in the 'input_filters' section of the configuration file. Controls without their own entry
+# use the 'default' entry:
+#
+#   deadband   - values within this distance of center are reported as 0.0. Values outside the
+#                deadband are rescaled so that the output still covers the full range.
+#   quantize   - step size that the value is rounded to
+#   min_change - minimum change from the last dispatched value for a new value to be dispatched.
+#                A return to 0.0 is always dispatched.
+#   max_rate   - maximum rate (in Hz) at which values are dispatched for the control. A value that
+#                is held back is dispatched once the interval has elapsed, unless superseded.
+#
+# Example:
+#   "input_filters": {
+#       "default":     { "deadband": 0.05, "quantize": 0.05, "min_change": 0.05, "max_rate": 50 },
+#       "LeftTrigger": { "deadband": 0.0 }
+#   }
+#
+# Button and hat events are discrete and are never filtered.
+#
+DEFAULT_FILTER = {
+    'deadband': 0.0,
+    'quantize': 0.1,
+    'min_change': 0.0,
+    'max_rate': 0
+}
+
+class AxisFilter():
+    def __init__(self, config):
+        self.deadband = float(config.get('deadband', DEFAULT_FILTER['deadband']))
+        self.quantize = float(config.get('quantize', DEFAULT_FILTER['quantize']))
+        self.min_change = float(config.get('min_change', DEFAULT_FILTER['min_change']))
+        max_rate = float(config.get('max_rate', DEFAULT_FILTER['max_rate']))
+        if max_rate > 0:
+            self.min_interval = 1.0 / max_rate
+        else:
+            self.min_interval = 0.0
+
+    def apply(self, value):
+        # deadband around center, rescaling the remaining range
+        if self.deadband > 0.0:
+            magnitude = abs(value)
+            if magnitude <= self.deadband:
+                value = 0.0
+            else:
+                scaled = min( (magnitude - self.deadband) / (1.0 - self.deadband), 1.0 )
+                value = scaled if value > 0.0 else -scaled
+
+        # quantize to the configured step
+        if self.quantize > 0.0:
+            value = round( round(value / self.quantize) * self.quantize, 6 )
+
+        return value
+
+class InputFilter():
+    def __init__(self, config=None):
+        if config is None:
+            config = {}
+
+        default_config = dict(DEFAULT_FILTER)
+        default_config.update( config.get('default', {}) )
+        self.default_filter = AxisFilter( default_config )
+
+        self.filters = {}
+        for name, control_config in config.items():
+            if name != 'default':
+                merged_config = dict(default_config)
+                merged_config.update( control_config )
+                self.filters[name] = AxisFilter( merged_config )
+
+        # state of each axis, keyed by (joystick instance, control name): last dispatched value,
+        # time of the last dispatch and any event held back by the rate limit
+        self.last_values = {}
+        self.last_times = {}
+        self.pending = {}
+
+    def get_filter(self, name):
+        return self.filters.get( name, self.default_filter )
+
+    #
+    # Function filters the decoded axis event, replacing the rounded value with the filtered value.
+    # Returns True if the event should be dispatched now, or False if it should be dropped or has
+    # been held back by the rate limit.
+    #
+    def filter_event(self, instance_id, event, now=None):
+        if event.type != 'AXIS' or event.value is None:
+            return True
+
+        if now is None:
+            now = time.monotonic()
+
+        name = event.name
+        key = (instance_id, name)
+        axis_filter = self.get_filter( name )
+        value = axis_filter.apply( event.value )
+        event.rounded_value = value
+
+        last_value = self.last_values.get( key, 0.0 )
+        if value == last_value:
+            self.pending.pop( key, None )
+            return False
+
+        if value != 0.0 and abs(value - last_value) < axis_filter.min_change:
+            # the axis has returned close to the last dispatched value, so any value held back by
+            # the rate limit is stale and must not be dispatched
+            self.pending.pop( key, None )
+            return False
+
+        last_time = self.last_times.get( key, None )
+        if last_time is not None and (now - last_time) < axis_filter.min_interval:
+            # hold the event back, it will be dispatched by flush_pending() unless a newer
+            # value is received first. The decoded event record is reused by the joystick manager,
+            # so a copy is held.
+            self.pending[key] = event.copy()
+            return False
+
+        self.pending.pop( key, None )
+        self.last_values[key] = value
+        self.last_times[key] = now
+        return True
+
+    #
+    # Function returns the list of (instance id, event) pairs held back by the rate limit whose
+    # interval has now elapsed
+    #
+    def flush_pending(self, now=None):
+        if not self.pending:
+            return []
+
+        if now is None:
+            now = time.monotonic()
+
+        ready = list()
+        for key, event in list(self.pending.items()):
+            axis_filter = self.get_filter( key[1] )
+            if (now - self.last_times[key]) >= axis_filter.min_interval:
+                del self.pending[key]
+                self.last_values[key] = event.rounded_value
+                self.last_times[key] = now
+                ready.append( (key[0], event) )
+        return ready
+
+    #
+    # Function returns the number of seconds until the next held back event is due, or None if
+    # no events are being held back
+    #
+    def next_flush_delay(self, now=None):
+        if not self.pending:
+            return None
+
+        if now is None:
+            now = time.monotonic()
+
+        delay = None
+        for key in self.pending:
+            axis_filter = self.get_filter( key[1] )
+            remaining = max( 0.0, self.last_times[key] + axis_filter.min_interval - now )
+            if delay is None or remaining < delay:
+                delay = remaining
+        return delay
+
+    #
+    # Function clears the filter state for a joystick that has been disconnected
+    #
+    def clear(self, instance_id):
+        for state in (self.last_values, self.last_times, self.pending):
+            for key in [key for key in state if key[0] == instance_id]:
+                del state[key]
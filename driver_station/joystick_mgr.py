@@ -7,6 +7,7 @@ import sys
 import threading
 import time
 
+from input_filter import InputFilter
 from logger import logger
 
 controller_maps = {
@@ -100,6 +101,78 @@ controller_maps = {
     }
 }
 
+#
+# Lightweight record describing a decoded joystick event. A single record is reused for each event
+# decoded by the joystick manager, so consumers that need to hold on to an event beyond the
+# dispatch call must make a copy.
+#
+class DecodedEvent():
+    __slots__ = ('type', 'name', 'value', 'rounded_value', 'timestamp')
+
+    def __init__(self, type='UNKNOWN', name='', value=None, rounded_value=None, timestamp=None):
+        self.type = type
+        self.name = name
+        self.value = value
+        self.rounded_value = rounded_value
+        self.timestamp = timestamp
+
+    def set(self, type, name='', value=None, rounded_value=None):
+        self.type = type
+        self.name = name
+        self.value = value
+        self.rounded_value = rounded_value
+
+    def copy(self):
+        return DecodedEvent( self.type, self.name, self.value, self.rounded_value, self.timestamp )
+
+    def __str__(self):
+        return 'Type: %s, Name: %s, Value: %s' % (self.type, self.name, self.value)
+
+#
+# Controller map compiled into flat lookup tables indexed by the pygame button, axis and hat
+# indexes. The axis scaling is reduced to a precomputed scale and offset so that decoding an axis
+# event is a single multiply-add.
+#
+class CompiledMap():
+    def __init__(self, controller_map):
+        self.button_names = self.compile_names( controller_map['BUTTONS'] )
+        self.hat_names = self.compile_names( controller_map['HATS'] )
+
+        axes = controller_map['AXES']
+        self.axis_names = self.compile_names( axes )
+        self.axis_scales = [1.0] * len(self.axis_names)
+        self.axis_offsets = [0.0] * len(self.axis_names)
+        self.axis_absolute = [False] * len(self.axis_names)
+        for index, axis in axes.items():
+            if axis.get('scale', False) == True:
+                # map the full range of the axis onto 0.0 to 1.0
+                range = axis['max'] - axis['min']
+                self.axis_scales[index] = 1.0 / range
+                self.axis_offsets[index] = (range/2) / range
+                self.axis_absolute[index] = True
+            else:
+                self.axis_scales[index] = 1.0 / axis['max']
+
+    @staticmethod
+    def compile_names(controls):
+        names = [None] * (max(controls.keys(), default=-1) + 1)
+        for index, control in controls.items():
+            names[index] = control['name']
+        return names
+
+# the controller maps are compiled once, the first time they are used
+compiled_maps = {}
+
+def get_compiled_map(map_name):
+    compiled_map = compiled_maps.get( map_name, None )
+    if compiled_map is None:
+        compiled_map = CompiledMap( controller_maps[map_name] )
+        compiled_maps[map_name] = compiled_map
+    return compiled_map
+
+# decoded event types that are dispatched to the bound device
+DISPATCH_TYPES = ('BUTTON', 'AXIS', 'HAT')
+
 class JoystickMgr:
 
     BUTTON_STATES = {
@@ -107,7 +180,8 @@ class JoystickMgr:
         1: 'PRESSED'
     }
 
-    def __init__(self, scan_for_joysticks=True):
+    def __init__(self, scan_for_joysticks=True, max_dispatch_rate=0, wait_timeout=0.5, input_filters=None,
+                 debug_events=False):
         self.joysticks = {}
         self.devices = {}
         self.controller_maps = {}
@@ -115,6 +189,25 @@ class JoystickMgr:
         self.curr_hat_y = {}
         self.mgmt_callback = None
 
+        # record reused for every decoded event, avoiding an allocation per event
+        self.decoded_event = DecodedEvent()
+
+        # logging every raw event is expensive at high event rates, so it is only done on request
+        self.debug_events = debug_events
+
+        # filter stage applied to the axis events between decoding and dispatch
+        self.input_filter = InputFilter( input_filters )
+
+        # the run loop blocks waiting for gamepad events, waking up after the wait timeout
+        # (in seconds) if no events are received. If a maximum dispatch rate (in Hz) is
+        # configured, events that arrive faster than that rate are batched together and
+        # only the latest value of each axis is dispatched.
+        self.wait_timeout_ms = int(wait_timeout * 1000)
+        if max_dispatch_rate and float(max_dispatch_rate) > 0:
+            self.min_dispatch_interval = 1.0 / float(max_dispatch_rate)
+        else:
+            self.min_dispatch_interval = 0.0
+
         pygame.init()
 
         if scan_for_joysticks:
@@ -153,6 +246,16 @@ class JoystickMgr:
         except:
             pass
 
+    #
+    # Function sets up the decode state for the joystick instance using the named controller map.
+    # This is called when a joystick is connected, and can also be used to register a synthetic
+    # joystick (e.g. for benchmarking) that is not backed by a physical device.
+    #
+    def register_controller(self, instance_id, map_name):
+        self.controller_maps[instance_id] = get_compiled_map( map_name )
+        self.curr_hat_x[instance_id] = 0
+        self.curr_hat_y[instance_id] = 0
+
     def get_num_joysticks(self):
         pygame.joystick.get_count()
 
@@ -160,124 +263,178 @@ class JoystickMgr:
         return self.joysticks
 
     # function decodes the joystick events to a form that can then be passed
-    # to a controller instance
+    # to a controller instance. The returned record is reused for the next event.
     def decode_event(self, event):
-        decoded_event = { 'type': 'UNKNOWN', 'name': '', 'value': None }
-
-        print( 'Event: %s' % str(event) )
-
-        if event.type == pygame.JOYBUTTONDOWN:
-            decoded_event['type'] = 'BUTTON'
-            button = self.controller_maps[event.instance_id]['BUTTONS'].get(event.button,None)
-            if button:
-                decoded_event['name'] = button['name']
-                decoded_event['value'] = 1
-        elif event.type == pygame.JOYBUTTONUP:
-            decoded_event['type'] = 'BUTTON'
-            button = self.controller_maps[event.instance_id]['BUTTONS'].get(event.button,None)
-            if button:
-                decoded_event['name'] = button['name']
-                decoded_event['value'] = 0
-        elif event.type == pygame.JOYAXISMOTION:
-            decoded_event['type'] = 'AXIS'
-            axis = self.controller_maps[event.instance_id]['AXES'].get(event.axis,None)
-            value = 0.0
-            if axis:
-                decoded_event['name'] = axis['name']
-                scaled = axis.get('scale', False)
-                if scaled == True:
-                    range = axis['max'] - axis['min']
-                    value = abs((event.value + (range/2))/range)
-                else:
-                    value = event.value / axis['max']
-                decoded_event['value'] = value
-                decoded_event['rounded_value'] = round(value, 1)
-        elif event.type == pygame.JOYHATMOTION:
-            decoded_event['type'] = 'HAT'
+        decoded_event = self.decoded_event
+        event_type = event.type
+
+        if self.debug_events:
+            logger.debug( 'Event: %s' % str(event) )
+
+        if event_type == pygame.JOYAXISMOTION:
+            compiled_map = self.controller_maps[event.instance_id]
+            axis = event.axis
+            if axis < len(compiled_map.axis_names) and compiled_map.axis_names[axis] is not None:
+                value = event.value * compiled_map.axis_scales[axis] + compiled_map.axis_offsets[axis]
+                if compiled_map.axis_absolute[axis]:
+                    value = abs(value)
+                decoded_event.set( 'AXIS', compiled_map.axis_names[axis], value, value )
+            else:
+                decoded_event.set( 'AXIS' )
+        elif event_type == pygame.JOYBUTTONDOWN or event_type == pygame.JOYBUTTONUP:
+            button_names = self.controller_maps[event.instance_id].button_names
+            button = event.button
+            if button < len(button_names) and button_names[button] is not None:
+                decoded_event.set( 'BUTTON', button_names[button], 1 if event_type == pygame.JOYBUTTONDOWN else 0 )
+            else:
+                decoded_event.set( 'BUTTON' )
+        elif event_type == pygame.JOYHATMOTION:
+            decoded_event.set( 'HAT' )
             # look for a change in the hat values for X and Y coordinates and map any
             # change to discrete events corresponding to the changed setting
+            hat_names = self.controller_maps[event.instance_id].hat_names
             if self.curr_hat_x[event.instance_id] != event.value[0]:
-                hat = self.controller_maps[event.instance_id]['HATS'].get(0,None)
-                if hat:
-                    decoded_event['name'] = hat['name']
-                    decoded_event['value'] = event.value[0]
+                if len(hat_names) > 0 and hat_names[0] is not None:
+                    decoded_event.set( 'HAT', hat_names[0], event.value[0] )
                     self.curr_hat_x[event.instance_id] = event.value[0]
             elif self.curr_hat_y[event.instance_id] != event.value[1]:
-                hat = self.controller_maps[event.instance_id]['HATS'].get(1,None)
-                if hat:
-                    decoded_event['name'] = hat['name']
-                    decoded_event['value'] = event.value[1]
+                if len(hat_names) > 1 and hat_names[1] is not None:
+                    decoded_event.set( 'HAT', hat_names[1], event.value[1] )
                     self.curr_hat_y[event.instance_id] = event.value[1]
-        elif event.type == pygame.JOYDEVICEADDED:
-            decoded_event['type'] = 'MGMT'
-            decoded_event['name'] = 'JOYSTICK'
-            decoded_event['value'] = 'CONNECTED'
-        elif event.type == pygame.JOYDEVICEREMOVED:
-            decoded_event['type'] = 'MGMT'
-            decoded_event['name'] = 'JOYSTICK'
-            decoded_event['value'] = 'DISCONNECTED'
-        elif event.type == pygame.KEYDOWN:
+        elif event_type == pygame.JOYDEVICEADDED:
+            decoded_event.set( 'MGMT', 'JOYSTICK', 'CONNECTED' )
+        elif event_type == pygame.JOYDEVICEREMOVED:
+            decoded_event.set( 'MGMT', 'JOYSTICK', 'DISCONNECTED' )
+        elif event_type == pygame.KEYDOWN and event.unicode == '\x03':
             # Check for a ctrl-C being pressed and raise the KeyboardInterrupt 
             # exception to terminate the program
-            if event.unicode == '\x03':
-                decoded_event['type'] = 'QUIT'
+            decoded_event.set( 'QUIT' )
+        else:
+            decoded_event.set( 'UNKNOWN' )
 
-        #logger.debug( 'Decoded Event: %s' % str(decoded_event) )
+        if self.debug_events:
+            logger.debug( 'Decoded Event: %s' % str(decoded_event) )
         return decoded_event
 
-    def process_events(self):
+    #
+    # Function returns the list of events with all but the latest motion event for each axis
+    # removed. Button and hat events are all retained, in the order they were received.
+    #
+    def coalesce_events(self, events):
+        latest_motion = {}
+        for index, event in enumerate(events):
+            if event.type == pygame.JOYAXISMOTION:
+                latest_motion[(event.instance_id, event.axis)] = index
+
+        coalesced = list()
+        for index, event in enumerate(events):
+            if event.type != pygame.JOYAXISMOTION or latest_motion[(event.instance_id, event.axis)] == index:
+                coalesced.append( event )
+        return coalesced
+
+    #
+    # Function processes the list of events, or all queued events if no list is provided. Each
+    # decoded event is tagged with the time that the events were received, which is used by the
+    # bound devices to measure the latency to the point the event is sent.
+    #
+    def process_events(self, events=None, timestamp=None):
         done = False
-        for event in pygame.event.get():
+        if events is None:
+            events = pygame.event.get()
+        if timestamp is None:
+            timestamp = time.monotonic()
+
+        for event in events:
             decoded_event = self.decode_event( event )
-            if decoded_event['type'] in ['BUTTON', 'AXIS', 'HAT']:
-                device = self.devices.get(event.instance_id, None)
-                if device:
-                    device.process_event( decoded_event )
-                else:
-                    logger.debug( 'No Device Bound To Process Event: %s %s %s' % (decoded_event['name'], decoded_event['type'], decoded_event['value']) )
-            elif decoded_event['type'] == 'MGMT':
-                logger.debug( 'Management Event: %s %s' % (decoded_event['name'], decoded_event['value']) )
-                if decoded_event['value'] == 'CONNECTED':
+            decoded_event.timestamp = timestamp
+            if decoded_event.type in DISPATCH_TYPES:
+                if self.input_filter.filter_event( event.instance_id, decoded_event, timestamp ):
+                    self.dispatch_event( event.instance_id, decoded_event )
+            elif decoded_event.type == 'MGMT':
+                logger.debug( 'Management Event: %s %s' % (decoded_event.name, decoded_event.value) )
+                if decoded_event.value == 'CONNECTED':
                     joystick = pygame.joystick.Joystick(event.device_index)
                     self.joysticks[joystick.get_instance_id()] = joystick
-                    self.curr_hat_x[joystick.get_instance_id()] = 0
-                    self.curr_hat_y[joystick.get_instance_id()] = 0
                     if joystick.get_numaxes() == 6:
                         os_type = platform.system()
                         if os_type == 'Windows':
                             logger.info( 'Windows XInput Joystick: %s Connected' % joystick.get_instance_id() )
-                            self.controller_maps[joystick.get_instance_id()] = controller_maps['XInputWindows']
+                            self.register_controller( joystick.get_instance_id(), 'XInputWindows' )
                         else:
                             logger.info( 'XInput Joystick: %s Connected' % joystick.get_instance_id() )
-                            self.controller_maps[joystick.get_instance_id()] = controller_maps['XInput']
+                            self.register_controller( joystick.get_instance_id(), 'XInput' )
                     else:
                         logger.info( 'DirectInput Joystick: %s Connected' % joystick.get_instance_id() )
-                        self.controller_maps[joystick.get_instance_id()] = controller_maps['DirectInput']
+                        self.register_controller( joystick.get_instance_id(), 'DirectInput' )
 
                     if self.mgmt_callback:
-                        self.mgmt_callback( decoded_event['value'], joystick.get_instance_id() )
+                        self.mgmt_callback( decoded_event.value, joystick.get_instance_id() )
 
-                elif decoded_event['value'] == 'DISCONNECTED':
+                elif decoded_event.value == 'DISCONNECTED':
                     logger.info( 'Joystick %d disconnected' % event.instance_id )
                     self.remove_device_binding(event.instance_id)
+                    self.input_filter.clear(event.instance_id)
                     del self.joysticks[event.instance_id]
 
                     if self.mgmt_callback:
-                        self.mgmt_callback( decoded_event['value'], event.instance_id )
+                        self.mgmt_callback( decoded_event.value, event.instance_id )
 
-            elif decoded_event['type'] == 'QUIT':
+            elif decoded_event.type == 'QUIT':
                 logger.debug( 'Quit received, returning done' )
                 done = True
 
         return done
 
+    def dispatch_event(self, instance_id, decoded_event):
+        device = self.devices.get(instance_id, None)
+        if device:
+            device.process_event( decoded_event )
+        else:
+            logger.debug( 'No Device Bound To Process Event: %s %s %s' % (decoded_event.name, decoded_event.type, decoded_event.value) )
+
+    #
+    # Function dispatches any axis events held back by the input filter rate limits that are now due
+    #
+    def dispatch_pending(self):
+        for instance_id, decoded_event in self.input_filter.flush_pending():
+            self.dispatch_event( instance_id, decoded_event )
+
+    #
+    # Main event loop. The loop blocks until an event is received from pygame, so events are
+    # dispatched as soon as they arrive rather than on a fixed polling interval.
+    #
     def run(self, mgmt_callback=None):
         self.mgmt_callback = mgmt_callback
         done = False
+        last_dispatch = 0.0
         while not done:
             try:
-                done = self.process_events()
-                time.sleep(0.1)
+                # wake up in time to dispatch any events held back by the input filter
+                wait_timeout_ms = self.wait_timeout_ms
+                flush_delay = self.input_filter.next_flush_delay()
+                if flush_delay is not None:
+                    wait_timeout_ms = min( wait_timeout_ms, int(flush_delay * 1000) + 1 )
+
+                event = pygame.event.wait( wait_timeout_ms )
+                if event.type == pygame.NOEVENT:
+                    self.dispatch_pending()
+                    continue
+                timestamp = time.monotonic()
+
+                # if a maximum dispatch rate is configured, hold off until the minimum interval
+                # has elapsed since the last dispatch. Any events received in the meantime are
+                # processed in the same batch.
+                if self.min_dispatch_interval > 0.0:
+                    delay = last_dispatch + self.min_dispatch_interval - timestamp
+                    if delay > 0.0:
+                        time.sleep( delay )
+                    events = self.coalesce_events( [event] + pygame.event.get() )
+                else:
+                    events = [event] + pygame.event.get()
+
+                last_dispatch = time.monotonic()
+                done = self.process_events( events, timestamp )
+                self.dispatch_pending()
             except KeyboardInterrupt:
                 done = True
 
@@ -0,0 +1,85 @@
+import threading
+
+#
+# Simple fixed-bucket histogram used to track the latency of the driver station event pipeline.
+#
+# Latencies are recorded in seconds and counted in buckets with upper bounds specified in
+# milliseconds. Percentiles are reported as the upper bound of the bucket containing the requested
+# percentile, which is accurate enough for tuning while keeping the cost of recording a sample low.
+#
+DEFAULT_BUCKETS_MS = ( 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000 )
+
+class LatencyHistogram():
+    def __init__(self, name='Latency', buckets_ms=DEFAULT_BUCKETS_MS):
+        self.name = name
+        self.buckets_ms = tuple(buckets_ms)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            # the last count is for samples larger than the largest bucket
+            self.counts = [0] * (len(self.buckets_ms) + 1)
+            self.num_samples = 0
+            self.total_ms = 0.0
+            self.max_ms = 0.0
+
+    def record(self, latency):
+        latency_ms = latency * 1000.0
+        index = 0
+        for bucket_ms in self.buckets_ms:
+            if latency_ms <= bucket_ms:
+                break
+            index += 1
+
+        with self.lock:
+            self.counts[index] += 1
+            self.num_samples += 1
+            self.total_ms += latency_ms
+            if latency_ms > self.max_ms:
+                self.max_ms = latency_ms
+
+    def get_count(self):
+        return self.num_samples
+
+    def get_mean_ms(self):
+        if self.num_samples == 0:
+            return 0.0
+        return self.total_ms / self.num_samples
+
+    def get_max_ms(self):
+        return self.max_ms
+
+    #
+    # Function returns the upper bound in milliseconds of the bucket that contains the requested
+    # percentile (0-100), limited to the maximum latency seen. Samples beyond the largest bucket are
+    # reported as the maximum latency.
+    #
+    def get_percentile_ms(self, percentile):
+        with self.lock:
+            if self.num_samples == 0:
+                return 0.0
+            threshold = self.num_samples * percentile / 100.0
+            running_count = 0
+            for index, count in enumerate(self.counts):
+                running_count += count
+                if running_count >= threshold and count > 0:
+                    if index < len(self.buckets_ms):
+                        return min( float(self.buckets_ms[index]), self.max_ms )
+                    break
+            return self.max_ms
+
+    def get_buckets(self):
+        with self.lock:
+            buckets = list()
+            for index, count in enumerate(self.counts):
+                if index < len(self.buckets_ms):
+                    buckets.append( ('<=%sms' % self.buckets_ms[index], count) )
+                else:
+                    buckets.append( ('>%sms' % self.buckets_ms[-1], count) )
+            return buckets
+
+    def __str__(self):
+        return '%s: samples=%d, mean=%.2fms, p50<=%.2fms, p99<=%.2fms, max=%.2fms' % \
+               (self.name, self.num_samples, self.get_mean_ms(), self.get_percentile_ms(50),
+                self.get_percentile_ms(99), self.max_ms)
@@ -0,0 +1,36 @@
+import unittest
+
+from input_filter import InputFilter
+from joystick_mgr import DecodedEvent
+
+#
+# Tests for the input filter stage applied to the axis events
+#
+class InputFilterTests(unittest.TestCase):
+    def axis_event(self, value):
+        return DecodedEvent( 'AXIS', 'LeftJoystickY', value )
+
+    def test_min_change_discards_held_back_value(self):
+        input_filter = InputFilter( {'default': {'quantize': 0.01, 'min_change': 0.05, 'max_rate': 10}} )
+
+        self.assertTrue( input_filter.filter_event(0, self.axis_event(0.5), now=0.0) )
+        # held back by the rate limit
+        self.assertFalse( input_filter.filter_event(0, self.axis_event(0.8), now=0.01) )
+        # back within min_change of the dispatched value, so the held back value is stale
+        self.assertFalse( input_filter.filter_event(0, self.axis_event(0.52), now=0.02) )
+
+        self.assertEqual( input_filter.flush_pending(now=0.2), [] )
+        self.assertIsNone( input_filter.next_flush_delay(now=0.2) )
+
+    def test_rate_limit_dispatches_latest_value(self):
+        input_filter = InputFilter( {'default': {'quantize': 0.01, 'min_change': 0.05, 'max_rate': 10}} )
+
+        self.assertTrue( input_filter.filter_event(0, self.axis_event(0.5), now=0.0) )
+        self.assertFalse( input_filter.filter_event(0, self.axis_event(0.8), now=0.01) )
+        self.assertFalse( input_filter.filter_event(0, self.axis_event(0.9), now=0.02) )
+
+        ready = input_filter.flush_pending( now=0.2 )
+        self.assertEqual( [ (instance_id, event.rounded_value) for instance_id, event in ready ], [ (0, 0.9) ] )
+
+if __name__ == '__main__':
+    unittest.main()
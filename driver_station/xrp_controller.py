@@ -1,18 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
+import collections
 import logging
+import random
 import socket
 import signal
+import struct
 import sys
-import threading
 import time
 
 from config import read_config
 
 from logger import logger
 
+from connection_mgr import get_connection_mgr
 from joystick_mgr import JoystickMgr
+from latency import LatencyHistogram
+from xrp_protocol import *
 
 # dictionary of all the xbox controller buttons and controls. By enabling or disabling
 # the controls, you can control how much extra traffic is sent down to the XRP.
@@ -39,127 +45,615 @@ controls = {
     'LED':            { 'type': 'CUSTOM', 'enabled': True }
 }
 
+# maximum interval between snapshot frames when the control state is unchanged. Resending
+# the state keeps the XRP from timing out the connection and stopping the robot.
+SNAPSHOT_KEEPALIVE = 1.0
+
+# UDP connections always send snapshots, as a lost datagram is simply superseded by the next one.
+# The snapshot rate used if none is configured, and the keepalive interval used to limit how long
+# the XRP acts on an old state if the datagram with a change is lost.
+UDP_SNAPSHOT_RATE = 50
+UDP_SNAPSHOT_KEEPALIVE = 0.1
+
+# connection parameters, in seconds
+CONNECT_TIMEOUT = 3.0
+NEGOTIATE_TIMEOUT = 2.0
+RECONNECT_DELAY_MIN = 0.5
+RECONNECT_DELAY_MAX = 8.0
+
+# a connection must stay up for at least this long (in seconds) before the reconnect delay is
+# reset, so that a connection that keeps dropping right after it is established still backs off
+STABLE_CONNECTION_TIME = 5.0
+
+# states of the connection to the XRP
+STATE_CONNECTING   = 'Connecting'
+STATE_CONNECTED    = 'Connected'
+STATE_BACKOFF      = 'Waiting To Reconnect'
+STATE_TERMINATED   = 'Terminated'
+
+# control types that represent a continuous position and are replayed to the XRP when the
+# connection is reestablished. Buttons are not replayed, as the XRP applications act on the
+# button press itself (e.g. toggling a setting).
+REPLAY_TYPES = ( 'AXIS', 'HAT' )
+
+#
+# Function returns the delay before the next reconnect attempt. The delay doubles with each
+# failed attempt up to the maximum, and a random jitter of up to half the delay is subtracted so
+# that controllers that lost their connections at the same time do not all reconnect together.
 #
+def get_reconnect_delay( attempt ):
+    delay = min( RECONNECT_DELAY_MIN * (2 ** attempt), RECONNECT_DELAY_MAX )
+    return delay - random.uniform( 0.0, delay / 2.0 )
+
+# interval (in seconds) between the pings sent to the XRP to measure the round trip time, and the
+# number of the most recent round trip samples kept for the link statistics
+PING_INTERVAL = 1.0
+PING_WINDOW = 20
+
 #
+# Function returns the driver station timestamp in milliseconds, as sent in the datagram headers
+# and pings
+#
+def get_timestamp_ms():
+    return int(time.monotonic() * 1000) & 0xFFFFFFFF
+
+# maximum number of frames waiting to be written to the XRP. If the XRP falls behind, the oldest
+# frames are dropped in favor of the latest.
+WRITE_QUEUE_SIZE = 64
+
+#
+# Class manages the connection to a single XRP device. The connection is serviced by a task running
+# on the event loop owned by the connection manager, which connects to the XRP, writes the queued
+# frames, and reconnects in the background if the connection is lost. Events are handed off to the
+# connection task without blocking the caller.
 #
 class XrpController():
-    def __init__(self, socket_type='UDP', host='', port=9999):
+    def __init__(self, socket_type='UDP', host='', port=9999, wire_format=WIRE_FORMAT_TEXT, snapshot_rate=0,
+                 connection_mgr=None, ping_interval=PING_INTERVAL):
 
         self.curr_values = {}
 
         self.host = host
         self.port = int(port)
-        self.socket = None
         self.socket_type = socket_type.upper()
 
+        # the wire format requested for this connection, and the format actually in use
+        # following the negotiation with the XRP
+        self.requested_wire_format = wire_format.upper()
+        self.wire_format = WIRE_FORMAT_TEXT
+
+        # The latest value of every control is saved in the control state, which is replayed to the XRP
+        # when the connection is reestablished. In snapshot mode, the full control state is sent to the
+        # XRP in a single frame at the configured rate (in Hz), instead of sending each event as it is
+        # received. Snapshot mode requires the binary wire format.
+        self.snapshot_rate = float(snapshot_rate)
+        self.snapshot_keepalive = SNAPSHOT_KEEPALIVE
+        if self.socket_type == 'UDP':
+            if self.snapshot_rate <= 0:
+                self.snapshot_rate = UDP_SNAPSHOT_RATE
+            self.snapshot_keepalive = UDP_SNAPSHOT_KEEPALIVE
+        self.control_state = [0] * len(CONTROL_IDS)
+        self.state_changed = False
+        self.state_timestamp = None
+        self.terminate = False
+
+        # histogram of the latency from the time a gamepad event is received to the time the
+        # event is written to the socket
+        self.latency = LatencyHistogram( name='XRP %s:%d Latency' % (self.host,self.port) )
+
         self.gamepad_id = None
 
-        self.initialize_client_socket()
+        # connection state, owned by the connection task
+        self.connection_state = STATE_CONNECTING
+        self.connected = False
+        self.status = 'Connecting'
+        self.reader = None
+        self.writer = None
+        self.transport = None
+        self.write_queue = None
+        self.sequence = 0
+
+        # latest telemetry received from the XRP, with the XRP timestamp of the frame and the local
+        # time it was received
+        self.telemetry = {}
+        self.telemetry_timestamp = None
+        self.telemetry_received = None
+        self.telemetry_frames = 0
+
+        # round trip time and clock offset measured by pinging the XRP. Each sample is a tuple of
+        # the round trip time and the offset of the XRP clock from the driver station clock, both
+        # in milliseconds.
+        self.ping_interval = float(ping_interval)
+        self.ping_sequence = 0
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.link_samples = collections.deque( maxlen=PING_WINDOW )
+
+        if connection_mgr is None:
+            connection_mgr = get_connection_mgr()
+        self.connection_mgr = connection_mgr
+        self.connection_task = self.connection_mgr.start_task( self.run_connection() )
 
     def shutdown(self):
         # Perform any necessary cleanup as part of shutdown
-        pass
+        self.terminate = True
+        self.connection_task.cancel()
 
     def __str__(self):
-        return 'XRP Address: %s:%d, Type: %s' % (self.host,self.port,self.socket_type)
+        return 'XRP Address: %s:%d, Type: %s, Format: %s, Status: %s' % \
+               (self.host,self.port,self.socket_type,self.wire_format,self.status)
+
+    def get_status(self):
+        return self.status
+
+    def is_connected(self):
+        return self.connected
+
+    def get_connection_state(self):
+        return self.connection_state
 
-    def initialize_client_socket(self):
-        connected = True
-        err = ''
+    def set_connection_state(self, state):
+        if state != self.connection_state:
+            logger.debug( 'Connection to %s:%d: %s -> %s' % (self.host,self.port,self.connection_state,state) )
+        self.connection_state = state
+        self.connected = (state == STATE_CONNECTED)
 
-        # create a socket based on the requested type
+    #
+    # Main connection task, implemented as a state machine:
+    #
+    #   CONNECTING -> CONNECTED  when the connection is established and the control state is replayed
+    #   CONNECTING -> BACKOFF    when the connection attempt fails
+    #   CONNECTED  -> BACKOFF    when the connection is lost
+    #   BACKOFF    -> CONNECTING when the reconnect delay has elapsed
+    #
+    # The reconnect delay grows with each consecutive failure and includes a random jitter.
+    #
+    async def run_connection(self):
+        self.write_queue = asyncio.Queue( maxsize=WRITE_QUEUE_SIZE )
+
+        snapshot_task = None
+        if self.snapshot_rate > 0:
+            snapshot_task = asyncio.create_task( self.snapshot_task() )
+        ping_task = None
+        if self.ping_interval > 0:
+            ping_task = asyncio.create_task( self.ping_task() )
+
+        attempt = 0
+        try:
+            while not self.terminate:
+                self.set_connection_state( STATE_CONNECTING )
+                if await self.connect():
+                    connected_time = time.monotonic()
+                    self.set_connection_state( STATE_CONNECTED )
+                    self.replay_control_state()
+                    await self.service_connection()
+                    self.close_connection()
+
+                    if (time.monotonic() - connected_time) >= STABLE_CONNECTION_TIME:
+                        attempt = 0
+
+                if not self.terminate:
+                    self.set_connection_state( STATE_BACKOFF )
+                    reconnect_delay = get_reconnect_delay( attempt )
+                    attempt += 1
+                    logger.info( 'Reconnecting to %s:%d in %.1f seconds' % (self.host,self.port,reconnect_delay) )
+                    await asyncio.sleep( reconnect_delay )
+        finally:
+            if snapshot_task:
+                snapshot_task.cancel()
+            if ping_task:
+                ping_task.cancel()
+            self.close_connection()
+            self.set_connection_state( STATE_TERMINATED )
+            self.status = 'Terminated'
+
+    async def connect(self):
+        self.wire_format = WIRE_FORMAT_TEXT
+
+        # create a connection based on the requested type
         if self.socket_type == 'UDP':
             logger.info( 'Creating UDP Client Connection to %s:%d' % (self.host,self.port) )
-            self.socket = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+            try:
+                loop = asyncio.get_running_loop()
+                self.transport, protocol = await loop.create_datagram_endpoint( lambda: TelemetryProtocol(self),
+                                                                                remote_addr=(self.host,self.port) )
+            except OSError:
+                logger.error( 'Error Creating UDP Connection to %s:%d' % (self.host,self.port) )
+                self.status = 'XRP Not Reachable'
+                return False
+            # UDP datagrams always carry binary frames
+            self.wire_format = WIRE_FORMAT_BINARY
         elif self.socket_type == 'TCP':
             logger.info( 'Creating TCP Client Connection to %s:%d' % (self.host,self.port) )
-            while True:
-                try:
-                    self.socket = socket.socket( socket.AF_INET, socket.SOCK_STREAM )
-                    self.socket.connect( (self.host,self.port) )
-                    logger.info( 'Client Connection Established to %s:%d' % (self.host,self.port) )
-                    break
-                except ConnectionRefusedError:
-                    logger.error( 'Error Connecting to %s:%d, Connection Refused' % (self.host,self.port) )
-                    connected = False
-                    err = 'Connection Refused'
-                    break
-                except OSError:
-                    logger.error( 'Error Connecting to %s:%d, Check if XRP is running' % (self.host,self.port) )
-                    connected = False
-                    err = 'XRP Not Reachable'
-                    break
-                except:
-                    logger.error( 'Unknown Error Connecting to %s:%d, Check if XRP is running' % (self.host,self.port) )
-                    connected = False
-                    err = 'XRP Connection Error'
-                    break
+            try:
+                self.reader, self.writer = await asyncio.wait_for( asyncio.open_connection(self.host, self.port),
+                                                                   CONNECT_TIMEOUT )
+                logger.info( 'Client Connection Established to %s:%d' % (self.host,self.port) )
+                await self.negotiate_wire_format()
+            except ConnectionRefusedError:
+                logger.error( 'Error Connecting to %s:%d, Connection Refused' % (self.host,self.port) )
+                self.status = 'Connection Refused'
+                self.close_connection()
+                return False
+            except asyncio.TimeoutError:
+                logger.error( 'Timeout Connecting to %s:%d, Check if XRP is running' % (self.host,self.port) )
+                self.status = 'XRP Not Reachable'
+                self.close_connection()
+                return False
+            except OSError:
+                logger.error( 'Error Connecting to %s:%d, Check if XRP is running' % (self.host,self.port) )
+                self.status = 'XRP Not Reachable'
+                self.close_connection()
+                return False
         else:
             logger.error( 'Unknown Socket Type: %s' % (self.socket_type) )
+            self.status = 'Unknown Socket Type'
+            self.terminate = True
+            return False
+
+        # discard anything that was queued before the connection was established, the current
+        # control state is replayed instead
+        while not self.write_queue.empty():
+            self.write_queue.get_nowait()
+
+        self.status = 'Connected'
+        return True
+
+    def close_connection(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+            self.reader = None
+        if self.transport:
+            self.transport.close()
+            self.transport = None
 
-        return connected,err
+    #
+    # Function requests the configured wire format from the XRP. Each new connection starts out using
+    # the text format, so the request is only sent if a different format has been configured. If the
+    # XRP does not acknowledge the request, the connection continues to use the text format.
+    #
+    async def negotiate_wire_format(self):
+        self.wire_format = WIRE_FORMAT_TEXT
+        if self.requested_wire_format == WIRE_FORMAT_TEXT:
+            return self.wire_format
+
+        request = protocol_command( self.requested_wire_format )
+        self.writer.write( request.encode('utf-8') )
+        await self.writer.drain()
+        try:
+            response = await asyncio.wait_for( self.reader.readline(), NEGOTIATE_TIMEOUT )
+        except asyncio.TimeoutError:
+            response = b''
+
+        if response.decode('utf-8', 'ignore') == request:
+            self.wire_format = self.requested_wire_format
+            logger.info( 'Using %s wire format for %s:%d' % (self.wire_format,self.host,self.port) )
+        else:
+            logger.info( 'XRP at %s:%d did not accept %s wire format, using %s' % \
+                         (self.host,self.port,self.requested_wire_format,self.wire_format) )
+
+        return self.wire_format
+
+    #
+    # Function services an established connection, writing the queued frames to the XRP and watching
+    # for the XRP to close the connection. Returns when the connection is lost.
+    #
+    async def service_connection(self):
+        tasks = [ asyncio.create_task(self.write_loop()) ]
+        if self.reader:
+            tasks.append( asyncio.create_task(self.read_loop()) )
 
-    def process_event( self, event ):
         try:
-            self.send_event( event )
+            done, pending = await asyncio.wait( tasks, return_when=asyncio.FIRST_COMPLETED )
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather( *tasks, return_exceptions=True )
+
+    async def write_loop(self):
+        try:
+            while True:
+                data, timestamp = await self.write_queue.get()
+                if self.writer:
+                    self.writer.write( data )
+                    self.record_latency( timestamp )
+                    await self.writer.drain()
+                elif self.transport:
+                    self.sequence += 1
+                    self.transport.sendto( encode_datagram(self.sequence, get_timestamp_ms(), data) )
+                    self.record_latency( timestamp )
         except ConnectionResetError:
             logger.error( 'Server Connection Error from %s:%d, Restablishing connection' % (self.host,self.port) )
-            self.initialize_client_socket()
         except ConnectionRefusedError:
             logger.error( 'Connection Refused Error from %s:%d, Restablishing connection' % (self.host,self.port) )
-            self.initialize_client_socket()
         except ConnectionAbortedError:
             logger.error( 'Connection Aborted Error from %s:%d, Restablishing connection' % (self.host,self.port) )
-            self.initialize_client_socket()
         except BrokenPipeError:
             logger.error( 'Client Connection Lost to %s:%d, Restablishing connection' % (self.host,self.port) )
-            self.initialize_client_socket()
         except OSError:
             logger.error( 'Unknown OS Error from %s:%d, Restablishing connection' % (self.host,self.port) )
-            self.initialize_client_socket()
+        self.status = 'Connection Lost'
+
+    #
+    # Function reads the data sent by the XRP, watching for the XRP to close the connection. Once the
+    # binary wire format is in use, the data is read as the frames sent back by the XRP.
+    #
+    async def read_loop(self):
+        try:
+            while True:
+                if self.wire_format == WIRE_FORMAT_BINARY:
+                    header = await self.reader.readexactly( 2 )
+                    frame_type, frame_size = header[0], header[1]
+                    if frame_type not in (FRAME_TELEMETRY, FRAME_PONG) or frame_size < len(header):
+                        logger.error( 'Unexpected Frame Type %d from %s:%d, Restablishing connection' % \
+                                      (frame_type,self.host,self.port) )
+                        break
+                    frame = header + await self.reader.readexactly( frame_size - len(header) )
+                    self.process_frame( frame )
+                else:
+                    line = await self.reader.readline()
+                    if not line:
+                        logger.error( 'Server Closed Connection from %s:%d, Restablishing connection' % (self.host,self.port) )
+                        break
+                    self.process_line( line )
+        except asyncio.IncompleteReadError:
+            logger.error( 'Server Closed Connection from %s:%d, Restablishing connection' % (self.host,self.port) )
+        except OSError:
+            logger.error( 'Server Connection Error from %s:%d, Restablishing connection' % (self.host,self.port) )
+        self.status = 'Connection Lost'
+
+    #
+    # Function processes a binary frame received from the XRP. This function must be called on the
+    # event loop.
+    #
+    def process_frame( self, frame ):
+        try:
+            if len(frame) >= PONG_FRAME_SIZE and frame[0] == FRAME_PONG:
+                self.process_pong( *decode_pong_frame(frame) )
+                return
+            if len(frame) < TELEMETRY_HEADER_SIZE or frame[0] != FRAME_TELEMETRY:
+                logger.debug( 'Ignoring Unexpected Frame from %s:%d' % (self.host,self.port) )
+                return
+            timestamp, values = decode_telemetry_frame( frame )
+        except struct.error:
+            logger.debug( 'Ignoring Invalid Frame from %s:%d' % (self.host,self.port) )
+            return
+
+        self.telemetry = values
+        self.telemetry_timestamp = timestamp
+        self.telemetry_received = time.monotonic()
+        self.telemetry_frames += 1
+        logger.debug( 'Telemetry from %s:%d: %s' % (self.host,self.port,str(values)) )
+
+    #
+    # Function processes a line of text received from the XRP. This function must be called on the
+    # event loop.
+    #
+    def process_line( self, line ):
+        fields = line.decode('utf-8', 'ignore').strip().split(':')
+        if len(fields) == 5 and fields[0] == PONG_COMMAND:
+            try:
+                self.process_pong( *[int(field) for field in fields[1:]] )
+            except ValueError:
+                logger.debug( 'Ignoring Invalid Pong from %s:%d' % (self.host,self.port) )
+
+    #
+    # Task that pings the XRP at the configured interval. The pings are queued behind any frames
+    # waiting to be written, so the round trip time includes the time spent in the write queue.
+    #
+    async def ping_task( self ):
+        while True:
+            await asyncio.sleep( self.ping_interval )
+            if self.connected:
+                self.ping_sequence = (self.ping_sequence + 1) & 0xFFFFFFFF
+                if self.wire_format == WIRE_FORMAT_BINARY:
+                    data = encode_ping_frame( self.ping_sequence, get_timestamp_ms() )
+                else:
+                    data = ('%s:%d:%d\n' % (PING_COMMAND, self.ping_sequence, get_timestamp_ms())).encode('utf-8')
+                self.put_data( data )
+                self.pings_sent += 1
+
+    #
+    # Function processes the reply to a ping, recording the round trip time and the offset of the
+    # XRP clock from the driver station clock. The time the XRP took to reply is subtracted from
+    # the round trip time, and the offset assumes that the delay is the same in both directions.
+    #
+    def process_pong( self, sequence, sent, received, transmitted ):
+        now = get_timestamp_ms()
+        round_trip = diff32( now, sent ) - diff32( transmitted, received )
+        offset = (diff32( received, sent ) + diff32( transmitted, now )) / 2.0
+        self.link_samples.append( (round_trip, offset) )
+        self.pongs_received += 1
+        logger.debug( 'Pong %d from %s:%d, Round Trip: %dms, Clock Offset: %.1fms' % \
+                      (sequence,self.host,self.port,round_trip,offset) )
+
+    #
+    # Function returns the statistics for the link to the XRP from the most recent pings: the
+    # round trip times (in milliseconds), and the offset of the XRP clock from the driver station
+    # clock, taken from the sample with the shortest round trip as it has the least uncertainty
+    #
+    def get_link_stats( self ):
+        stats = {}
+        stats['pings_sent'] = self.pings_sent
+        stats['pongs_received'] = self.pongs_received
+        samples = list(self.link_samples)
+        if samples:
+            round_trips = [ sample[0] for sample in samples ]
+            stats['rtt_last'] = round_trips[-1]
+            stats['rtt_mean'] = round( sum(round_trips) / len(round_trips), 1 )
+            stats['rtt_min'] = min(round_trips)
+            stats['rtt_max'] = max(round_trips)
+            stats['clock_offset'] = min(samples)[1]
+        return stats
+
+    #
+    # Function returns the latest telemetry received from the XRP, as a dictionary of the field
+    # values. The 'age' entry is the time in seconds since the telemetry was received, and the
+    # 'xrp_timestamp' entry is the XRP clock (in ms) when the values were read. An empty dictionary
+    # is returned if no telemetry has been received.
+    #
+    def get_telemetry( self ):
+        if self.telemetry_received is None:
+            return {}
+        telemetry = dict(self.telemetry)
+        telemetry['age'] = time.monotonic() - self.telemetry_received
+        telemetry['xrp_timestamp'] = self.telemetry_timestamp
+        return telemetry
+
+    #
+    # Function queues the data to be written to the XRP. This function must be called on the event
+    # loop. If the queue is full, the oldest queued frame is dropped to make room.
+    #
+    def put_data( self, data, timestamp=None ):
+        if self.write_queue.full():
+            self.write_queue.get_nowait()
+        self.write_queue.put_nowait( (data,timestamp) )
+
+    #
+    # Function hands the data off to the connection task. This function can be called from any thread
+    # and never blocks. Data is dropped if there is no connection to the XRP.
+    #
+    def queue_data( self, data, timestamp=None ):
+        if self.connected:
+            self.connection_mgr.call_soon( self.put_data, data, timestamp )
+
+    def snapshot_enabled(self):
+        return self.snapshot_rate > 0 and self.wire_format == WIRE_FORMAT_BINARY
+
+    def process_event( self, event ):
+        self.send_event( event )
 
     def send_event( self, event ):
-        command = None
-        name = event['name']
+        value = None
+        name = event.name
         try:
             control = controls[name]
             if control.get('enabled', False) == True:
                 if control['type'] == 'AXIS':
-                    # for the axis type, send the value rounded to the nearest 2 decimal points
-                    value = event['rounded_value']
-                    if self.curr_values.get(name, 0.0) != value:
+                    # for the axis type, send the value produced by the input filter stage
+                    if self.curr_values.get(name, 0.0) != event.rounded_value:
                         # only send the command if the value has changed
+                        value = event.rounded_value
                         self.curr_values[name] = value
-                        command = '%s:%s:%f' % ('Event',name, value) 
                         logger.debug( 'Axis Type: %s, Value: %f' % (name,value) )
                 elif control['type'] == 'BUTTON':
                     # for the button type, send the value reported by the button (1:PRESSED or 0:RELEASED)
-                    value = event['value']
-                    command = '%s:%s:%d' % ('Event',name, value) 
+                    value = event.value
                     logger.debug( 'Button Type: %s, Value: %d' % (name,value) )
                 elif control['type'] == 'HAT':
                     # for the hat type, send the value as an integer value
-                    value = event['value']
-                    command = '%s:%s:%d' % ('Event',name, value) 
+                    value = event.value
                     logger.debug( 'Hat Type: %s, Value: %d' % (name,value) )
                 elif control['type'] == 'CUSTOM':
-                    value = event['value']
-                    command = '%s:%s:%s' % ('Event',name, value) 
+                    value = event.value
                     logger.debug( 'Custom Event Type: %s, Value: %s' % (name,value) )
                 else:
                     logger.error( 'Unknown Event Type: %s' % name )
 
-                if command:
-                    logger.debug( 'Sending: %s' % command )
-                    command += '\n'
-                    if self.socket_type == 'TCP':
-                        self.socket.sendall( command.encode('utf-8') )
-                    elif self.socket_type == 'UDP':
-                        self.socket.sendto( command.encode('utf-8'), (self.host,self.port) )
+                if value is not None:
+                    # save the latest value in the control state, which will be sent with the next snapshot
+                    # in snapshot mode, and is replayed to the XRP following a reconnect
+                    self.update_control_state( name, value, event.timestamp )
+
+                    if not self.snapshot_enabled():
+                        data = self.encode_event( name, value )
+                        if data:
+                            self.queue_data( data, event.timestamp )
 
         except KeyError:
             pass
 
+    #
+    # Function encodes the control event in the wire format in use for the connection
+    #
+    def encode_event( self, name, value ):
+        if self.wire_format == WIRE_FORMAT_BINARY:
+            return self.encode_binary_event( name, value )
+
+        control_type = controls[name]['type']
+        if control_type == 'AXIS':
+            command = '%s:%s:%f' % ('Event',name, value)
+        elif control_type == 'CUSTOM':
+            command = '%s:%s:%s' % ('Event',name, value)
+        else:
+            command = '%s:%s:%d' % ('Event',name, value)
+        logger.debug( 'Sending: %s' % command )
+        command += '\n'
+        return command.encode('utf-8')
+
+    #
+    # Function replays the last known control state to the XRP after the connection has been
+    # (re)established, so that the XRP immediately reflects the current position of the controls.
+    # In snapshot mode, the full state is simply sent with the next snapshot. Otherwise, an event is
+    # sent for each enabled axis and hat control. This function must be called on the event loop.
+    #
+    def replay_control_state( self ):
+        if self.snapshot_enabled():
+            self.state_changed = True
+            return
+
+        for control_id, fixed in enumerate(self.control_state):
+            name = CONTROL_IDS[control_id]
+            control = controls.get( name, None )
+            if control and control.get('enabled', False) == True and control['type'] in REPLAY_TYPES:
+                data = self.encode_event( name, from_fixed(fixed) )
+                if data:
+                    self.put_data( data )
+
+    #
+    # Function encodes the event as a binary event frame. Only numeric values can be carried in the
+    # binary frames, so any other custom event values are dropped.
+    #
+    def encode_binary_event( self, name, value ):
+        try:
+            return encode_event_frame( name, value )
+        except (TypeError, ValueError):
+            logger.error( 'Unable to send non-numeric value for %s in binary format: %s' % (name,value) )
+            return None
+
+    def record_latency( self, timestamp ):
+        if timestamp is not None:
+            self.latency.record( time.monotonic() - timestamp )
+
+    def get_latency_histogram( self ):
+        return self.latency
+
+    def update_control_state( self, name, value, timestamp=None ):
+        control_id = CONTROL_ID_MAP.get( name, None )
+        if control_id is None:
+            return
+        try:
+            fixed = to_fixed( value )
+        except (TypeError, ValueError):
+            # only numeric values are saved in the control state
+            return
+        if self.control_state[control_id] != fixed:
+            self.control_state[control_id] = fixed
+            # the latency of a snapshot is measured from the oldest change not yet sent
+            if not self.state_changed:
+                self.state_timestamp = timestamp
+            self.state_changed = True
+
+    #
+    # Task that sends the control state to the XRP at the configured snapshot rate. A snapshot is only
+    # sent when the state has changed, or when the keepalive interval has elapsed.
+    #
+    async def snapshot_task( self ):
+        period = 1.0 / self.snapshot_rate
+        last_sent = 0.0
+        logger.info( 'Sending control state snapshots to %s:%d at %.1f Hz' % (self.host,self.port,self.snapshot_rate) )
+        while True:
+            start = time.monotonic()
+            if self.connected and self.snapshot_enabled():
+                if self.state_changed or (start - last_sent) >= self.snapshot_keepalive:
+                    self.state_changed = False
+                    timestamp = self.state_timestamp
+                    self.state_timestamp = None
+                    self.put_data( encode_snapshot_frame(self.control_state), timestamp )
+                    last_sent = start
+            await asyncio.sleep( max(0.0, period - (time.monotonic() - start)) )
+
     def set_gamepad_id( self, gamepad_id ):
         self.gamepad_id = gamepad_id
 
@@ -169,6 +663,17 @@ class XrpController():
     def clear_gamepad_id(self):
         self.gamepad_id = None
 
+#
+# Datagram protocol for the UDP connection to the XRP, which passes the telemetry frames sent back
+# by the XRP to the controller
+#
+class TelemetryProtocol( asyncio.DatagramProtocol ):
+    def __init__( self, controller ):
+        self.controller = controller
+
+    def datagram_received( self, data, addr ):
+        self.controller.process_frame( data )
+
 def joystick_callback( event_type, gamepad_id ):
     if event_type == 'CONNECTED':
         if xrp_controllers:
@@ -186,6 +691,7 @@ def shutdown_all():
     logger.info( 'Terminating XRP controller service' )
     if xrp_controllers:
         for controller in xrp_controllers:
+            logger.info( str(controller.get_latency_histogram()) )
             controller.shutdown()
         time.sleep(2)
 
@@ -204,6 +710,8 @@ if __name__ == '__main__':
     parser.add_argument('-p', '--port', action='store', dest='xrp_port', default='9999')
     parser.add_argument('-s', '--socket', action='store', dest='socket_type', default=None)
     parser.add_argument('-x', '--xrp', action='store', dest='xrp_ipaddr', default=None)
+    parser.add_argument('-w', '--wire_format', action='store', dest='wire_format', default=None)
+    parser.add_argument('-r', '--snapshot_rate', action='store', dest='snapshot_rate', default=None)
     options = parser.parse_args()
 
     #
@@ -223,6 +731,18 @@ if __name__ == '__main__':
     else:
         socket_type = config.get('socket_type', 'TCP').upper()
 
+    # override the wire format setting if specified at the command line
+    if options.wire_format:
+        wire_format = options.wire_format.upper()
+    else:
+        wire_format = config.get('wire_format', WIRE_FORMAT_TEXT).upper()
+
+    # override the snapshot rate setting if specified at the command line
+    if options.snapshot_rate:
+        snapshot_rate = float(options.snapshot_rate)
+    else:
+        snapshot_rate = float(config.get('snapshot_rate', 0))
+
     # if one or more XRPs are specified at the command line, use them instead of the configured
     # devices. Multiple XRPs can be specified as a comma-separated list
     xrp_devices = list()
@@ -246,7 +766,9 @@ if __name__ == '__main__':
     xrp_controllers = list()
 
     # initialize the joystick manager instance, binding each joystick to an XRP instance
-    joystick_mgr = JoystickMgr()
+    joystick_mgr = JoystickMgr(max_dispatch_rate=config.get('max_dispatch_rate', 0),
+                               input_filters=config.get('input_filters', None),
+                               debug_events=config.get('debug_events', False))
 
     #
     # retrieve the list of joystick devices that are connected to this controller and 
@@ -264,7 +786,8 @@ if __name__ == '__main__':
 
             # Create the XRP controller instance to service this XRP device
             logger.debug( 'Creating XRP instance %s, Type: %s, Host: %s' % (xrp_config.get('name','Unknown'), socket_type, xrp_ipaddr) )
-            controller = XrpController(socket_type=socket_type, host=xrp_ipaddr, port=xrp_port)
+            controller = XrpController(socket_type=socket_type, host=xrp_ipaddr, port=xrp_port, wire_format=wire_format,
+                                       snapshot_rate=snapshot_rate, ping_interval=config.get('ping_interval', PING_INTERVAL))
             xrp_controllers.append( controller )
 
             # Bind the XRP controller to the joystick instance. All events received from that joystick will be handled by the
@@ -134,3 +134,17 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Time (in seconds) that a device can go without reporting its status before the scheduled status
+# check marks it as unknown, keyed by the device type (e.g. 'XRP' or 'DriverStation'). The 'default'
+# timeout is used for the device types that are not listed.
+DEVICE_STATUS_TIMEOUTS = {
+    'default': 300,
+}
+
+# The FMS serves the device registry from memory, and writes the status reported by the devices to
+# the database in batches every DEVICE_CACHE_FLUSH_INTERVAL seconds (0 writes each status report
+# immediately). The cached registry is reloaded from the database every DEVICE_CACHE_MAX_AGE
+# seconds, to pick up the changes made by other processes such as the scheduled status check.
+DEVICE_CACHE_FLUSH_INTERVAL = 5
+DEVICE_CACHE_MAX_AGE = 60
@@ -12,7 +12,9 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fms.settings")
 
 django.setup()
 
-from xrp_registry.models import Device
+from django.conf import settings
+
+from xrp_registry.utils import mark_unreported_devices
 from xrp_registry.logger import logger
 
 class SafeScheduler(Scheduler):
@@ -43,20 +45,19 @@ class SafeScheduler(Scheduler):
             job._schedule_next_run()
 
 
+#
+# Function marks the devices that have stopped reporting their status as unknown, using the status
+# timeout configured for each device type
+#
 def check_device_status():
     logger.info( 'Checking Device Reported Status' )
-    devices = Device.objects.all()
-    curr_time = int(time.time())
 
-    for device in devices: 
-        since_reported = curr_time - device.last_timestamp
-        if since_reported > 300 and device.state != 'unknown':
-            logger.info( 'Marking device status to unknown for device: %s' % device.hardware_id )
-            device.state = 'unknown'
-            device.save()
+    timeouts = getattr( settings, 'DEVICE_STATUS_TIMEOUTS', {} )
+    for hardware_id in mark_unreported_devices( timeouts ):
+        logger.info( 'Marking device status to unknown for device: %s' % hardware_id )
 
     logger.info( 'Device Status Check Complete.' )
-            
+
 if __name__ == '__main__':
 
     # 
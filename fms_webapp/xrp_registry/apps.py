@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class XrpRegistryConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'xrp_registry'
+
+    def ready(self):
+        # connect the signals that keep the registry cache up to date
+        from . import registry_cache
@@ -10,6 +10,7 @@ class Device(models.Model):
 
     PROTOCOLS = [
         ('tcp', 'TCP'),
+        ('udp', 'UDP'),
         ('bluetooth', 'BLUETOOTH'),
     ]
 
@@ -19,7 +20,7 @@ class Device(models.Model):
         ('blue', 'BLUE')
     ]
 
-    hardware_id    = models.CharField(max_length = 36, blank=False, default='Unassigned')
+    hardware_id    = models.CharField(max_length = 36, blank=False, default='Unassigned', unique=True)
     state          = models.CharField(max_length = 32, choices=STATES, blank=False, default='UNKNOWN')
     type           = models.CharField(max_length = 32, blank=False, default='Unknown')
     ip_address     = models.CharField(max_length = 32, blank=False, default='Unassigned')
@@ -34,6 +35,16 @@ class Device(models.Model):
     alliance       = models.CharField(max_length = 32, choices=ALLIANCES, blank=True, default='ANY')
     ble_service    = models.CharField(max_length = 32, blank=True, default='Unknown')
 
+    class Meta:
+        # the driver stations poll the registry for the devices of a type in their alliance, and the
+        # status check looks for the devices in each state that have stopped reporting, either of a
+        # type with its own status timeout or of any other type
+        indexes = [
+            models.Index(fields=['type', 'alliance'], name='device_type_alliance_idx'),
+            models.Index(fields=['state', 'last_timestamp'], name='device_state_reported_idx'),
+            models.Index(fields=['type', 'state', 'last_timestamp'], name='device_type_reported_idx'),
+        ]
+
     def __str__(self):
         return self.hardware_id
 
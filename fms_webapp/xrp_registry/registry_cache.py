@@ -0,0 +1,311 @@
+import atexit
+import collections
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Device
+from .logger import logger
+
+#
+# In-memory cache of the device registry.
+#
+# Every XRP and driver station reports its status to the FMS every 15 seconds, and every driver
+# station polls the registry for its XRPs every 10 seconds. Rather than reading and writing the
+# database for each of those requests, the FMS serves the device lists and configurations from
+# this cache, and the status reported by the devices is applied to the cached devices and written
+# to the database in batches (write-behind). Each batch is written in a single transaction, so the
+# database is committed to the SD card of the FMS once per flush interval rather than once per
+# status report.
+#
+# The pending status is flushed before any write that changes the configuration of a device, and
+# the cached device is then refreshed from the database. Devices saved or deleted through the ORM
+# (e.g. from the admin site or the devices API) are updated in the cache by the model signals. The
+# whole registry is reloaded after DEVICE_CACHE_MAX_AGE seconds to pick up changes made by other
+# processes, such as the scheduled status check.
+#
+# The status reported within the last flush interval is lost if the FMS is killed, which only
+# delays the timestamps seen by the scheduled status check. The pending status is flushed when the
+# FMS exits normally.
+#
+# Each change to the fields of a device that the driver stations use to connect to it (its feed
+# data) is numbered with a revision and kept in a change log, which is used to stream the changes
+# to the driver stations. The revisions start from the time the cache is created, so that the
+# revisions seen by a driver station before the FMS restarts are older than any in the change log.
+#
+
+# default time (in seconds) between the writes of the pending status to the database
+DEFAULT_FLUSH_INTERVAL = 5.0
+
+# default time (in seconds) after which the cached registry is reloaded from the database
+DEFAULT_MAX_AGE = 60.0
+
+# fields of each device sent in the change feed, which excludes the status reported by the device
+# so that the status reports alone do not create changes
+FEED_FIELDS = ( 'id', 'hardware_id', 'type', 'name', 'ip_address', 'port', 'protocol', 'state', 'alliance' )
+
+# number of changes kept in the change log
+FEED_HISTORY = 256
+
+#
+# Function returns the feed data of a device, or None for no device
+#
+def get_feed_data( device ):
+    if device is None:
+        return None
+    return { key: getattr(device, key) for key in FEED_FIELDS }
+
+class DeviceRegistryCache():
+    def __init__(self):
+        # the registry is accessed from the request threads of the FMS and the flush timer, and
+        # the change feeds wait on the condition for new changes
+        self.lock = threading.RLock()
+        self.changed = threading.Condition( self.lock )
+        self.devices = {}
+        self.loaded_time = None
+        # the fields reported by each device that have not been written to the database yet
+        self.pending = {}
+        self.flush_timer = None
+        self.flushes = 0
+        # log of the changes as (revision, hardware ID, previous feed data, new feed data)
+        self.revision = int(time.time() * 1000)
+        self.changes = collections.deque( maxlen=FEED_HISTORY )
+
+    def get_flush_interval(self):
+        return getattr( settings, 'DEVICE_CACHE_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL )
+
+    def get_max_age(self):
+        return getattr( settings, 'DEVICE_CACHE_MAX_AGE', DEFAULT_MAX_AGE )
+
+    #
+    # Function loads the registry from the database, if it has not been loaded yet or the cached
+    # registry has expired. The pending status is applied to the loaded devices.
+    #
+    def load(self):
+        with self.lock:
+            curr_time = time.monotonic()
+            if self.loaded_time is not None and curr_time - self.loaded_time < self.get_max_age():
+                return
+
+            logger.debug( 'Loading Device Registry' )
+            previous = self.devices
+            self.devices = {}
+            for device in Device.objects.order_by('id'):
+                self.apply_pending( device )
+                self.devices[device.hardware_id] = device
+
+            # record the changes made by other processes since the registry was last loaded
+            if self.loaded_time is not None:
+                for hardware_id in set(previous) | set(self.devices):
+                    self.record_change( hardware_id, previous.get(hardware_id, None), self.devices.get(hardware_id, None) )
+            self.loaded_time = curr_time
+
+    def apply_pending(self, device):
+        for key, value in self.pending.get( device.hardware_id, {} ).items():
+            setattr( device, key, value )
+
+    #
+    # Function returns the cached devices, optionally filtered by hardware ID, device type and
+    # alliance, with the alliance 'any' matching all alliances
+    #
+    def get_devices(self, hardware_id=None, device_type=None, alliance=None):
+        with self.lock:
+            self.load()
+            if hardware_id is not None:
+                device = self.devices.get( hardware_id, None )
+                devices = [ device ] if device else []
+            else:
+                devices = list( self.devices.values() )
+
+        if device_type is not None:
+            devices = [ device for device in devices if device.type == device_type ]
+        if alliance is not None and alliance.lower() != 'any':
+            devices = [ device for device in devices if device.alliance == alliance ]
+        return devices
+
+    def get_device(self, hardware_id):
+        with self.lock:
+            self.load()
+            return self.devices.get( hardware_id, None )
+
+    #
+    # Function replaces the cached device, or removes it if device is None, and records the change
+    #
+    def set_device(self, hardware_id, device):
+        with self.lock:
+            previous = self.devices.get( hardware_id, None )
+            if device is None:
+                self.devices.pop( hardware_id, None )
+            else:
+                self.apply_pending( device )
+                self.devices[hardware_id] = device
+            self.record_change( hardware_id, previous, device )
+
+    def record_change(self, hardware_id, previous, device):
+        previous_data = previous if isinstance(previous, dict) else get_feed_data( previous )
+        data = get_feed_data( device )
+        if data != previous_data:
+            self.revision += 1
+            self.changes.append( (self.revision, hardware_id, previous_data, data) )
+            self.changed.notify_all()
+
+    #
+    # Function returns the current revision and the feed data of the cached devices, filtered by
+    # device type and alliance
+    #
+    def get_snapshot(self, device_type=None, alliance=None):
+        with self.lock:
+            devices = self.get_devices( device_type=device_type, alliance=alliance )
+            return self.revision, [ get_feed_data(device) for device in devices ]
+
+    #
+    # Function returns the changes made after the revision, or None if the changes are no longer
+    # in the change log (or the revision is from before the FMS restarted)
+    #
+    def get_changes(self, revision):
+        with self.lock:
+            if revision > self.revision:
+                return None
+            if revision == self.revision:
+                return []
+            if not self.changes or revision < self.changes[0][0] - 1:
+                return None
+            return [ change for change in self.changes if change[0] > revision ]
+
+    #
+    # Function waits up to the timeout for changes after the revision, and returns the changes as
+    # for get_changes()
+    #
+    def wait_for_changes(self, revision, timeout):
+        with self.changed:
+            # reload the registry if it has expired, to pick up the changes made by other processes
+            self.load()
+            if revision == self.revision:
+                self.changed.wait( timeout )
+            return self.get_changes( revision )
+
+    #
+    # Function applies the status reported by a device to the cached device, and queues it to be
+    # written to the database. Returns False if the device is not in the registry.
+    #
+    def update_status(self, hardware_id, fields):
+        with self.lock:
+            self.load()
+            device = self.devices.get( hardware_id, None )
+            if device is None:
+                # the device may have been added by another process since the registry was loaded
+                self.refresh( hardware_id )
+                device = self.devices.get( hardware_id, None )
+                if device is None:
+                    return False
+
+            previous_data = get_feed_data( device )
+            for key, value in fields.items():
+                setattr( device, key, value )
+            self.pending.setdefault( hardware_id, {} ).update( fields )
+            self.record_change( hardware_id, previous_data, device )
+
+            flush_interval = self.get_flush_interval()
+            if flush_interval <= 0:
+                self.flush()
+            elif self.flush_timer is None:
+                self.flush_timer = threading.Timer( flush_interval, self.flush_from_timer )
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+        return True
+
+    #
+    # Function writes the pending status of all the devices to the database in a single
+    # transaction. Returns the number of devices written.
+    #
+    def flush(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            if not self.pending:
+                return 0
+
+            pending = self.pending
+            self.pending = {}
+            try:
+                with transaction.atomic():
+                    for hardware_id, fields in pending.items():
+                        Device.objects.filter(hardware_id=hardware_id).update(**fields)
+            except Exception:
+                # keep the status to be written with the next flush, unless a newer status has
+                # been reported in the meantime
+                for hardware_id, fields in pending.items():
+                    fields.update( self.pending.get(hardware_id, {}) )
+                    self.pending[hardware_id] = fields
+                raise
+
+            self.flushes += 1
+            logger.debug( 'Flushed Status For %d Devices' % len(pending) )
+            return len(pending)
+
+    def flush_from_timer(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error( 'Error Flushing Device Status: %s' % str(e) )
+        finally:
+            # the timer thread has its own database connection, which is closed when it finishes
+            connection.close()
+
+    #
+    # Function reloads a single device from the database after it has been written directly
+    #
+    def refresh(self, hardware_id):
+        with self.lock:
+            if self.loaded_time is None:
+                return
+            self.set_device( hardware_id, Device.objects.filter(hardware_id=hardware_id).first() )
+
+    def device_saved(self, device):
+        with self.lock:
+            if self.loaded_time is None:
+                return
+            self.set_device( device.hardware_id, device )
+
+    def device_deleted(self, device):
+        with self.lock:
+            self.pending.pop( device.hardware_id, None )
+            if self.loaded_time is None:
+                return
+            self.set_device( device.hardware_id, None )
+
+    #
+    # Function discards the cached registry and the pending status, without writing it
+    #
+    def clear(self):
+        with self.lock:
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+            self.devices = {}
+            self.loaded_time = None
+            self.pending = {}
+            self.revision = int(time.time() * 1000)
+            self.changes.clear()
+
+registry_cache = DeviceRegistryCache()
+
+@receiver(post_save, sender=Device)
+def device_saved(sender, instance, **kwargs):
+    registry_cache.device_saved( instance )
+
+@receiver(post_delete, sender=Device)
+def device_deleted(sender, instance, **kwargs):
+    registry_cache.device_deleted( instance )
+
+@atexit.register
+def flush_registry_cache():
+    try:
+        registry_cache.flush()
+    except Exception as e:
+        logger.error( 'Error Flushing Device Status: %s' % str(e) )
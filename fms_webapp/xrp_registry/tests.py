@@ -1,3 +1,267 @@
-from django.test import TestCase
+import json
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from .models import Device
+from .registry_cache import registry_cache
+from .utils import mark_unreported_devices, device_feed
+
+#
+# Tests for the database access made by the FMS endpoints. Every driver station and XRP polls or
+# reports to the FMS every few seconds, so each endpoint is checked for the number of queries that
+# it makes, and the query plan of each query is checked to make sure that it finds the devices
+# with an index rather than scanning the whole registry.
+#
+# The device lists, configurations and status reports are served from the registry cache once it
+# has been loaded, so those endpoints are checked to make no queries at all, and the status is
+# checked to be written in batches when the cache is flushed.
+#
+# The query plans are read with EXPLAIN QUERY PLAN, so these tests require the SQLite database
+# used by the FMS.
+#
+@override_settings(DEVICE_CACHE_FLUSH_INTERVAL=60, DEVICE_CACHE_MAX_AGE=60)
+class DeviceQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # enough devices across the types and alliances that a scan would be noticeable
+        for index in range(40):
+            Device.objects.create( hardware_id='xrp-%04d' % index, type='XRP', name='XRP-%d' % index,
+                                   alliance=('red', 'blue')[index % 2], state='running' )
+        for index in range(4):
+            Device.objects.create( hardware_id='ds-%04d' % index, type='DriverStation', alliance='any',
+                                   state='running' )
+
+    def setUp(self):
+        registry_cache.clear()
+        registry_cache.load()
+
+    def tearDown(self):
+        registry_cache.clear()
+
+    #
+    # Function returns the query plan for each of the captured queries
+    #
+    def get_query_plans(self, queries):
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if sql in ('BEGIN', 'COMMIT') or sql.startswith('SAVEPOINT') or sql.startswith('RELEASE'):
+                    continue
+                cursor.execute( 'EXPLAIN QUERY PLAN %s' % sql )
+                plans.append( (sql, ' '.join([ str(row[-1]) for row in cursor.fetchall() ])) )
+        return plans
+
+    def assertUsesIndex(self, queries, index_name=None):
+        plans = self.get_query_plans( queries )
+        self.assertTrue( plans )
+        for sql, plan in plans:
+            self.assertIn( 'USING', plan, 'Query does not use an index: %s\n%s' % (sql, plan) )
+            self.assertNotIn( 'SCAN xrp_registry_device', plan, 'Query scans the registry: %s\n%s' % (sql, plan) )
+            if index_name:
+                self.assertIn( index_name, plan, 'Query does not use %s: %s\n%s' % (index_name, sql, plan) )
+
+    def get(self, path, num_queries, **extra):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get( path, **extra )
+        self.assertEqual( len(queries), num_queries, [ query['sql'] for query in queries ] )
+        return response, queries
+
+    def post(self, path, data, num_queries):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post( path, json.dumps(data), content_type='application/json' )
+        self.assertEqual( len(queries), num_queries, [ query['sql'] for query in queries ] )
+        return response, queries
+
+    def test_load_registry(self):
+        registry_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            registry_cache.load()
+        self.assertEqual( len(queries), 1 )
+        self.assertEqual( len(registry_cache.get_devices()), 44 )
+
+    def test_devices_by_type_and_alliance(self):
+        response, queries = self.get( '/api/devices/?type=XRP&alliance=red', 0 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( len(response.json()), 20 )
+        self.assertTrue( all([ device['alliance'] == 'red' for device in response.json() ]) )
+
+    def test_devices_by_type(self):
+        response, queries = self.get( '/api/devices/?type=XRP&alliance=any', 0 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( len(response.json()), 40 )
+
+    def test_devices_by_hardware_id(self):
+        response, queries = self.get( '/api/devices/?id=xrp-0007', 0 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( response.json()[0]['name'], 'XRP-7' )
+        self.assertTrue( response.json()[0]['url'].endswith('/api/devices/%d/' % response.json()[0]['id']) )
+
+    def test_device_config(self):
+        response, queries = self.get( '/config/?id=xrp-0007', 0 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( response.json()['name'], 'XRP-7' )
+
+        response, queries = self.get( '/config/?id=xrp-0007', 0, HTTP_IF_NONE_MATCH=response['ETag'] )
+        self.assertEqual( response.status_code, 304 )
+
+    def test_status(self):
+        response, queries = self.post( '/status/', {'hardware_id': 'xrp-0007', 'status': 'Driving'}, 0 )
+        self.assertEqual( response.status_code, 200 )
+
+        # the status is served from the cache before it is written to the database
+        response, queries = self.get( '/api/devices/?id=xrp-0007', 0 )
+        self.assertEqual( response.json()[0]['status'], 'Driving' )
+        self.assertEqual( Device.objects.get(hardware_id='xrp-0007').status, 'Unknown' )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual( registry_cache.flush(), 1 )
+        self.assertEqual( Device.objects.get(hardware_id='xrp-0007').status, 'Driving' )
+        self.assertUsesIndex( queries )
+
+    def test_status_batch(self):
+        # the status reports of all the devices are written in a single transaction, with the
+        # latest status of each device
+        for repeat in range(3):
+            for index in range(10):
+                self.post( '/status/', {'hardware_id': 'xrp-%04d' % index, 'status': 'Report %d' % repeat}, 0 )
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual( registry_cache.flush(), 10 )
+        statements = [ query['sql'] for query in queries ]
+        self.assertEqual( len([ sql for sql in statements if sql.startswith('UPDATE') ]), 10, statements )
+        self.assertEqual( len([ sql for sql in statements if sql.startswith('SAVEPOINT') ]), 1, statements )
+        self.assertEqual( Device.objects.filter(status='Report 2').count(), 10 )
+
+    def test_status_unknown_device(self):
+        response, queries = self.post( '/status/', {'hardware_id': 'xrp-missing', 'status': 'Driving'}, 1 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( registry_cache.flush(), 0 )
+
+    def test_register_existing_device(self):
+        # the pending status is written before the registration, which then refreshes the cache
+        self.post( '/status/', {'hardware_id': 'xrp-0007', 'status': 'Driving'}, 0 )
+        registration = {'hardware_id': 'xrp-0007', 'type': 'XRP', 'ip_address': '10.0.0.7', 'status': 'Initialized'}
+        response, queries = self.post( '/register/', registration, 5 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( Device.objects.get(hardware_id='xrp-0007').ip_address, '10.0.0.7' )
+        self.assertEqual( registry_cache.get_device('xrp-0007').ip_address, '10.0.0.7' )
+        self.assertEqual( registry_cache.get_device('xrp-0007').status, 'Initialized' )
+        self.assertUsesIndex( queries )
+
+    def test_register_new_device(self):
+        registration = {'hardware_id': 'xrp-new', 'type': 'XRP', 'ip_address': '10.0.0.99'}
+        response, queries = self.post( '/register/', registration, 4 )
+        self.assertEqual( response.status_code, 200 )
+        self.assertEqual( Device.objects.filter(hardware_id='xrp-new').count(), 1 )
+        self.assertEqual( registry_cache.get_device('xrp-new').ip_address, '10.0.0.99' )
+
+    def test_delete_device(self):
+        self.post( '/status/', {'hardware_id': 'xrp-0007', 'status': 'Driving'}, 0 )
+        self.client.delete( '/register/', json.dumps({'hardware_id': 'xrp-0007'}), content_type='application/json' )
+        self.assertIsNone( registry_cache.get_device('xrp-0007') )
+        self.assertEqual( registry_cache.flush(), 0 )
+
+    def test_unreported_devices(self):
+        queryset = Device.objects.filter( state='running', last_timestamp__lt=1000 )
+        self.assertIn( 'device_state_reported_idx', queryset.explain() )
+
+    def test_mark_unreported_devices(self):
+        # the even numbered XRPs last reported at 1000 and the others are still reporting
+        Device.objects.update( last_timestamp=1100 )
+        Device.objects.filter( hardware_id__in=[ 'xrp-%04d' % index for index in range(0, 40, 2) ] ).update( last_timestamp=1000 )
+        Device.objects.filter( hardware_id='ds-0000' ).update( last_timestamp=1000 )
+
+        # the XRPs time out before the driver stations, so only the stale XRPs are marked
+        timeouts = {'default': 300, 'XRP': 60}
+        with CaptureQueriesContext(connection) as queries:
+            marked = mark_unreported_devices( timeouts, curr_time=1120 )
+        self.assertEqual( sorted(marked), [ 'xrp-%04d' % index for index in range(0, 40, 2) ] )
+        self.assertEqual( Device.objects.filter(state='unknown').count(), 20 )
+        # both the sweep of the XRPs and of the other types find the stale devices from the time
+        # they last reported
+        self.assertUsesIndex( queries, '_reported_idx' )
+
+        # each timeout is a read of the stale IDs and a single UPDATE, and the devices already
+        # marked are not marked again
+        with CaptureQueriesContext(connection) as queries:
+            marked = mark_unreported_devices( timeouts, curr_time=1400 )
+        self.assertEqual( sorted(marked), [ 'ds-0000' ] + [ 'xrp-%04d' % index for index in range(1, 40, 2) ] )
+        statements = [ query['sql'] for query in queries if query['sql'].startswith(('SELECT', 'UPDATE')) ]
+        self.assertEqual( len(statements), 4, statements )
+        self.assertEqual( Device.objects.exclude(state='unknown').count(), 3 )
+
+
+#
+# Tests for the device change feed streamed to the driver stations
+#
+@override_settings(DEVICE_CACHE_FLUSH_INTERVAL=60, DEVICE_CACHE_MAX_AGE=60)
+class DeviceFeedTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for index in range(4):
+            Device.objects.create( hardware_id='xrp-%04d' % index, type='XRP', name='XRP-%d' % index,
+                                   alliance=('red', 'blue')[index % 2], ip_address='10.0.0.%d' % index,
+                                   state='running' )
+
+    def setUp(self):
+        registry_cache.clear()
+        registry_cache.load()
+
+    def tearDown(self):
+        registry_cache.clear()
+
+    def update(self, hardware_id, **config):
+        config.update( {'hardware_id': hardware_id, 'type': 'XRP', 'port': '9999', 'protocol': 'tcp'} )
+        self.client.post( '/update/', json.dumps(config), content_type='application/json' )
+
+    def parse_event(self, text):
+        fields = dict( [ line.split(': ', 1) for line in text.strip().split('\n') ] )
+        return int(fields['id']), fields['event'], json.loads(fields['data'])
+
+    def test_snapshot(self):
+        response = self.client.get( '/feed/?type=XRP&alliance=red' )
+        self.assertEqual( response['Content-Type'], 'text/event-stream' )
+        revision, event, data = self.parse_event( next(response.streaming_content).decode('utf-8') )
+        response.close()
+        self.assertEqual( event, 'snapshot' )
+        self.assertEqual( revision, registry_cache.revision )
+        self.assertEqual( [ device['hardware_id'] for device in data['devices'] ], [ 'xrp-0000', 'xrp-0002' ] )
+
+    def test_changes(self):
+        feed = device_feed( device_type='XRP', alliance='red', keepalive=0 )
+        revision, event, data = self.parse_event( next(feed) )
+
+        # a device moving into the alliance is added, and moving out of the alliance is removed
+        self.update( 'xrp-0001', ip_address='10.0.0.1', alliance='red' )
+        self.update( 'xrp-0000', ip_address='10.0.1.0', alliance='red' )
+        self.update( 'xrp-0002', ip_address='10.0.0.2', alliance='blue' )
+        events = [ self.parse_event(next(feed)) for index in range(3) ]
+        self.assertEqual( [ event for revision, event, data in events ], [ 'add', 'update', 'remove' ] )
+        self.assertEqual( events[1][2]['ip_address'], '10.0.1.0' )
+        self.assertEqual( events[2][2], {'hardware_id': 'xrp-0002'} )
+        self.assertEqual( [ revision for revision, event, data in events ],
+                          [ revision + 1, revision + 2, revision + 3 ] )
+
+        # the status reports do not change the feed data, and devices in other alliances are not sent
+        self.client.post( '/status/', json.dumps({'hardware_id': 'xrp-0000', 'status': 'Driving'}),
+                          content_type='application/json' )
+        self.update( 'xrp-0003', ip_address='10.0.1.3', alliance='blue' )
+        self.assertEqual( next(feed), ': keepalive\n\n' )
+
+    def test_resume(self):
+        revision = registry_cache.revision
+        self.update( 'xrp-0000', ip_address='10.0.1.0', alliance='red' )
+
+        # a subscriber that reconnects only receives the changes since its last event
+        feed = device_feed( device_type='XRP', alliance='red', revision=revision, keepalive=0 )
+        self.assertEqual( self.parse_event(next(feed))[1], 'update' )
+
+        # a revision that is no longer in the change log, or from before the FMS restarted,
+        # starts with a snapshot
+        feed = device_feed( device_type='XRP', alliance='red', revision=revision - 1000, keepalive=0 )
+        self.assertEqual( self.parse_event(next(feed))[1], 'snapshot' )
+        feed = device_feed( device_type='XRP', alliance='red', revision=revision + 1000, keepalive=0 )
+        self.assertEqual( self.parse_event(next(feed))[1], 'snapshot' )
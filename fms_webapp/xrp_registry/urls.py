@@ -15,5 +15,7 @@ urlpatterns = [
     re_path(r'^register/', views.register, name='register'),
     re_path(r'^status/', views.status, name='status'),
     re_path(r'^update/', views.update, name='update'),
+    re_path(r'^config/', views.config, name='config'),
+    re_path(r'^feed/', views.feed, name='feed'),
 
 ]
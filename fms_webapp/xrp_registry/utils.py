@@ -1,10 +1,41 @@
 
 import time
 import datetime
+import hashlib
+import json
+
+from django.db import IntegrityError, transaction
+from django.db.models import Q
 
 from .models import Device
+from .registry_cache import registry_cache
 from .logger import logger
 
+# configuration parameters of a device that the FMS assigns and the device applies to itself
+DEVICE_CONFIG_FIELDS = ( 'name', 'protocol', 'port', 'alliance' )
+
+# time (in seconds) without a status report before a device is marked as unknown, used when the
+# settings do not specify a default timeout
+DEFAULT_STATUS_TIMEOUT = 300
+
+# time (in seconds) between the keepalive comments sent on an idle change feed, which detects the
+# driver stations that have disconnected
+FEED_KEEPALIVE = 15
+
+# the states of the devices that are expected to be reporting their status
+REPORTING_STATES = [ state for state, label in Device.STATES if state != 'unknown' ]
+
+#
+# Function adds a device to the registry, or updates the registered device with the same hardware ID.
+#
+# Registered devices are updated with a single UPDATE statement that only writes the columns
+# provided, rather than loading the device and saving the whole row. A new device is only created
+# if the update finds no device, and the unique index on the hardware ID makes sure that a device
+# registering twice at the same time is only created once.
+#
+# The status pending in the registry cache is written before the device is updated, so that it
+# does not overwrite the update, and the cached device is then refreshed.
+#
 def add_or_update_device( config, update_config=False ):
     ret_val = 'Successful'
 
@@ -12,8 +43,32 @@ def add_or_update_device( config, update_config=False ):
 
     hardware_id = config.get( 'hardware_id', None )
     if hardware_id:
-        devices = Device.objects.filter(hardware_id = hardware_id)
-        if len(devices) == 0:
+        fields = {}
+        fields['type'] = config.get('type', 'Unknown')
+        fields['ip_address'] = config.get('ip_address', 'Unassigned')
+        fields['last_reported'] = datetime.datetime.now().strftime('%m/%d/%Y %I:%M:%S %p' )
+        fields['last_timestamp'] = int(time.time())
+
+        # Only update these configuration items if the update flag is set. This is done to ensure that
+        # the devices themselves do not update certain configuration parameters that the FMS itself 
+        # is expected to override.
+        if update_config == True:
+            fields['port'] = config.get('port', '9999')
+            fields['protocol'] = config.get('protocol', 'tcp')
+            for key in ( 'name', 'alliance' ):
+                if key in config:
+                    fields[key] = config[key]
+
+        # add in the optional parameters if they are specified in the update
+        for key in ( 'application', 'state', 'status', 'version', 'ble_service' ):
+            if key in config:
+                fields[key] = config[key]
+
+        registry_cache.flush()
+        if Device.objects.filter(hardware_id=hardware_id).update(**fields) > 0:
+            logger.info( 'Update Existing Device: %s' % hardware_id )
+            registry_cache.refresh( hardware_id )
+        else:
             logger.info( 'Create New Device: %s' % hardware_id )
             device_obj = Device( hardware_id=hardware_id,
                                  type=config.get('type', 'Unknown'),
@@ -28,60 +83,39 @@ def add_or_update_device( config, update_config=False ):
                                  version=config.get('version', ''),
                                  ble_service=config.get('ble_service', '')
                          )
-            device_obj.save()
-        else:
-            logger.info( 'Update Existing Device: %s' % hardware_id )
-            device_obj = devices[0]
-            device_obj.type=config.get('type', 'Unknown')
-            device_obj.ip_address=config.get('ip_address', 'Unassigned')
-            device_obj.last_reported = datetime.datetime.now().strftime('%m/%d/%Y %I:%M:%S %p' )
-            device_obj.last_timestamp = int(time.time())
-
-            # Only update these configuration items if the update flag is set. This is done to ensure that
-            # the devices themselves do not update certain configuration parameters that the FMS itself 
-            # is expected to override.
-            if update_config == True:
-                device_obj.port=config.get('port', '9999')
-                device_obj.protocol=config.get('protocol', 'tcp')
-                try:
-                    device_obj.name=config['name']
-                except KeyError:
-                    pass
-                
-                try:
-                    device_obj.alliance=config['alliance']
-                except KeyError:
-                    pass
-
-            # add in the optional parameters if they are specified in the update
-            try:
-                device_obj.application=config['application']
-            except KeyError:
-                pass
-            try:
-                device_obj.state=config['state']
-            except KeyError:
-                pass
             try:
-                device_obj.status=config['status']
-            except KeyError:
-                pass
-            try:
-                device_obj.version=config['version']
-            except KeyError:
-                pass
-            try:
-                device_obj.ble_service=config['ble_service']
-            except KeyError:
-                pass
-
-            device_obj.save()
+                with transaction.atomic():
+                    device_obj.save()
+            except IntegrityError:
+                # the device was created by another request in the meantime
+                logger.info( 'Device Created Concurrently, Updating: %s' % hardware_id )
+                Device.objects.filter(hardware_id=hardware_id).update(**fields)
+                registry_cache.refresh( hardware_id )
 
     else:
         logger.info( 'No Hardware Device Provided' )
 
     return ret_val
 
+#
+# Function returns the configuration assigned to the device by the FMS, or None if the device is
+# not in the registry
+#
+def get_device_config( hardware_id ):
+    device = registry_cache.get_device( hardware_id )
+    if device is None:
+        return None
+    return { key: getattr(device, key) for key in DEVICE_CONFIG_FIELDS }
+
+#
+# Function returns the ETag for a device configuration. The tag only depends on the configuration
+# values, so it stays the same across status updates and FMS restarts, and devices can revalidate
+# their cached configuration with it.
+#
+def get_device_config_etag( device_config ):
+    encoded = json.dumps( device_config, sort_keys=True ).encode('utf-8')
+    return hashlib.sha1( encoded ).hexdigest()[:16]
+
 def delete_device( config ):
     ret_val = 'Successful'
 
@@ -92,24 +126,117 @@ def delete_device( config ):
         logger.info( 'No Hardware Device Provided' )
     return ret_val
 
+#
+# Function records the status reported by a device. The devices report their status every 15
+# seconds, so the status is applied to the registry cache and written to the database in batches.
+#
 def update_device_status( status_info ):
     ret_val = 'Successful'
 
     hardware_id = status_info.get( 'hardware_id', None )
     if hardware_id:
-        devices = Device.objects.filter(hardware_id = hardware_id)
-        if len(devices) == 0:
+        # the drive loop timing reported by the XRP is logged for tuning the robot control loop
+        drive_loop = status_info.get('drive_loop', None)
+        if drive_loop:
+            logger.debug( 'Drive Loop Timing For %s: %s' % (hardware_id, str(drive_loop)) )
+
+        # the round trip times measured by a driver station to each of its XRPs
+        links = status_info.get('links', None)
+        if links:
+            logger.debug( 'Link Statistics For %s: %s' % (hardware_id, str(links)) )
+
+        updated = registry_cache.update_status( hardware_id, {
+                      'state': 'running',
+                      'status': status_info.get('status', 'Unknown'),
+                      'last_reported': datetime.datetime.now().strftime('%m/%d/%Y %I:%M:%S %p' ),
+                      'last_timestamp': int(time.time()) } )
+        if not updated:
             logger.info( 'Device %s NOT Found In Registry!' % hardware_id )
         else:
             logger.info( 'Updating Device Status For %s' % hardware_id )
-            device_obj = devices[0]
-            device_obj.state='running'
-            device_obj.status=status_info.get('status', 'Unknown')
-            device_obj.last_reported = datetime.datetime.now().strftime('%m/%d/%Y %I:%M:%S %p' )
-            device_obj.last_timestamp = int(time.time())
-            device_obj.save()
     else:
         logger.info( 'No Hardware Device Provided' )
 
     return ret_val
 
+#
+# Function marks the devices that have not reported their status within the timeout for their
+# device type as unknown, and returns the hardware IDs of the devices that were marked.
+#
+# The timeouts are specified as a dictionary keyed by device type, with the 'default' timeout used
+# for any other types. Each timeout is applied with a single UPDATE statement over the devices of
+# those types, which finds the devices that have stopped reporting with the state and timestamp
+# index, so the cost of the check depends on the number of stale devices rather than the number of
+# devices in the registry.
+#
+def mark_unreported_devices( timeouts, curr_time=None ):
+    if curr_time is None:
+        curr_time = int(time.time())
+
+    device_types = [ device_type for device_type in timeouts if device_type != 'default' ]
+    sweeps = [ (Q(type=device_type), timeouts[device_type]) for device_type in device_types ]
+    if device_types:
+        sweeps.append( (~Q(type__in=device_types), timeouts.get('default', DEFAULT_STATUS_TIMEOUT)) )
+    else:
+        sweeps.append( (Q(), timeouts.get('default', DEFAULT_STATUS_TIMEOUT)) )
+
+    marked = []
+    for device_types_filter, timeout in sweeps:
+        stale_devices = Device.objects.filter( device_types_filter, state__in=REPORTING_STATES,
+                                               last_timestamp__lt=curr_time - timeout )
+        with transaction.atomic():
+            # the IDs are only read for logging, the UPDATE applies the same conditions itself so
+            # that a device reporting in the meantime is not marked
+            hardware_ids = list( stale_devices.values_list('hardware_id', flat=True) )
+            if hardware_ids:
+                stale_devices.update( state='unknown' )
+        marked.extend( hardware_ids )
+
+    return marked
+
+#
+# Function formats an event of the change feed in the Server-Sent Events format
+#
+def format_feed_event( event, revision, data ):
+    return 'id: %d\nevent: %s\ndata: %s\n\n' % (revision, event, json.dumps(data))
+
+#
+# Generator for the events of the device change feed, for the devices of a type in an alliance.
+#
+# The feed starts with a snapshot event listing the devices, unless the subscriber provides the
+# revision of the last event it received and the changes since that revision are still in the
+# change log. Each following change is sent as an add, update or remove event for the device,
+# where a device that moves into or out of the alliance is sent as an add or remove event. Every
+# event carries the revision of the registry in its ID, which the subscriber sends back as the
+# Last-Event-ID when it reconnects.
+#
+def device_feed( device_type=None, alliance=None, revision=None, keepalive=FEED_KEEPALIVE ):
+    def matches( data ):
+        if data is None:
+            return False
+        if device_type is not None and data['type'] != device_type:
+            return False
+        if alliance is not None and alliance.lower() != 'any' and data['alliance'] != alliance:
+            return False
+        return True
+
+    changes = None
+    if revision is not None:
+        changes = registry_cache.get_changes( revision )
+
+    while True:
+        if changes is None:
+            revision, devices = registry_cache.get_snapshot( device_type=device_type, alliance=alliance )
+            yield format_feed_event( 'snapshot', revision, {'revision': revision, 'devices': devices} )
+        elif changes:
+            for change_revision, hardware_id, previous_data, data in changes:
+                if matches(data):
+                    event = 'update' if matches(previous_data) else 'add'
+                    yield format_feed_event( event, change_revision, data )
+                elif matches(previous_data):
+                    yield format_feed_event( 'remove', change_revision, {'hardware_id': hardware_id} )
+            revision = changes[-1][0]
+        else:
+            yield ': keepalive\n\n'
+
+        changes = registry_cache.wait_for_changes( revision, keepalive )
@@ -1,14 +1,18 @@
 from django.shortcuts import render
 
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import condition, require_GET
 
 from rest_framework import viewsets
 from rest_framework.decorators import api_view
+from rest_framework.response import Response
 from django.views.decorators.csrf import csrf_exempt
 
 from .models import Device
+from .registry_cache import registry_cache
 from .serializers import DeviceSerializer
 from .utils import add_or_update_device, update_device_status, delete_device
+from .utils import get_device_config, get_device_config_etag, device_feed
 
 
 class DeviceViewSet(viewsets.ModelViewSet):
@@ -30,6 +34,16 @@ class DeviceViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    #
+    # The device lists polled by the driver stations are served from the registry cache
+    #
+    def list(self, request, *args, **kwargs):
+        devices = registry_cache.get_devices( hardware_id=request.query_params.get('id', None),
+                                              device_type=request.query_params.get('type', None),
+                                              alliance=request.query_params.get('alliance', None) )
+        serializer = self.get_serializer( devices, many=True )
+        return Response( serializer.data )
+
     queryset = Device.objects.all()
     serializer_class = DeviceSerializer
 
@@ -60,5 +74,49 @@ def update(request):
         return HttpResponse(ret_val)
     return HttpResponse("Failed")
 
+def device_config_etag(request):
+    hardware_id = request.GET.get('id', None)
+    if hardware_id is None:
+        return None
+    device_config = get_device_config( hardware_id )
+    if device_config is None:
+        return None
+    return get_device_config_etag( device_config )
+
+#
+# The configuration assigned to a device, requested by the device itself when it starts up. Devices
+# send the ETag of their cached configuration in If-None-Match, and receive a 304 Not Modified
+# response without a body if it is still current.
+#
+@require_GET
+@condition(etag_func=device_config_etag)
+def config(request):
+    hardware_id = request.GET.get('id', None)
+    device_config = get_device_config( hardware_id ) if hardware_id else None
+    if device_config is None:
+        return JsonResponse({'error': 'Unknown device'}, status=404)
+    return JsonResponse(device_config)
+
+#
+# Stream of the changes to the devices of a type in an alliance, sent as Server-Sent Events, which
+# the driver stations subscribe to instead of polling the device list. A subscriber that reconnects
+# sends the revision of the last event it received in Last-Event-ID, and only receives the changes
+# since then.
+#
+@require_GET
+def feed(request):
+    revision = request.headers.get('Last-Event-ID', request.GET.get('revision', None))
+    try:
+        revision = int(revision) if revision else None
+    except ValueError:
+        revision = None
+
+    response = StreamingHttpResponse( device_feed( device_type=request.GET.get('type', None),
+                                                   alliance=request.GET.get('alliance', None),
+                                                   revision=revision ),
+                                      content_type='text/event-stream' )
+    response['Cache-Control'] = 'no-cache'
+    return response
+
 def home(request):
     return render(request, "xrp_registry/home.html", {})
@@ -10,13 +10,19 @@ import json
 import machine
 import network
 import socket
+import struct
 import sys
 import time
-import urequests as requests
 import uselect as select
 import _thread
 
 from xrp_config import read_config
+from xrp_http import AsyncHttpClient
+from xrp_kinematics import DriveKinematics
+from xrp_loop_timer import LoopTimer
+from xrp_protocol import *
+from xrp_receiver import CommandReceiver
+from xrp_telemetry import TelemetrySender
 
 from xrp_display import XrpDisplay
 
@@ -32,13 +38,54 @@ def get_id(short_id=False):
         id = id[11:]
     return id
     
+# Period of time (in seconds) without any commands from the driver station after which the
+# robot is stopped
+READ_TIMEOUT = 5
+
+# UDP datagrams delayed by more than this many milliseconds relative to the fastest datagram
+# received from the driver station are considered stale and are dropped
+UDP_STALE_MS = 250
+
+# Period (in milliseconds) after which the fastest delay is raised by one millisecond, so that it
+# follows the drift between the driver station clock and the XRP clock
+UDP_DELAY_DECAY_MS = 1000
+
+# Time (in seconds) to wait before retrying the registration with the FMS, which is doubled after
+# each failed attempt up to the maximum
+REGISTER_RETRY_MIN = 2
+REGISTER_RETRY_MAX = 60
+
+# Interval (in milliseconds) at which the UDP socket is checked for new datagrams
+UDP_POLL_MS = 5
+
+# Default period (in milliseconds) of the drive loop, which can be overridden with the
+# 'drive_period_ms' parameter in the settings section of the configuration
+DRIVE_PERIOD_MS = 20
+
+# Default slew rate of the drive motors (the largest change in effort per second), which can be
+# overridden with the 'slew_rate' parameter in the settings section of the configuration. A slew
+# rate of 0 disables the limiting.
+DRIVE_SLEW_RATE = 0.0
+
+# Time allowed (in milliseconds) for each network to connect, and the interval at which the
+# connection is checked while waiting
+NETWORK_TIMEOUT_MS = 20000
+NETWORK_POLL_MS = 100
+
+# Default file in flash used to cache the device configuration last received from the FMS, which
+# can be overridden with the 'fms_cache' parameter in the configuration
+FMS_CACHE_FILE = 'fms_cache.json'
+
+# Parameters of the device configuration retrieved from the FMS that are applied to the XRP
+FMS_CONFIG_KEYS = ( 'name', 'protocol', 'port', 'alliance' )
+
 
 # Set of control events that could be sent from the driver station application
 # to the XRP. These events correspond to the Xbox Controller buttons and
 # axis controls.
 #
-# At present, this dictionary is included to define all the expected events. 
-# Additional functionality will be added to make more use of the dictionary.
+# Handlers are only registered for the controls that are enabled in this
+# dictionary, so events for any other controls are ignored when received.
 #
 control_events = {
     'ButtonA':        { 'type': 'BUTTON', 'enabled': True },
@@ -89,11 +136,22 @@ event_map = {
 # Main control class for the XRP application.
 #
 class XrpControl():
-    def __init__(self, config, application='XRP_Base'):
+    def __init__(self, config, application='XRP_Base', control_events=control_events):
         print( '\nInitializing XRP...')
         
         # save the configuration within this object
         self.config = config
+        self.control_events = control_events
+
+        # table of the event handler for each control, indexed by control ID. The handlers are
+        # registered once by register_handlers(), and events for controls without a handler are
+        # ignored.
+        self.handlers = [None] * NUM_CONTROLS
+        self.register_handlers()
+
+        # lock protecting the control state set by the event handlers, which is read by the drive
+        # loop. The lock is only contended when the drive loop runs on the second core.
+        self.state_lock = _thread.allocate_lock()
         
         # retrieve and save the unique machine ID
         self.id = get_id()
@@ -109,19 +167,51 @@ class XrpControl():
             except:
                 print('Error initializing XRP Display')
 
-        # set up the network based on the specified configuration
-        # flash the LED on the pico to indicate that we're connecting to the network
-        board.led_blink(2)
-        self.setup_network()
-        time.sleep(1)
-        board.led_off()
-        
+        # the network is set up from the run loop, so that the control server can be started as
+        # soon as an IP address has been assigned
+        self.my_ipaddr = None
+        self.server = None
+        self.udp_task = None
+
         # initialize some variables used to control the robot
         self.current_speed = 0.0
         self.current_turn = 0.0
         self.desired_heading = 0.0
         self.reset_heading = True
-        self.partial_cmd_buffer = ''
+
+        # PID controller for imu_assist driving when enabled
+        self.imu_pid = PID(kp = 0.075, kd=0.001,)
+
+        # receive path for the TCP control connection. Each received command is printed if debug
+        # output is enabled in the configuration.
+        command_names = {}
+        for name, event in event_map.items():
+            command_names[name] = CONTROL_ID_MAP[event]
+        for name in CONTROL_IDS:
+            command_names[name] = CONTROL_ID_MAP[name]
+        self.receiver = CommandReceiver( command_names, debug=config.get('debug', False) )
+
+        # the most recent control state snapshot received from the driver station, and the
+        # control values that have been applied from previous snapshots
+        self.snapshot_buffer = bytearray(SNAPSHOT_FRAME_SIZE)
+        self.snapshot_pending = False
+        self.snapshot_state = [0] * NUM_CONTROLS
+
+        # state of the UDP control channel, used to reject out-of-order and stale datagrams
+        self.udp_peer = None
+        self.udp_last_seq = 0
+        self.udp_min_delay = None
+        self.udp_min_delay_time = 0
+        self.udp_last_accepted = 0
+        self.udp_stats = {'received': 0, 'out_of_order': 0, 'stale': 0}
+
+        # reply to the latest ping received from the driver station, which is sent once the
+        # received data has been processed
+        self.pong_frame = bytearray(PONG_FRAME_SIZE)
+        self.pong_pending = False
+        self.pong_sequence = 0
+        self.pong_timestamp = 0
+        self.pong_received = 0
         
         self.max_angle = 180
         self.min_angle = 0
@@ -137,21 +227,41 @@ class XrpControl():
         self.status_reported = 0
         self.application = application
         
-        # if an FMS is configured, then attempt to register this device with the FMS
+        # registration with the FMS, if one is configured, is done in the background once the
+        # control server has been started, so that the requests do not delay driving
         self.fms_configured = False
-        fms_config = self.config.get('fms', None)
-        if fms_config:
-            for fms in fms_config:
-                if fms.get('enabled', False) == True:
-                    self.fms_configured = True
-                    if self.register(fms['url_base']) == True:
-                        self.retrieve_config(fms['url_base'])
-                        break
+        self.registered = False
+        self.fms_client = None
+
+        # apply the device configuration cached from the last time the XRP registered with the
+        # FMS, so that the control server starts with it without waiting for the FMS
+        self.fms_cache_file = self.config.get('fms_cache', FMS_CACHE_FILE)
+        self.read_fms_cache()
+        if self.fms_device_config:
+            print( 'Using Cached FMS Device Configuration: %s' % self.fms_device_config )
+            self.apply_fms_config( self.fms_device_config )
 
+        drive_period_ms = DRIVE_PERIOD_MS
+        slew_rate = DRIVE_SLEW_RATE
+        self.dual_core = False
         xrp_settings = self.config.get('settings', None)
         if xrp_settings:
             self.imu_assist = xrp_settings.get('imu_assist', None)
             self.proximity_assist = xrp_settings.get('proximity_assist', None)
+            drive_period_ms = xrp_settings.get('drive_period_ms', DRIVE_PERIOD_MS)
+            slew_rate = xrp_settings.get('slew_rate', DRIVE_SLEW_RATE)
+            self.dual_core = xrp_settings.get('dual_core', False)
+
+        # fixed-rate scheduler for the drive task, which also measures the loop jitter
+        self.drive_timer = LoopTimer( drive_period_ms )
+
+        # mixing of the axis values into the drive motor efforts. Application classes with other
+        # drive motors replace this with their own kinematics.
+        self.slew_rate = slew_rate
+        self.kinematics = DriveKinematics( (left_motor, right_motor), period_ms=drive_period_ms, slew_rate=slew_rate )
+
+        # telemetry sent back to the driver station, if enabled in the configuration
+        self.telemetry = TelemetrySender( self.config.get('telemetry', {}), self.get_telemetry_sources() )
 
     #
     # Utility function that will set the angle of the selected servo, saving
@@ -175,13 +285,18 @@ class XrpControl():
     # Currently, Station (STA) and Access Point (AP) modes are supported.
     # Bluetooth support will be added in future support
     #
-    def setup_network(self):
-        MAX_ATTEMPTS = 20
-        num_attempts = 0
-        
+    # The connection is polled rather than waited for with blocking sleeps, so the drive task keeps
+    # the robot stopped while the XRP connects, and the function returns as soon as an IP address
+    # has been assigned.
+    #
+    async def setup_network(self):
+        self.status = 'Connecting To Network'
+
+        # flash the LED on the pico to indicate that we're connecting to the network
+        board.led_blink(2)
+
         networks = self.config['networks']
         for network_config in networks:
-            num_attempts = 0
             if network_config['enabled']:
                 if network_config['network_type'] == 'STA':
                     # Station mode
@@ -190,24 +305,14 @@ class XrpControl():
                     sta_if.active(True)
                     sta_if.connect(network_config['ssid'], network_config['wifi_passcode'])
 
-                    while num_attempts < MAX_ATTEMPTS:
-                        if sta_if.isconnected():
-                            network_config = sta_if.ifconfig()
-                            self.my_ipaddr = network_config[0]
-                            print( 'Connected to WIFI, IP Address: %s' % (self.my_ipaddr) )
-                            
-                            if self.xrp_display:
-                                self.xrp_display.print_ln( 'IP: %s' % (self.my_ipaddr) )
-                                
-                            break
-                        else:
-                            # increment the number of attempts, then pause and retry. We have seen the XRP 
-                            # needing some time following powerup before it will successfully connect to the
-                            # network
-                            num_attempts += 1
-                            time.sleep(1)
-                            
-                    if sta_if.isconnected():
+                    # we have seen the XRP needing some time following powerup before it will
+                    # successfully connect to the network
+                    if await self.wait_for_network( sta_if.isconnected ):
+                        self.my_ipaddr = sta_if.ifconfig()[0]
+                        print( 'Connected to WIFI, IP Address: %s' % (self.my_ipaddr) )
+                        
+                        if self.xrp_display:
+                            self.xrp_display.print_ln( 'IP: %s' % (self.my_ipaddr) )
                         break
                     else:
                         print( 'Error connecting to WIFI network: %s' % network_config['ssid'] )
@@ -218,44 +323,45 @@ class XrpControl():
                     ap_if.config(essid=network_config['ssid'], password=network_config['wifi_passcode'])
                     ap_if.active(True)
 
-                    while num_attempts < MAX_ATTEMPTS:
-                        if ap_if.active():
-                            network_config = ap_if.ifconfig()
-                            self.my_ipaddr = network_config[0]
-                            print( 'WIFI Access Point Activated, IP Address: %s' % (self.my_ipaddr) )
-                            break
-                        else:
-                            # increment the number of attempts, then pause and retry. We have seen the XRP 
-                            # needing some time following powerup before it will successfully connect to the
-                            # network
-                            num_attempts += 1
-                            time.sleep(1)
-                            
-                    if ap_if.active():
+                    if await self.wait_for_network( ap_if.active ):
+                        self.my_ipaddr = ap_if.ifconfig()[0]
+                        print( 'WIFI Access Point Activated, IP Address: %s' % (self.my_ipaddr) )
                         break
                     else:
                         print( 'Error setting up access point: %s' % network_config['ssid'])
                 else:
                     print( 'Unsupported Network Mode Requested: %s' % network_config['network_type'] )
 
-        if num_attempts >= MAX_ATTEMPTS:
-            print( 'Unable to set up the network for %s mode' % network_config['network_type'] )
+        board.led_off()
+        if self.my_ipaddr is None:
+            print( 'Unable to set up the network' )
             sys.exit(0)
 
-    # Function will initialize the local server socket based on the configuration. Currently, only
-    # TCP (Transmission Control Protocol) sockets are supported. TCP sockets are connection-oriented 
-    # and data delivery is guaranteed. 
+    #
+    # Function polls the network interface until it is ready, returning False if it is not ready
+    # within the network timeout
+    #
+    async def wait_for_network(self, is_ready):
+        start = time.ticks_ms()
+        while not is_ready():
+            if time.ticks_diff(time.ticks_ms(), start) >= NETWORK_TIMEOUT_MS:
+                return False
+            await asyncio.sleep_ms(NETWORK_POLL_MS)
+        return True
+
+    # Function will initialize the local server socket based on the configuration. TCP (Transmission
+    # Control Protocol) and UDP (User Datagram Protocol) sockets are supported. TCP sockets are
+    # connection-oriented and data delivery is guaranteed. 
     #
     # The defined control protocol uses short messages between the driver station control application 
-    # and the XRP, so the observed behavior with TCP has not shown any noticable performance degredation.
+    # and the XRP, so the observed behavior with TCP has not shown any noticable performance degredation
+    # on a quiet network. On a congested network, a single lost TCP packet holds up all of the commands
+    # behind it until it is retransmitted. UDP sockets avoid that by treating each datagram as the latest
+    # control state, dropping any datagrams that arrive out of order or late.
     #
     # Note: Bluetooth connections are being developed as an alternative to TCP over WIFI connections, and this
     #       application will be updated to include Bluetooth as a connection type once the testing has been
     #       completed.
-    #
-    # Note 2: UDP sockets were also implemented initially, thinking that the connection-less model may
-    #       perform better than TCP. But in practice, the TCP connections were shown to have more 
-    #       consistent behavior and the UDP support has been removed.
     # 
     async def server_task(self):
         server_config = self.config['server']
@@ -266,55 +372,304 @@ class XrpControl():
             self.server = await asyncio.start_server(self.handle_tcp_client, self.my_ipaddr, self.my_port)
             print( 'Created TCP socket to listen for connections on %s:%d' % (self.my_ipaddr, self.my_port) )
             self.status = 'Waiting For Connection'
+        elif connection_type == 'UDP':
+            self.udp_task = asyncio.create_task(self.udp_server_task())
         else:
             print( 'Unknown socket type: %s' % connection_type )
+
+    #
+    # Function closes the control server and starts it again with the current server configuration,
+    # used when the FMS assigns a different listening port or socket type from the one the server was
+    # started with. A TCP connection that is already established is left open.
+    #
+    async def restart_server(self):
+        print( 'Restarting %s Server On Port %s' % (self.config['server']['socket_type'], str(self.config['server']['listening_port'])) )
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if self.udp_task:
+            self.udp_task.cancel()
+            self.udp_task = None
+            # allow the cancelled task to close its socket before the port is bound again
+            await asyncio.sleep_ms(0)
+        await self.server_task()
+
+    #
+    # Function services the UDP control socket. MicroPython asyncio does not provide datagram support,
+    # so the non-blocking socket is polled. All datagrams that are waiting are read on each pass, with
+    # each one superseding the last. If no datagrams are received within the read timeout, the robot
+    # is stopped in the same way as for a TCP connection.
+    #
+    async def udp_server_task(self):
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        udp_socket.bind(socket.getaddrinfo(self.my_ipaddr, self.my_port)[0][-1])
+        udp_socket.setblocking(False)
+
+        poller = select.poll()
+        poller.register(udp_socket, select.POLLIN)
+
+        print( 'Created UDP socket to listen for commands on %s:%d' % (self.my_ipaddr, self.my_port) )
+        self.status = 'Waiting For Connection'
+
+        # the socket is closed if the task is cancelled to restart the server on a different port
+        try:
+            last_received = time.ticks_ms()
+            next_telemetry = last_received
+            while True:
+                while poller.poll(0):
+                    try:
+                        datagram, address = udp_socket.recvfrom(64)
+                    except OSError:
+                        break
+                    if self.process_datagram( datagram, address ):
+                        last_received = time.ticks_ms()
+                        if self.pong_pending:
+                            try:
+                                udp_socket.sendto(self.encode_pong(WIRE_FORMAT_BINARY), address)
+                            except OSError:
+                                pass
+
+                if time.ticks_diff(time.ticks_ms(), last_received) > READ_TIMEOUT * 1000:
+                    print( 'Read Timeout' )
+                    self.process_commands( ['ReadTimeout'] )
+                    last_received = time.ticks_ms()
+
+                # send the telemetry to the driver station that the control datagrams are received from
+                if self.telemetry.enabled and self.udp_peer:
+                    now = time.ticks_ms()
+                    if time.ticks_diff(now, next_telemetry) >= 0:
+                        next_telemetry = time.ticks_add(now, self.telemetry.period_ms)
+                        try:
+                            udp_socket.sendto(self.telemetry.encode(), self.udp_peer)
+                        except OSError:
+                            pass
+
+                await asyncio.sleep_ms(UDP_POLL_MS)
+        finally:
+            udp_socket.close()
+
+    #
+    # Function validates a UDP control datagram and processes the frame that it carries. Datagrams with
+    # a sequence number that is not newer than the last accepted datagram are dropped, as are datagrams
+    # that took much longer to arrive than the fastest datagram seen from the driver station. The
+    # driver station clock is not synchronized with the XRP clock, so the delay is only compared
+    # relative to the fastest delay. The fastest delay is raised slowly over time to follow the drift
+    # between the two clocks, and is reset if only stale datagrams have arrived for READ_TIMEOUT
+    # seconds (e.g. after the driver station clock is stepped). Returns True if the datagram was accepted.
+    #
+    def process_datagram(self, datagram, address, now=None):
+        if len(datagram) <= DATAGRAM_HEADER_SIZE:
+            return False
+        if now is None:
+            now = time.ticks_ms()
+        seq, remote_ms = decode_datagram_header( datagram )
+        delay = diff32( now, remote_ms )
+        if address != self.udp_peer:
+            print( 'UDP Control Established From: %s' % address[0] )
+            self.udp_peer = address
+            self.udp_last_seq = seq - 1
+            self.udp_min_delay = delay
+            self.udp_min_delay_time = now
+            self.udp_last_accepted = now
+            self.snapshot_state = [0] * NUM_CONTROLS
+            self.status = 'Connected'
+        if diff32( seq, self.udp_last_seq ) <= 0:
+            self.udp_stats['out_of_order'] += 1
+            return False
+        elapsed = time.ticks_diff( now, self.udp_min_delay_time )
+        if elapsed >= UDP_DELAY_DECAY_MS:
+            self.udp_min_delay += elapsed // UDP_DELAY_DECAY_MS
+            self.udp_min_delay_time = time.ticks_add( self.udp_min_delay_time, elapsed - elapsed % UDP_DELAY_DECAY_MS )
+        if delay < self.udp_min_delay:
+            self.udp_min_delay = delay
+        elif delay - self.udp_min_delay > UDP_STALE_MS:
+            if time.ticks_diff( now, self.udp_last_accepted ) <= READ_TIMEOUT * 1000:
+                self.udp_stats['stale'] += 1
+                return False
+            print( 'Resetting UDP Delay After Stale Datagrams' )
+            self.udp_min_delay = delay
+        self.udp_last_seq = seq
+        self.udp_last_accepted = now
+        self.udp_stats['received'] += 1
+        self.process_frame( datagram, DATAGRAM_HEADER_SIZE )
+        return True
     
     #
-    # Set of functions that read from the network and return the command and data associated with the
-    # command.
+    # Function services a TCP connection from the driver station.
     #
     # A simple command format has been specified of the form:
     #   <command>:<arg1>:<arg2>:etc
     #
-    # The command string is decoded and split on the colon(':') to create a list of command
-    # tokens that are returned to the caller. Note that each command is terminated by a newline '\n'
+    # Each command is terminated by a newline '\n'. The received data is parsed in place by the
+    # command receiver, which dispatches each event to the registered handler as it is parsed.
+    #
+    # The driver station may request the binary wire format by sending the 'Protocol:BIN' command.
+    # Once acknowledged, all remaining data on the connection is read as fixed-size binary frames,
+    # and the telemetry frames are sent back to the driver station if enabled.
     #
-    def handle_tcp_client(self, rx_stream, tx_stream):
-        commands = []
+    async def handle_tcp_client(self, rx_stream, tx_stream):
+        self.receiver.reset()
+        self.snapshot_pending = False
+        self.snapshot_state = [0] * NUM_CONTROLS
+        telemetry_task = None
+
+        # the telemetry task and the replies to the pings both write to the connection, so the
+        # writes are serialized by the lock
+        tx_lock = asyncio.Lock()
 
         self.status = 'Connected'
         print( 'TCP Connection Established From: %s' % rx_stream.get_extra_info('peername')[0])
         while True:
             try:
-                data = await asyncio.wait_for(rx_stream.readline(), 5)
-                decoded_data = self.partial_cmd_buffer + data.decode('utf-8')
-            
-                if decoded_data:
-                    print( 'Decoded Received: ', decoded_data )
-
-                    # split the decoded data into separate commands delimited by a newline
-                    commands = decoded_data.split('\n')
-
-                    # for TCP connections, it is possible that the received data may contain a partial
-                    # command, which will be the last item in the commands list. We'll store that last
-                    # item as the partial command so that we can attach the next received data to the
-                    # partial command string.
-                    self.partial_cmd_buffer = commands.pop()
-                else:
+                received = await asyncio.wait_for(self.receiver.receive(rx_stream), READ_TIMEOUT)
+                if not received:
                     print( 'TCP Client Connection Error, Closing Socket' )
                     raise OSError
-                    
+
+                # check for a request from the driver station to change the wire format. Any data
+                # following the request is parsed in the requested format.
+                requested = self.receiver.process( self )
+                while requested:
+                    wire_format = await self.negotiate_wire_format( requested, tx_stream )
+                    if wire_format == WIRE_FORMAT_BINARY and self.telemetry.enabled and telemetry_task is None:
+                        telemetry_task = asyncio.create_task( self.telemetry_task(tx_stream, tx_lock) )
+                    requested = self.receiver.process( self )
+
+                if self.pong_pending:
+                    async with tx_lock:
+                        tx_stream.write( self.encode_pong(self.receiver.wire_format) )
+                        await tx_stream.drain()
+
             except asyncio.TimeoutError:
                 print( 'Read Timeout' )
-                commands = ['ReadTimeout']
+                self.process_commands( ['ReadTimeout'] )
 
-            except OSError:
+            except (OSError, EOFError):
+                if telemetry_task:
+                    telemetry_task.cancel()
                 self.stop_movement()
-                await rx_stream.wait_closed()
+                tx_stream.close()
+                await tx_stream.wait_closed()
                 self.status = 'Disconnected'
                 break
-            
-            self.process_commands( commands )
+
+    #
+    # Function handles the request from the driver station to change the wire format for the
+    # connection. The selected format is echoed back to the driver station as the acknowledgement.
+    #
+    async def negotiate_wire_format(self, wire_format, tx_stream):
+        print( 'Using %s wire format' % wire_format )
+        tx_stream.write( protocol_command(wire_format).encode('utf-8') )
+        await tx_stream.drain()
+        return wire_format
+
+    #
+    # Function records a ping received from the driver station, along with the time it was
+    # received. The reply is sent by the connection handler once the received data has been
+    # processed.
+    #
+    def process_ping(self, sequence, timestamp):
+        self.pong_sequence = sequence
+        self.pong_timestamp = timestamp
+        self.pong_received = time.ticks_ms()
+        self.pong_pending = True
+
+    #
+    # Function encodes the reply to the latest ping in the specified wire format, stamped with
+    # the time at which it is sent
+    #
+    def encode_pong(self, wire_format):
+        self.pong_pending = False
+        transmitted = time.ticks_ms()
+        if wire_format == WIRE_FORMAT_BINARY:
+            struct.pack_into( PONG_FRAME_FORMAT, self.pong_frame, 0, FRAME_PONG, PONG_FRAME_SIZE,
+                              self.pong_sequence & 0xFFFFFFFF, self.pong_timestamp & 0xFFFFFFFF,
+                              self.pong_received & 0xFFFFFFFF, transmitted & 0xFFFFFFFF )
+            return self.pong_frame
+        return ('%s:%d:%d:%d:%d\n' % (PONG_COMMAND, self.pong_sequence, self.pong_timestamp,
+                                      self.pong_received, transmitted)).encode('utf-8')
+
+    #
+    # Task sends the telemetry frames to the driver station at the configured rate. The task ends
+    # when the connection is closed.
+    #
+    async def telemetry_task(self, tx_stream, tx_lock):
+        try:
+            while True:
+                async with tx_lock:
+                    tx_stream.write( self.telemetry.encode() )
+                    await tx_stream.drain()
+                await asyncio.sleep_ms( self.telemetry.period_ms )
+        except OSError:
+            pass
+
+    #
+    # Function returns the source of each telemetry field, as a dictionary mapping the field name
+    # to a function returning the current value, or None if the field is not available.
+    #
+    # OVERLOAD THIS FUNCTION IN A DERIVED CLASS TO REPORT DIFFERENT VALUES FOR
+    # YOUR XRP CONFIGURATION.
+    #
+    def get_telemetry_sources(self):
+        sources = {}
+        sources['left_encoder'] = getattr( left_motor, 'get_position_counts', None )
+        sources['right_encoder'] = getattr( right_motor, 'get_position_counts', None )
+        sources['left_effort'] = getattr( left_motor, 'get_effort', None )
+        sources['right_effort'] = getattr( right_motor, 'get_effort', None )
+        sources['yaw'] = imu.get_yaw
+        sources['distance'] = rangefinder.distance
+        sources['loop_jitter'] = self.drive_timer.get_last_jitter
+        sources['loop_overruns'] = self.drive_timer.get_overruns
+        sources['battery'] = getattr( board, 'get_battery_voltage', None )
+        return sources
+
+    #
+    # Function processes a single binary frame, starting at the specified offset, received from the
+    # driver station. Event frames are processed immediately, while snapshot frames are copied to the
+    # snapshot buffer so that the drive task only acts on the newest control state. Ping frames are
+    # recorded so that the reply can be sent.
+    #
+    def process_frame(self, frame, offset=0):
+        frame_type = frame[offset]
+        if frame_type == FRAME_EVENT:
+            control_id, value = decode_event_frame( frame, offset )
+            if control_id < NUM_CONTROLS:
+                self.status = 'Processing Command'
+                self.dispatch_event( control_id, value )
+        elif frame_type == FRAME_PING:
+            frame_type, sequence, timestamp = struct.unpack_from( PING_FRAME_FORMAT, frame, offset )
+            self.process_ping( sequence, timestamp )
+        elif frame_type == FRAME_SNAPSHOT:
+            self.status = 'Processing Command'
+            for index in range(SNAPSHOT_FRAME_SIZE):
+                self.snapshot_buffer[index] = frame[offset + index]
+            self.snapshot_pending = True
+
+            # the drive loop on the second core does not apply the snapshots, so apply it now
+            if self.dual_core:
+                self.apply_snapshot()
+        else:
+            print( 'Ignoring Unexpected Frame Type: %d' % frame_type )
+
+    #
+    # Function applies the most recent control state snapshot, if one has been received since the
+    # last call. Only the controls that have changed since the previous snapshot are passed on to
+    # the event processing. This function is called at the start of each drive task iteration, or
+    # as each snapshot is received when the drive loop runs on the second core.
+    #
+    def apply_snapshot(self):
+        if not self.snapshot_pending:
+            return
+        self.snapshot_pending = False
+
+        fixed_values = decode_snapshot_frame( self.snapshot_buffer, 0 )
+        for control_id in range(NUM_CONTROLS):
+            fixed = fixed_values[control_id]
+            if fixed != self.snapshot_state[control_id]:
+                self.snapshot_state[control_id] = fixed
+                self.dispatch_event( control_id, fixed / VALUE_SCALE )
     
     def process_commands(self, commands ):
         #if self.xrp_display:
@@ -329,7 +684,13 @@ class XrpControl():
                     event = event_map[tokens[1]]
                 except KeyError:
                     event = tokens[1]
-                self.process_event( event, tokens[2:] )
+                value = None
+                if len(tokens) > 2:
+                    try:
+                        value = float(tokens[2])
+                    except ValueError:
+                        value = tokens[2]
+                self.process_event( event, value )
             elif command == 'ReadTimeout':
                 # If the read times out, then no commands have been received from the
                 # driver station in awhile. We have seen the drive station not totally 
@@ -343,115 +704,212 @@ class XrpControl():
     # 
     # Function to periodically send status to a configured FMS
     #
-    # Function processes the Event command, interpreting the event type and 
-    # invoking the appropriate robot control behavior specified by the event
+    # Function registers the handlers for the control events. Each handler is called with the
+    # value of the control, which is passed as a number, or as a string for non-numeric values.
     #
     # OVERLOAD THIS FUNCTION IN A DERIVED CLASS TO MODIFY THE BEHAVIOR FOR
-    # YOUR XRP CONFIGURATION
-    #
-    def process_event( self, event, args ):
-        #print( 'Processing Event: %s, Args %s' % (event,str(args)))
-        if event == 'LeftJoystickY':
-            self.current_speed = float(args[0]) * -1.0
-        elif event == 'RightJoystickX' or event == 'LeftJoystickX':
-            if self.current_speed != 0.0:
-                # if we are currently moving forward or backward, let's dampen the
-                # turn amount so that it's less abrupt
-                dampened_turn = float(args[0]) * 0.3
-            else:
-                dampened_turn = float(args[0])
-            
-            # and if we are going backwards, let's flip the direction of the
-            # turn so that the robot will move in a natural direction
-            if self.current_speed < 0.0:
-                self.current_turn = dampened_turn
-            else:
-                self.current_turn = dampened_turn * -1.0
+    # YOUR XRP CONFIGURATION. Call the base class function first, then register
+    # the handlers for your controls, which replace any handler already registered
+    # for the same control.
+    #
+    def register_handlers( self ):
+        self.register_handler( 'LeftJoystickY', self.set_speed )
+        self.register_handler( 'RightJoystickX', self.set_turn )
+        self.register_handler( 'LeftJoystickX', self.set_turn )
+        self.register_handler( 'LeftBumper', self.open_arm )
+        self.register_handler( 'LeftTrigger', self.open_arm )
+        self.register_handler( 'RightBumper', self.close_arm )
+        self.register_handler( 'RightTrigger', self.close_arm )
+        self.register_handler( 'ButtonA', self.select_servo_one )
+        self.register_handler( 'ButtonB', self.select_servo_two )
+        self.register_handler( 'ButtonX', self.toggle_proximity_assist )
+        self.register_handler( 'ButtonY', self.toggle_imu_assist )
 
-            # if the current turning setting returns to zero, signal to the drive
-            # task to update the heading to the current yaw position
-            if self.current_turn == 0.0:
-                self.reset_heading = True
-                
-        elif event == 'LeftBumper' or event == 'LeftTrigger':
-            # Open (lower) the arm when the left bumper is pressed
-            if int(args[0]) == 1:
-                self.set_servo_angle( self.min_angle )
-        elif event == 'RightBumper' or event == 'RightTrigger':
-            # Close (raise) the arm when the right bumper is pressed
-            if int(args[0]) == 1:
-                self.set_servo_angle( self.max_angle )
-        elif event == 'ButtonA':
-            if int(args[0]) == 1:
-                print( 'Selecting Servo One' )
-                self.curr_servo = 0
-        elif event == 'ButtonB':
-            if int(args[0]) == 1:
-                print( 'Selecting Servo Two' )
-                self.curr_servo = 1
-        elif event == 'ButtonX':
-            if int(args[0]) == 1:
-                if self.proximity_assist.get('enabled',False) == False:
-                    print( 'Enabling Collision Avoidance' )
-                    self.proximity_assist['enabled'] = True
-                else:
-                    print( 'Disabling Collision Avoidance' )
-                    self.proximity_assist['enabled'] = False
-        elif event == 'ButtonY':
-            if int(args[0]) == 1:
-                if self.imu_assist.get('enabled',False) == False:
-                    print( 'Enabling IMU Assist' )
-                    self.imu_assist['enabled'] = True
-                else:
-                    print( 'Disabling IMU Assist' )
-                    self.imu_assist['enabled'] = False
+    #
+    # Function sets the handler for the named control. The handler is only registered if the
+    # control is enabled in the control events for the application, so that events for any other
+    # controls are ignored as soon as they are received.
+    #
+    def register_handler( self, event, handler ):
+        control_id = CONTROL_ID_MAP.get( event, None )
+        if control_id is None:
+            print( 'Unable to register handler for unknown control: %s' % event )
+            return
+
+        control = self.control_events.get( event, None )
+        if control is None or control.get('enabled', False) == False:
+            self.handlers[control_id] = None
         else:
-            # add more event handling operations here...
-            pass
+            self.handlers[control_id] = handler
 
+    #
+    # Function invokes the handler registered for the control
+    #
+    def dispatch_event( self, control_id, value ):
+        handler = self.handlers[control_id]
+        if handler:
+            with self.state_lock:
+                handler( value )
+
+    #
+    # Function processes the named event, used for events that are not received
+    # with a control ID
+    #
+    def process_event( self, event, value ):
+        control_id = CONTROL_ID_MAP.get( event, None )
+        if control_id is not None:
+            self.dispatch_event( control_id, value )
+
+    def set_speed( self, value ):
+        self.current_speed = value * -1.0
+
+    def set_turn( self, value ):
+        if self.current_speed != 0.0:
+            # if we are currently moving forward or backward, let's dampen the
+            # turn amount so that it's less abrupt
+            dampened_turn = value * 0.3
+        else:
+            dampened_turn = value
+        
+        # and if we are going backwards, let's flip the direction of the
+        # turn so that the robot will move in a natural direction
+        if self.current_speed < 0.0:
+            self.current_turn = dampened_turn
+        else:
+            self.current_turn = dampened_turn * -1.0
+
+        # if the current turning setting returns to zero, signal to the drive
+        # task to update the heading to the current yaw position
+        if self.current_turn == 0.0:
+            self.reset_heading = True
+
+    def open_arm( self, value ):
+        # Open (lower) the arm when the left bumper is pressed
+        if value == 1:
+            self.set_servo_angle( self.min_angle )
+
+    def close_arm( self, value ):
+        # Close (raise) the arm when the right bumper is pressed
+        if value == 1:
+            self.set_servo_angle( self.max_angle )
+
+    def select_servo_one( self, value ):
+        if value == 1:
+            print( 'Selecting Servo One' )
+            self.curr_servo = 0
+
+    def select_servo_two( self, value ):
+        if value == 1:
+            print( 'Selecting Servo Two' )
+            self.curr_servo = 1
+
+    def toggle_proximity_assist( self, value ):
+        if value == 1:
+            if self.proximity_assist.get('enabled',False) == False:
+                print( 'Enabling Collision Avoidance' )
+                self.proximity_assist['enabled'] = True
+            else:
+                print( 'Disabling Collision Avoidance' )
+                self.proximity_assist['enabled'] = False
+
+    def toggle_imu_assist( self, value ):
+        if value == 1:
+            if self.imu_assist.get('enabled',False) == False:
+                print( 'Enabling IMU Assist' )
+                self.imu_assist['enabled'] = True
+            else:
+                print( 'Disabling IMU Assist' )
+                self.imu_assist['enabled'] = False
+
+    #
+    # Function runs the drive loop, which applies the newest control state received from the
+    # driver station and then updates the motors once per period.
+    #
+    # If the 'dual_core' setting is enabled, the motor updates are run on the second core of the
+    # RP2040 by drive_thread(), so that their timing is not affected by the network handling,
+    # command parsing and FMS requests running on the first core. The event handlers still run on
+    # the first core, with the snapshots applied as soon as they are received.
+    #
     async def drive_task(self):
-        # initialize the PID controller for imu_assist driving when enabled
-        imu_pid = PID(kp = 0.075, kd=0.001,)
+        print( 'Starting %s Drive Task' % self.application )
+        if self.dual_core:
+            _thread.start_new_thread( self.drive_thread, () )
+            return
 
-        while True:
-            collision_imminent = False
-            if self.proximity_assist.get('enabled',False) == True:
-                range_distance = float(self.proximity_assist.get('distance',10))
-
-                if self.current_speed > 0.0 and rangefinder.distance() < range_distance:
-                    # if the proximity assist is enabled and the front of the robot is within the minimum
-                    # distance and we're trying to go forward, then stop the movement.
-                    collision_imminent = True
-                
-            if collision_imminent:
-                # a collision is imminent, stop all forward movement
-                drivetrain.stop()
-            elif self.imu_assist.get('enabled',False) == False:
-                # if the IMU assist is disabled, then just run the standard 
-                # arcade drive
-                drivetrain.arcade( self.current_speed, self.current_turn )
+        self.drive_timer.start()
+        while not self.shutdown:
+            # apply the newest control state received from the driver station
+            self.apply_snapshot()
+
+            self.drive_step()
+
+            # wait for the start of the next period
+            await self.drive_timer.wait()
+
+    #
+    # Function runs the drive loop on the second core
+    #
+    def drive_thread(self):
+        print( 'Running Drive Loop On Second Core' )
+        self.drive_timer.start()
+        while not self.shutdown:
+            self.drive_step()
+            self.drive_timer.wait_blocking()
+
+    #
+    # Function performs a single iteration of the drive loop, updating the motors from the
+    # current control state. The control state is copied under the state lock first, so that the
+    # values are consistent when the drive loop runs on the second core, and the lock is not held
+    # while the sensors are read and the motors are updated.
+    #
+    # OVERLOAD THIS FUNCTION IN A DERIVED CLASS TO MODIFY THE BEHAVIOR FOR
+    # YOUR XRP DRIVETRAIN.
+    #
+    def drive_step(self):
+        with self.state_lock:
+            current_speed = self.current_speed
+            current_turn = self.current_turn
+            reset_heading = self.reset_heading
+            proximity_enabled = self.proximity_assist.get('enabled',False)
+            range_distance = float(self.proximity_assist.get('distance',10))
+            imu_enabled = self.imu_assist.get('enabled',False)
+
+        collision_imminent = False
+        if proximity_enabled == True:
+            if current_speed > 0.0 and rangefinder.distance() < range_distance:
+                # if the proximity assist is enabled and the front of the robot is within the minimum
+                # distance and we're trying to go forward, then stop the movement.
+                collision_imminent = True
+            
+        if collision_imminent:
+            # a collision is imminent, stop all forward movement
+            self.kinematics.stop()
+        elif imu_enabled == False:
+            # if the IMU assist is disabled, then just run the standard 
+            # arcade drive
+            self.kinematics.arcade( current_speed, current_turn )
+        else:
+            # else if IMU assist is enabled, then use the IMU with PID to
+            # maintain a set heading while driving.
+            if current_speed == 0.0 or current_turn != 0.0:
+                self.kinematics.arcade( current_speed, current_turn )
             else:
-                # else if IMU assist is enabled, then use the IMU with PID to
-                # maintain a set heading while driving.
-                if self.current_speed == 0.0 or self.current_turn != 0.0:
-                    drivetrain.arcade( self.current_speed, self.current_turn )
-                else:
-                    if self.reset_heading:
+                if reset_heading:
+                    with self.state_lock:
                         self.reset_heading = False
-                        self.desired_heading = imu.get_yaw()
+                    self.desired_heading = imu.get_yaw()
 
-                    heading_correction = imu_pid.update(self.desired_heading - imu.get_yaw())
-                    drivetrain.set_effort(self.current_speed - heading_correction, self.current_speed + heading_correction)
-            
-            await asyncio.sleep_ms(20)
+                heading_correction = self.imu_pid.update(self.desired_heading - imu.get_yaw())
+                self.kinematics.tank(current_speed - heading_correction, current_speed + heading_correction)
 
     #
     # Simple function for force the XRP to stop moving. This function is used to handle cases
     # where the XRP robot continues to move following a command invocation.
     #
     def stop_movement(self):
-        self.current_speed = 0.0
-        self.current_turn = 0.0
+        with self.state_lock:
+            self.current_speed = 0.0
+            self.current_turn = 0.0
 
     #
     # Function to register this device with a configured FMS
@@ -462,7 +920,32 @@ class XrpControl():
     # register with the FMS, providing their IP address, and the driver station application
     # will learn the IP addresses of all connected XRPs from the FMS.
     #
-    def register(self, url_base):
+    # The requests to the FMS are made with the non-blocking HTTP client, so the drive task keeps
+    # running while waiting for the FMS to respond. The connection to the FMS that accepted the
+    # registration is kept open for the status reports.
+    #
+    # The registration runs in the background after the control server has been started, so the
+    # driver station can connect while the XRP waits for the FMS, and is retried until it succeeds.
+    #
+    async def register_with_fms(self):
+        fms_config = [ fms for fms in self.config.get('fms', None) or [] if fms.get('enabled', False) == True ]
+        if not fms_config:
+            return
+
+        # each enabled FMS is tried in turn until one accepts the registration, backing off between
+        # the attempts in case the FMS is not up yet
+        self.fms_configured = True
+        retry_delay = REGISTER_RETRY_MIN
+        while not self.shutdown:
+            for fms in fms_config:
+                if await self.register(fms['url_base']) == True:
+                    await self.retrieve_config(fms['url_base'])
+                    return
+            print( 'Retrying Registration With FMS In %d Seconds' % retry_delay )
+            await asyncio.sleep(retry_delay)
+            retry_delay = min( retry_delay * 2, REGISTER_RETRY_MAX )
+
+    async def register(self, url_base):
         print( 'Registering Device With FMS: %s' % url_base )
         self.registered = False
         reg_data = {}
@@ -481,51 +964,133 @@ class XrpControl():
         except:
             pass
 
-        url = '%s/register/' % url_base
+        client = AsyncHttpClient( url_base )
         headers = {'Content-type': 'application/json'}
         try:
-            resp = requests.post(url, data=json.dumps(reg_data), headers=headers)
+            resp = await client.post('/register/', data=json.dumps(reg_data), headers=headers)
             if resp.status_code == 200:
                 print( 'Registration With FMS Complete' )
                 self.fms_url_base = url_base
+                self.fms_client = client
                 self.registered = True
             else:
                 print( 'Error Registering With FMS: %d' % resp.status_code )
         except OSError:
             print( 'Error Connecting To FMS: %s' % url_base )
+
+        if not self.registered:
+            await client.close()
         return self.registered
 
-    def retrieve_config(self, url_base):
+    #
+    # Function retrieves the device configuration from the FMS. The configuration is revalidated
+    # with the ETag of the cached configuration, so the FMS only sends the configuration when it has
+    # changed. An FMS without the configuration endpoint is asked for the full device record instead.
+    #
+    async def retrieve_config(self, url_base):
         print( 'Retrieving Device Config From FMS: %s' % url_base )
 
-        url = '%s/api/devices/?id=%s' % (url_base,self.id)
+        headers = {}
+        if self.fms_config_etag:
+            headers['If-None-Match'] = self.fms_config_etag
         try:
-            resp = requests.get(url)
+            resp = await self.fms_client.get('/config/?id=%s' % self.id, headers=headers)
+            if resp.status_code == 304:
+                print( 'Cached Device Configuration Is Current' )
+                return
+
+            etag = None
+            if resp.status_code == 200:
+                ret_config = resp.json()
+                etag = resp.headers.get('etag', None)
+            elif resp.status_code == 404:
+                resp = await self.fms_client.get('/api/devices/?id=%s' % self.id)
+                if resp.status_code == 200:
+                    ret_config = resp.json()[0]
+
             if resp.status_code == 200:
-                ret_config = resp.json()[0]
                 print( 'Device Configuration Received: %s' % ret_config )
-                
-                # Apply returned configuration, overriding any default configuration 
-                # parameters that could be overriden by the FMS
-                self.config['server']['name'] = ret_config['name']
-                self.config['server']['type'] = ret_config['protocol']
-                self.config['server']['listening_port'] = ret_config['port']
-                self.config['alliance'] = ret_config['alliance']
+
+                # only the parameters that are applied are cached, so that the cache is only
+                # rewritten when one of them changes
+                device_config = {}
+                for key in FMS_CONFIG_KEYS:
+                    device_config[key] = ret_config[key]
+
+                if device_config != self.fms_device_config or etag != self.fms_config_etag:
+                    server_changed = self.apply_fms_config( device_config )
+                    self.fms_device_config = device_config
+                    self.fms_config_etag = etag
+                    self.write_fms_cache()
+
+                    # the driver station learns the port and protocol from the FMS, so the server must
+                    # move to them
+                    if server_changed and (self.server or self.udp_task):
+                        await self.restart_server()
             else:
                 print( 'Error Retrieving Device Config From FMS: %d' % resp.status_code )
+        except (OSError, ValueError, IndexError, KeyError):
+            print( 'Error Retrieving Device Config From FMS: %s' % url_base )
+
+    #
+    # Function applies the device configuration from the FMS, overriding any default configuration
+    # parameters that could be overriden by the FMS. Returns True if the listening port or the socket
+    # type changed.
+    #
+    def apply_fms_config(self, device_config):
+        port = self.config['server'].get('listening_port', None)
+        socket_type = self.config['server'].get('socket_type', '')
+        self.config['server']['name'] = device_config['name']
+        self.config['server']['socket_type'] = device_config['protocol']
+        self.config['server']['listening_port'] = device_config['port']
+        self.config['alliance'] = device_config['alliance']
+        return str(port) != str(device_config['port']) or socket_type.upper() != device_config['protocol'].upper()
+
+    #
+    # Functions read and write the device configuration cached in flash, along with the ETag that the
+    # FMS sent with it. A missing or unreadable cache is treated as empty.
+    #
+    def read_fms_cache(self):
+        self.fms_device_config = None
+        self.fms_config_etag = None
+        try:
+            with open( self.fms_cache_file ) as fd:
+                cache = json.load(fd)
+            device_config = cache['config']
+            for key in FMS_CONFIG_KEYS:
+                if key not in device_config:
+                    return
+            self.fms_device_config = device_config
+            self.fms_config_etag = cache.get('etag', None)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def write_fms_cache(self):
+        cache = {}
+        cache['config'] = self.fms_device_config
+        cache['etag'] = self.fms_config_etag
+        try:
+            with open( self.fms_cache_file, 'w' ) as fd:
+                json.dump( cache, fd )
+            print( 'FMS Device Configuration Cached In %s' % self.fms_cache_file )
         except OSError:
-            print( 'Error Connecting To FMS: %s' % url_base )
-            
-        #
+            print( 'Error Writing FMS Device Configuration Cache: %s' % self.fms_cache_file )
 
     #
     # Function represents the main processing loop for the XRP controller. This function 
     # reads commands from the network interface and invokes the command procesing to 
     # control the robot.
     #
+    # The startup is staged so that the XRP is drivable as soon as possible after power-on. The drive
+    # task starts first, the control server is started as soon as the network has an IP address
+    # (using the server configuration cached from the FMS), and the registration with the FMS then
+    # runs in the background.
+    #
     async def run(self):
         asyncio.create_task(self.drive_task())
-        asyncio.create_task(self.server_task())
+        await self.setup_network()
+        await self.server_task()
+        asyncio.create_task(self.register_with_fms())
         asyncio.create_task(self.status_task())
         
         while True:
@@ -551,10 +1116,13 @@ class XrpControl():
                 data['hardware_id'] = self.id
                 data['status'] = self.status
 
-                url = '%s/status/' % self.fms_url_base
+                # drive loop timing since the last status report
+                data['drive_loop'] = self.drive_timer.get_stats(reset=True)
+                print( 'Drive Loop: %s' % str(data['drive_loop']) )
+
                 headers = {'Content-type': 'application/json'}
                 try:
-                    resp = requests.post(url, data=json.dumps(data), headers=headers)
+                    resp = await self.fms_client.post('/status/', data=json.dumps(data), headers=headers)
                     if resp.status_code == 200:
                         print( 'Status Sent' )
                     else:
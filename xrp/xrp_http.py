@@ -0,0 +1,189 @@
+import asyncio
+import json
+
+#
+# Non-blocking HTTP client used by the XRP to communicate with the FMS.
+#
+# The urequests module blocks the whole asyncio loop while a request is in flight, so a slow or
+# unreachable FMS stops the drive and server tasks for as long as the request takes to complete or
+# time out. This client is built on asyncio.open_connection instead, so the other tasks keep
+# running while it waits for the FMS, and every request is bounded by a timeout.
+#
+# The connection to the FMS is kept open between requests (HTTP/1.1 keep-alive) where the server
+# allows it, which avoids setting up a new TCP connection for every status report. If the server
+# has closed a kept-alive connection in the meantime, the request is retried once on a new
+# connection.
+#
+# Only plain HTTP is supported. Failed requests, including timeouts, raise OSError, as they do with
+# urequests.
+#
+
+# Default time (in seconds) allowed for a complete request, including connecting to the server
+HTTP_TIMEOUT = 3
+
+#
+# The response headers are stored with lowercase names
+#
+class HttpResponse():
+    def __init__(self, status_code, content, headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers if headers is not None else {}
+
+    @property
+    def text(self):
+        return str(self.content, 'utf-8')
+
+    def json(self):
+        return json.loads( self.text )
+
+class AsyncHttpClient():
+    #
+    # The URL base is of the form http://<host>[:<port>], as specified in the FMS configuration
+    #
+    def __init__(self, url_base, timeout=HTTP_TIMEOUT):
+        self.url_base = url_base
+        self.timeout = timeout
+
+        address = url_base
+        if address.startswith('http://'):
+            address = address[7:]
+        address = address.split('/')[0]
+        if ':' in address:
+            self.host, port = address.split(':')
+            self.port = int(port)
+        else:
+            self.host = address
+            self.port = 80
+
+        self.reader = None
+        self.writer = None
+        self.lock = asyncio.Lock()
+
+    async def get(self, path, headers=None):
+        return await self.request( 'GET', path, headers=headers )
+
+    async def post(self, path, data=None, headers=None):
+        return await self.request( 'POST', path, data=data, headers=headers )
+
+    #
+    # Function sends the request to the server and returns the response. Requests are serialized
+    # so that only one request is in flight on the connection at a time.
+    #
+    async def request(self, method, path, data=None, headers=None):
+        async with self.lock:
+            reused = self.writer is not None
+            try:
+                return await asyncio.wait_for( self.send_request(method, path, data, headers), self.timeout )
+            except asyncio.TimeoutError:
+                await self.close()
+                raise OSError( 'HTTP request timed out' )
+            except (OSError, EOFError) as err:
+                await self.close()
+                if not reused:
+                    raise OSError( 'HTTP request failed: %s' % str(err) )
+
+            # the kept-alive connection was closed by the server, so retry on a new connection
+            try:
+                return await asyncio.wait_for( self.send_request(method, path, data, headers), self.timeout )
+            except (asyncio.TimeoutError, OSError, EOFError) as err:
+                await self.close()
+                raise OSError( 'HTTP request failed: %s' % str(err) )
+
+    async def close(self):
+        writer = self.writer
+        self.reader = None
+        self.writer = None
+        if writer:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def send_request(self, method, path, data, headers):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection( self.host, self.port )
+
+        if data is None:
+            body = b''
+        elif isinstance(data, str):
+            body = data.encode('utf-8')
+        else:
+            body = data
+
+        request = '%s %s HTTP/1.1\r\nHost: %s:%d\r\nConnection: keep-alive\r\n' % (method, path, self.host, self.port)
+        if headers:
+            for name, value in headers.items():
+                request += '%s: %s\r\n' % (name, value)
+        if body or method == 'POST':
+            request += 'Content-Length: %d\r\n' % len(body)
+        request += '\r\n'
+
+        self.writer.write( request.encode('utf-8') + body )
+        await self.writer.drain()
+
+        return await self.read_response()
+
+    #
+    # Function reads the status line, headers and body of the response. The connection is closed
+    # afterwards unless the server supports keeping it open. A response that cannot be parsed is
+    # reported as an OSError, as for any other failed request, and the connection is closed as the
+    # rest of the response cannot be found.
+    #
+    async def read_response(self):
+        try:
+            return await self.parse_response()
+        except (ValueError, UnicodeError) as err:
+            await self.close()
+            raise OSError( 'Invalid HTTP response: %s' % str(err) )
+
+    async def parse_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise EOFError( 'Connection closed by server' )
+        fields = str(status_line, 'utf-8').split()
+        if len(fields) < 2:
+            raise OSError( 'Invalid HTTP response' )
+        version = fields[0]
+        status_code = int(fields[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if not line or line == b'\r\n' or line == b'\n':
+                break
+            header = str(line, 'utf-8')
+            separator = header.find(':')
+            if separator > 0:
+                response_headers[header[:separator].strip().lower()] = header[separator+1:].strip()
+
+        keep_alive = version == 'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+        if status_code == 204 or status_code == 304 or status_code < 200:
+            # these responses never have a body, whatever the headers say
+            content = b''
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            content = b''
+            while True:
+                size = int( str(await self.reader.readline(), 'utf-8').split(';')[0].strip(), 16 )
+                if size == 0:
+                    # skip any trailers following the last chunk
+                    while True:
+                        line = await self.reader.readline()
+                        if not line or line == b'\r\n' or line == b'\n':
+                            break
+                    break
+                content += await self.reader.readexactly( size )
+                await self.reader.readline()
+        elif 'content-length' in response_headers:
+            length = int(response_headers['content-length'])
+            content = await self.reader.readexactly( length ) if length > 0 else b''
+        else:
+            # the end of the body is marked by the server closing the connection
+            content = await self.reader.read( -1 )
+            keep_alive = False
+
+        if not keep_alive:
+            await self.close()
+
+        return HttpResponse( status_code, content, response_headers )
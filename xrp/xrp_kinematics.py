@@ -0,0 +1,134 @@
+from array import array
+
+#
+# Drive kinematics for the XRP control applications, which mix the driver station axis values into
+# the effort of each drive motor.
+#
+# The efforts are computed in preallocated float arrays, so the drive loop does not create any new
+# objects. When a combination of axis values asks for more than full effort on any motor, all the
+# efforts are scaled down by the largest absolute effort, so the robot keeps moving in the requested
+# direction rather than having the large efforts (positive or negative) clipped by the motor driver.
+#
+# The effort of a motor is only written when it has changed, which avoids setting the same effort on
+# every motor on every iteration of the drive loop.
+#
+# The efforts can optionally be slew-rate limited, which ramps each motor to a new effort rather than
+# stepping to it, to avoid wheel slip and tipping with sudden changes on the sticks. The slew rate
+# is the largest change in effort allowed per second, e.g. a slew rate of 4.0 ramps from stopped to
+# full effort in 0.25 seconds. A slew rate of 0 disables the limiting.
+#
+# Usage:
+#   kinematics = DriveKinematics( (left_motor, right_motor), period_ms=20, slew_rate=4.0 )
+#   <on each iteration of the drive loop>
+#   kinematics.arcade( speed, turn )
+#
+
+# motor indexes used by the mecanum drive
+MECANUM_FRONT_LEFT = 0
+MECANUM_FRONT_RIGHT = 1
+MECANUM_REAR_LEFT = 2
+MECANUM_REAR_RIGHT = 3
+
+class DriveKinematics():
+    #
+    # The motors are specified in the order used by the drive functions: left and right for arcade
+    # and tank drive, and front left, front right, rear left and rear right for mecanum drive. The
+    # effort of each motor listed in inverted is negated when it is written to the motor.
+    #
+    def __init__(self, motors, inverted=(), period_ms=20, slew_rate=0.0):
+        self.motors = motors
+        self.num_motors = len(motors)
+
+        # the efforts requested by the drive functions, and the efforts last written to the motors
+        self.efforts = array('f', [0.0] * self.num_motors)
+        self.applied = array('f', [0.0] * self.num_motors)
+        self.directions = array('f', [1.0] * self.num_motors)
+        for index in inverted:
+            self.directions[index] = -1.0
+
+        self.set_slew_rate( slew_rate, period_ms )
+        self.writes = 0
+
+    #
+    # Function sets the slew rate (in effort per second), converted to the largest change in
+    # effort allowed in each period of the drive loop
+    #
+    def set_slew_rate(self, slew_rate, period_ms):
+        self.max_step = float(slew_rate) * period_ms / 1000.0
+
+    def is_slew_limited(self):
+        return self.max_step > 0.0
+
+    #
+    # Function sets the effort of the left and right motors from the speed and turn axes
+    #
+    def arcade(self, speed, turn):
+        self.efforts[0] = speed - turn
+        self.efforts[1] = speed + turn
+        self.update()
+
+    #
+    # Function sets the effort of the left and right motors directly
+    #
+    def tank(self, left_effort, right_effort):
+        self.efforts[0] = left_effort
+        self.efforts[1] = right_effort
+        self.update()
+
+    #
+    # Function sets the effort of the four mecanum wheels from the speed, turn and twist axes
+    #
+    def mecanum(self, speed, turn, twist):
+        self.efforts[MECANUM_FRONT_LEFT] = speed - turn + twist
+        self.efforts[MECANUM_FRONT_RIGHT] = speed + turn - twist
+        self.efforts[MECANUM_REAR_LEFT] = speed + turn + twist
+        self.efforts[MECANUM_REAR_RIGHT] = speed - turn - twist
+        self.update()
+
+    #
+    # Function stops all the motors immediately, without any slew-rate limiting
+    #
+    def stop(self):
+        for index in range(self.num_motors):
+            self.efforts[index] = 0.0
+            if self.applied[index] != 0.0:
+                self.write( index )
+
+    #
+    # Function normalizes the requested efforts and writes the efforts that have changed to the
+    # motors, limiting the change in each effort to the slew rate if enabled
+    #
+    def update(self):
+        # find the largest absolute effort, and scale all the efforts relative to it if it exceeds
+        # the valid range of -1.0 to 1.0
+        max_effort = 0.0
+        for effort in self.efforts:
+            if effort > max_effort:
+                max_effort = effort
+            elif -effort > max_effort:
+                max_effort = -effort
+        if max_effort > 1.0:
+            for index in range(self.num_motors):
+                self.efforts[index] /= max_effort
+
+        max_step = self.max_step
+        for index in range(self.num_motors):
+            if max_step > 0.0:
+                change = self.efforts[index] - self.applied[index]
+                if change > max_step:
+                    self.efforts[index] = self.applied[index] + max_step
+                elif change < -max_step:
+                    self.efforts[index] = self.applied[index] - max_step
+            if self.efforts[index] != self.applied[index]:
+                self.write( index )
+
+    def write(self, index):
+        self.applied[index] = self.efforts[index]
+        self.motors[index].set_effort( self.applied[index] * self.directions[index] )
+        self.writes += 1
+
+    #
+    # Function returns the efforts last written to the motors
+    #
+    def get_efforts(self):
+        return self.applied
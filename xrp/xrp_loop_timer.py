@@ -0,0 +1,143 @@
+import asyncio
+import time
+
+#
+# Fixed-rate scheduler for the periodic control loops on the XRP.
+#
+# Sleeping for a fixed time after the work of each iteration makes the real period of the loop
+# the sleep time plus however long the work, and any other tasks that run in the meantime, took.
+# Instead, the loop timer keeps a deadline that advances by exactly one period each iteration and
+# only sleeps for the time remaining until that deadline, so the loop keeps a true fixed period
+# as long as the work fits within it.
+#
+# If an iteration overruns its deadline, the next iteration starts right away. If the loop falls
+# more than a whole period behind, the missed deadlines are skipped rather than run back-to-back
+# to catch up.
+#
+# The timer records the statistics for the loop, which are reported to the FMS in the status:
+#   iterations    - number of iterations run
+#   overruns      - number of iterations that were still running when their deadline passed
+#   skipped       - number of deadlines skipped because the loop fell a whole period behind
+#   mean_jitter   - mean difference (in milliseconds) between the deadline and the actual start
+#                   of each iteration
+#   max_jitter    - largest difference (in milliseconds) between the deadline and the actual start
+#                   of an iteration
+#   max_work      - longest time (in milliseconds) spent in the work of an iteration
+#
+# Usage:
+#   timer = LoopTimer( 20 )
+#   timer.start()
+#   while True:
+#       <do the work of the iteration>
+#       await timer.wait()
+#
+class LoopTimer():
+    def __init__(self, period_ms):
+        self.period_ms = period_ms
+        self.period_us = int(period_ms * 1000)
+        self.deadline = time.ticks_us()
+        self.iteration_start = self.deadline
+        self.last_jitter_us = 0
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.iterations = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.total_jitter_us = 0
+        self.max_jitter_us = 0
+        self.max_work_us = 0
+
+    #
+    # Function starts the schedule, with the first deadline one period from now
+    #
+    def start(self):
+        self.iteration_start = time.ticks_us()
+        self.deadline = time.ticks_add( self.iteration_start, self.period_us )
+
+    #
+    # Function waits until the deadline for the next iteration, allowing the other tasks to run
+    #
+    async def wait(self):
+        remaining_us = self.end_iteration()
+        if remaining_us > 0:
+            await asyncio.sleep_ms( (remaining_us + 500) // 1000 )
+        else:
+            # yield so that the other tasks still get to run
+            await asyncio.sleep_ms(0)
+        self.start_iteration()
+
+    #
+    # Function blocks until the deadline for the next iteration, used by loops that run on their
+    # own core rather than as an asyncio task
+    #
+    def wait_blocking(self):
+        remaining_us = self.end_iteration()
+        if remaining_us > 0:
+            time.sleep_us( remaining_us )
+        self.start_iteration()
+
+    #
+    # Function records the time spent in the work of the iteration that just completed, and
+    # returns the time remaining (in microseconds) until the deadline for the next iteration
+    #
+    def end_iteration(self):
+        now = time.ticks_us()
+        work_us = time.ticks_diff( now, self.iteration_start )
+        if work_us > self.max_work_us:
+            self.max_work_us = work_us
+
+        remaining_us = time.ticks_diff( self.deadline, now )
+        if remaining_us <= 0:
+            self.overruns += 1
+            missed = (-remaining_us) // self.period_us
+            if missed > 0:
+                self.skipped += missed
+                self.deadline = time.ticks_add( self.deadline, missed * self.period_us )
+        return remaining_us
+
+    #
+    # Function records the jitter at the start of the next iteration and advances the deadline
+    #
+    def start_iteration(self):
+        now = time.ticks_us()
+        jitter_us = abs( time.ticks_diff(now, self.deadline) )
+        self.last_jitter_us = jitter_us
+        self.total_jitter_us += jitter_us
+        if jitter_us > self.max_jitter_us:
+            self.max_jitter_us = jitter_us
+
+        self.iterations += 1
+        self.iteration_start = now
+        self.deadline = time.ticks_add( self.deadline, self.period_us )
+
+    #
+    # Functions return the jitter (in milliseconds) of the last iteration, and the number of
+    # overruns since the statistics were last reset
+    #
+    def get_last_jitter(self):
+        return self.last_jitter_us / 1000.0
+
+    def get_overruns(self):
+        return self.overruns
+
+    #
+    # Function returns the statistics for the loop, optionally resetting them so that the next
+    # report covers only the iterations that follow
+    #
+    def get_stats(self, reset=False):
+        stats = {}
+        stats['period'] = self.period_ms
+        stats['iterations'] = self.iterations
+        stats['overruns'] = self.overruns
+        stats['skipped'] = self.skipped
+        if self.iterations > 0:
+            stats['mean_jitter'] = round( self.total_jitter_us / self.iterations / 1000.0, 2 )
+        else:
+            stats['mean_jitter'] = 0.0
+        stats['max_jitter'] = round( self.max_jitter_us / 1000.0, 2 )
+        stats['max_work'] = round( self.max_work_us / 1000.0, 2 )
+
+        if reset:
+            self.reset_stats()
+        return stats
@@ -3,6 +3,7 @@ from XRPLib.defaults import *
 import asyncio
 
 from xrp_control import XrpControl, read_config
+from xrp_kinematics import DriveKinematics, MECANUM_REAR_LEFT, MECANUM_REAR_RIGHT
 
 from xrp_led_strip import XrpLedStrip
 
@@ -10,8 +11,8 @@ from xrp_led_strip import XrpLedStrip
 # to the XRP. These events correspond to the Xbox Controller buttons and
 # axis controls.
 #
-# At present, this dictionary is included to define all the expected events. 
-# Additional functionality will be added to make more use of the dictionary.
+# Handlers are only registered for the controls that are enabled in this
+# dictionary, so events for any other controls are ignored when received.
 #
 control_events = {
     'ButtonA':        { 'type': 'BUTTON', 'enabled': True },
@@ -42,10 +43,14 @@ right_rear_motor = EncodedMotor.get_default_encoded_motor(index=4)
 #
 class XrpMecanum(XrpControl):
     def __init__(self, config):
-        super().__init__(config, application='XRP_Mecanum')
+        super().__init__(config, application='XRP_Mecanum', control_events=control_events)
         
         self.current_twist = 0.0
-        self.motor_effort = [0.0, 0.0, 0.0, 0.0]
+
+        # the rear motors are mounted facing the other way, so their efforts are inverted
+        self.kinematics = DriveKinematics( (left_motor, right_motor, left_rear_motor, right_rear_motor),
+                                           inverted=(MECANUM_REAR_LEFT, MECANUM_REAR_RIGHT),
+                                           period_ms=self.drive_timer.period_ms, slew_rate=self.slew_rate )
 
         self.xrp_bling = None
         led_config = config.get('led_strip')
@@ -55,69 +60,53 @@ class XrpMecanum(XrpControl):
             except:
                 print('Error initializing XRP LED Strip')
 
-    async def drive_task(self):
-        print( 'Starting Mecanum Drive Task')
-        while True:
-            # set the effort of each wheel based on the current axis values
-            self.motor_effort[0] = self.current_speed - self.current_turn + self.current_twist
-            self.motor_effort[1] = self.current_speed + self.current_turn - self.current_twist
-            self.motor_effort[2] = self.current_speed + self.current_turn + self.current_twist
-            self.motor_effort[3] = self.current_speed - self.current_turn - self.current_twist
-            
-            # find the maximum value across all the effort values so that we can normalize
-            # them for the valid range 0.0-1.0
-            max_effort = 0.0
-            for effort in self.motor_effort:
-                if effort > max_effort:
-                    max_effort = effort
-            
-            # if the maximum effort exceeds 1.0, then scale all the values relative to the
-            # maximum values
-            if max_effort > 1.0:
-                for i in range(0,len(self.motor_effort)):
-                    self.motor_effort[i] /= max_effort
-            
-            # set the effort for each of the motors, keeping in mind that the rear motor
-            # settings need to be inverted
-            left_motor.set_effort( self.motor_effort[0] )
-            right_motor.set_effort( self.motor_effort[1] )
-            left_rear_motor.set_effort( self.motor_effort[2] * -1.0 )
-            right_rear_motor.set_effort( self.motor_effort[3] * -1.0 )
-
-            # pause to allow other tasks to run
-            await asyncio.sleep_ms(20)
+    #
+    # Function performs a single iteration of the drive loop, setting the effort of each
+    # mecanum wheel from the current speed, turn and twist
+    #
+    def drive_step(self):
+        with self.state_lock:
+            current_speed = self.current_speed
+            current_turn = self.current_turn
+            current_twist = self.current_twist
+
+        # set the effort of each wheel based on the current axis values, normalized to the
+        # valid range -1.0 to 1.0
+        self.kinematics.mecanum( current_speed, current_turn, current_twist )
+
+    #
+    # Function stops the robot, including any twist
+    #
+    def stop_movement(self):
+        super().stop_movement()
+        with self.state_lock:
+            self.current_twist = 0.0
 
     #
-    # Function processes the Event command, interpreting the event type and 
-    # invoking the appropriate robot control behavior specified by the event
+    # Function registers the handlers for the control events. The buttons toggle
+    # the colors of the LED strip.
     #
-    def process_event( self, event, args ):
-        #print( 'Processing Event: %s, Args %s' % (event,str(args)))
-        if event == 'LeftJoystickY':
-            self.current_speed = float(args[0]) * -1.0
-        elif event == 'LeftJoystickX':
-            self.current_turn = float(args[0]) * -1.0
-        elif event == 'RightJoystickX':
-            self.current_twist = float(args[0]) * 1.0
-        elif event == 'ButtonA':
-            if int(args[0]) == 1:
-                if self.xrp_bling:
-                    self.xrp_bling.set_color('green', toggle=True)
-        elif event == 'ButtonB':
-            if int(args[0]) == 1:
-                if self.xrp_bling:
-                    self.xrp_bling.set_color('red', toggle=True)
-        elif event == 'ButtonX':
-            if int(args[0]) == 1:
-                if self.xrp_bling:
-                    self.xrp_bling.set_color('blue', toggle=True)
-        elif event == 'ButtonY':
-            if int(args[0]) == 1:
-                if self.xrp_bling:
-                    self.xrp_bling.set_color('yellow', toggle=True)
-        else:
-            # add more event handling operations here...
-            super().process_event(event, args)
+    def register_handlers( self ):
+        super().register_handlers()
+        self.register_handler( 'LeftJoystickY', self.set_speed )
+        self.register_handler( 'LeftJoystickX', self.set_mecanum_turn )
+        self.register_handler( 'RightJoystickX', self.set_twist )
+        self.register_handler( 'ButtonA', lambda value: self.toggle_color( 'green', value ) )
+        self.register_handler( 'ButtonB', lambda value: self.toggle_color( 'red', value ) )
+        self.register_handler( 'ButtonX', lambda value: self.toggle_color( 'blue', value ) )
+        self.register_handler( 'ButtonY', lambda value: self.toggle_color( 'yellow', value ) )
+        # add more event handlers here...
+
+    def set_mecanum_turn( self, value ):
+        self.current_turn = value * -1.0
+
+    def set_twist( self, value ):
+        self.current_twist = value * 1.0
+
+    def toggle_color( self, color, value ):
+        if value == 1:
+            if self.xrp_bling:
+                self.xrp_bling.set_color(color, toggle=True)
 
 if __name__ == '__main__':
 
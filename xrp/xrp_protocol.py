@@ -0,0 +1,194 @@
+import struct
+
+#
+# Definitions for the wire formats used between the driver station and the XRP.
+#
+# Two wire formats are supported on a control connection:
+#
+#   TEXT   - the original newline terminated ASCII protocol of the form:
+#                Event:<control name>:<value>\n
+#
+#   BINARY - fixed-size binary frames, each starting with a one byte frame type.
+#            Event frames carry a one byte control ID and a signed 16-bit fixed-point
+#            value in network byte order. Snapshot frames carry the fixed-point value
+#            of every control, indexed by control ID.
+#
+# Every connection starts out using the TEXT format. The driver station requests
+# the BINARY format by sending the text command 'Protocol:BIN', and the XRP
+# acknowledges the request by echoing the same command back. All data received
+# after the request is decoded as binary frames.
+#
+# UDP control datagrams always use the BINARY format. Each datagram carries a
+# header with a sequence number and the driver station timestamp (in ms),
+# followed by a single binary frame.
+#
+# Once the BINARY format is in use, the XRP may send telemetry frames back to the
+# driver station on the same connection (or to the address of the driver station
+# for UDP). Telemetry frames carry their own size and a mask of the fields they
+# include, so the set of fields can be configured on the XRP.
+#
+# The driver station periodically sends a ping (a 'Ping' text command or a ping
+# frame) to measure the round trip time and the offset between the driver station
+# and XRP clocks. The XRP replies to each ping with a pong in the same format,
+# carrying the time at which it received the ping and sent the reply.
+#
+
+WIRE_FORMAT_TEXT   = 'TEXT'
+WIRE_FORMAT_BINARY = 'BIN'
+
+PROTOCOL_COMMAND = 'Protocol'
+
+# Frame type identifiers for the binary wire format
+FRAME_EVENT = 0x45      # 'E'
+FRAME_SNAPSHOT = 0x53   # 'S'
+
+# Event frame: frame type, control ID, fixed-point value
+EVENT_FRAME_FORMAT = '>BBh'
+EVENT_FRAME_SIZE = struct.calcsize(EVENT_FRAME_FORMAT)
+
+# Control values are sent as fixed-point integers in thousandths
+VALUE_SCALE = 1000
+
+# Table of control IDs. The position of the control within the table is the
+# control ID used in the binary frames. This table must match the table in the
+# driver station xrp_protocol.py module.
+CONTROL_IDS = (
+    'ButtonA',
+    'ButtonB',
+    'ButtonX',
+    'ButtonY',
+    'LeftBumper',
+    'RightBumper',
+    'Select',
+    'Start',
+    'LeftThumb',
+    'RightThumb',
+    'LeftJoystickX',
+    'LeftJoystickY',
+    'LeftTrigger',
+    'RightJoystickX',
+    'RightJoystickY',
+    'RightTrigger',
+    'HatX',
+    'HatY',
+    'LED'
+)
+
+NUM_CONTROLS = len(CONTROL_IDS)
+
+CONTROL_ID_MAP = { name: control_id for control_id, name in enumerate(CONTROL_IDS) }
+
+# Snapshot frame: frame type, followed by the fixed-point value of each control in
+# control ID order
+SNAPSHOT_FRAME_FORMAT = '>B%dh' % NUM_CONTROLS
+SNAPSHOT_FRAME_SIZE = struct.calcsize(SNAPSHOT_FRAME_FORMAT)
+
+# UDP datagram header: sequence number, driver station timestamp in milliseconds
+DATAGRAM_HEADER_FORMAT = '>II'
+DATAGRAM_HEADER_SIZE = struct.calcsize(DATAGRAM_HEADER_FORMAT)
+
+# Ping frame, sent from the driver station to measure the round trip time: frame type, ping
+# sequence number, driver station timestamp in milliseconds
+FRAME_PING = 0x50       # 'P'
+PING_FRAME_FORMAT = '>BII'
+PING_FRAME_SIZE = struct.calcsize(PING_FRAME_FORMAT)
+
+# Pong frame, sent by the XRP in reply to each ping: frame type, size of the frame in bytes, ping
+# sequence number, driver station timestamp from the ping, XRP timestamps (in milliseconds) at
+# which the ping was received and the pong was sent
+FRAME_PONG = 0x70       # 'p'
+PONG_FRAME_FORMAT = '>BBIIII'
+PONG_FRAME_SIZE = struct.calcsize(PONG_FRAME_FORMAT)
+
+# Text commands used for the ping and pong in the TEXT wire format:
+#     Ping:<sequence>:<driver station timestamp>
+#     Pong:<sequence>:<driver station timestamp>:<XRP receive timestamp>:<XRP transmit timestamp>
+PING_COMMAND = 'Ping'
+PONG_COMMAND = 'Pong'
+
+# Telemetry frame, sent from the XRP to the driver station: frame type, size of the frame in
+# bytes, bit mask of the fields included in the frame, XRP timestamp in milliseconds, followed by
+# the value of each included field in field ID order
+FRAME_TELEMETRY = 0x54  # 'T'
+TELEMETRY_HEADER_FORMAT = '>BBHI'
+TELEMETRY_HEADER_SIZE = struct.calcsize(TELEMETRY_HEADER_FORMAT)
+
+# Table of telemetry fields. The position of the field within the table is the field ID, which
+# is the bit number of the field in the field mask. Each field is sent as an integer with the
+# given struct format, holding the value multiplied by the scale. This table must match the table
+# in the driver station xrp_protocol.py module.
+#
+#   left_encoder, right_encoder - drive motor encoder positions, in counts
+#   left_effort, right_effort   - drive motor efforts, -1.0 to 1.0
+#   yaw                         - IMU yaw, in degrees
+#   distance                    - rangefinder distance, in cm
+#   loop_jitter                 - jitter of the last drive loop iteration, in ms
+#   loop_overruns               - drive loop overruns since the last status report to the FMS
+#   battery                     - battery voltage, in volts
+TELEMETRY_FIELDS = (
+    ( 'left_encoder',  'i', 1 ),
+    ( 'right_encoder', 'i', 1 ),
+    ( 'left_effort',   'h', 1000 ),
+    ( 'right_effort',  'h', 1000 ),
+    ( 'yaw',           'h', 10 ),
+    ( 'distance',      'H', 10 ),
+    ( 'loop_jitter',   'H', 100 ),
+    ( 'loop_overruns', 'H', 1 ),
+    ( 'battery',       'H', 1000 )
+)
+
+# Size of each binary frame, including the frame type, indexed by frame type
+FRAME_SIZES = {
+    FRAME_EVENT: EVENT_FRAME_SIZE,
+    FRAME_SNAPSHOT: SNAPSHOT_FRAME_SIZE,
+    FRAME_PING: PING_FRAME_SIZE
+}
+
+#
+# Function returns the text command used to request or acknowledge the specified
+# wire format
+#
+def protocol_command( wire_format ):
+    return '%s:%s\n' % (PROTOCOL_COMMAND, wire_format)
+
+#
+# Function decodes a binary event frame, returning the control ID and the
+# control value
+#
+def decode_event_frame( frame, offset=0 ):
+    frame_type, control_id, fixed = struct.unpack_from( EVENT_FRAME_FORMAT, frame, offset )
+    return control_id, fixed / VALUE_SCALE
+
+#
+# Function decodes a binary snapshot frame, returning the fixed-point value of
+# each control indexed by control ID
+#
+def decode_snapshot_frame( frame, offset=0 ):
+    return struct.unpack_from( SNAPSHOT_FRAME_FORMAT, frame, offset )[1:]
+
+#
+# Function decodes the header of a UDP control datagram, returning the sequence
+# number and the driver station timestamp
+#
+def decode_datagram_header( datagram ):
+    return struct.unpack_from( DATAGRAM_HEADER_FORMAT, datagram, 0 )
+
+#
+# Function returns the signed difference between two 32-bit values that may
+# have wrapped, such as sequence numbers and millisecond timestamps
+#
+def diff32( a, b ):
+    diff = (a - b) & 0xFFFFFFFF
+    if diff & 0x80000000:
+        diff -= 0x100000000
+    return diff
+
+#
+# Function returns the struct format of a telemetry frame carrying the fields in the field mask
+#
+def telemetry_frame_format( field_mask ):
+    frame_format = TELEMETRY_HEADER_FORMAT
+    for field_id, field in enumerate(TELEMETRY_FIELDS):
+        if field_mask & (1 << field_id):
+            frame_format += field[1]
+    return frame_format
@@ -0,0 +1,292 @@
+from xrp_protocol import *
+
+#
+# Receive path for the driver station control connection.
+#
+# Data read from the connection is placed in a preallocated ring buffer and the commands are parsed
+# in place, so that receiving a command does not create any intermediate strings or lists. Creating
+# those objects for every command causes the garbage collector to run frequently while driving,
+# which shows up as stutter in the robot movement.
+#
+# In the TEXT wire format, each newline terminated command of the form:
+#     Event:<control name>:<value>
+# is dispatched to the controller by calling controller.dispatch_event(control_id, value), with the
+# control ID looked up from a table of the control names and the value parsed directly into a
+# number. Commands for controls that are not in the table are ignored. Values that are not numeric
+# are decoded into new strings, which only happens for unexpected commands. Ping commands of the
+# form:
+#     Ping:<sequence>:<timestamp>
+# are passed to the controller by calling controller.process_ping(sequence, timestamp).
+#
+# In the BINARY wire format, each frame is passed to controller.process_frame(buffer, offset)
+# directly from the ring buffer. Frames that wrap around the end of the ring buffer are first
+# copied into a preallocated frame buffer.
+#
+
+# size of the ring buffer, which must be a power of two
+RX_BUFFER_SIZE = 256
+RX_BUFFER_MASK = RX_BUFFER_SIZE - 1
+
+NEWLINE = 0x0A
+CARRIAGE_RETURN = 0x0D
+COLON = 0x3A
+MINUS = 0x2D
+PLUS = 0x2B
+PERIOD = 0x2E
+DIGIT_ZERO = 0x30
+DIGIT_NINE = 0x39
+
+EVENT_COMMANDS = ( b'Event', b'EV' )
+PROTOCOL_KEYWORD = PROTOCOL_COMMAND.encode('utf-8')
+PING_KEYWORD = PING_COMMAND.encode('utf-8')
+WIRE_FORMAT_BINARY_KEYWORD = WIRE_FORMAT_BINARY.encode('utf-8')
+
+# size of the largest binary frame, used to size the frame buffer
+MAX_FRAME_SIZE = max( FRAME_SIZES.values() )
+
+#
+# Function returns the hash used to look up the names in the command table
+#
+def name_hash( value, hash_value=0 ):
+    return ((hash_value * 31) + value) & 0xFFFF
+
+class CommandReceiver():
+    #
+    # The command names are specified as a dictionary mapping each name that may appear in a command
+    # to the control ID passed to the controller (e.g. 'LX' -> ID of 'LeftJoystickX').
+    #
+    def __init__(self, command_names, debug=False):
+        self.buffer = bytearray(RX_BUFFER_SIZE)
+        self.view = memoryview(self.buffer)
+        self.frame_buffer = bytearray(MAX_FRAME_SIZE)
+        self.debug = debug
+
+        # table of command names keyed by the hash of the name, with a list of the names sharing
+        # each hash so that the name can be verified
+        self.names = {}
+        for name, control_id in command_names.items():
+            encoded = name.encode('utf-8')
+            hash_value = 0
+            for value in encoded:
+                hash_value = name_hash( value, hash_value )
+            self.names.setdefault( hash_value, [] ).append( (encoded, control_id) )
+
+        self.reset()
+
+    def reset(self):
+        self.head = 0
+        self.tail = 0
+        self.count = 0
+        # number of bytes from the tail already searched for a newline
+        self.scanned = 0
+        self.wire_format = WIRE_FORMAT_TEXT
+
+    #
+    # Function reads the available data from the stream into the free space in the ring buffer.
+    # Returns the number of bytes read, which is 0 if the connection has been closed.
+    #
+    async def receive(self, stream):
+        if self.count == RX_BUFFER_SIZE:
+            # the buffer is full of data that cannot be parsed, so discard it
+            print( 'Receive Buffer Overflow, Discarding Data' )
+            self.consume( self.count )
+
+        # read into the contiguous free space following the head of the buffer
+        if self.head >= self.tail:
+            end = RX_BUFFER_SIZE
+        else:
+            end = self.tail
+        received = await stream.readinto( self.view[self.head:end] )
+        if received:
+            self.head = (self.head + received) & RX_BUFFER_MASK
+            self.count += received
+        return received
+
+    def consume(self, size):
+        self.tail = (self.tail + size) & RX_BUFFER_MASK
+        self.count -= size
+        self.scanned = 0
+
+    #
+    # Function parses and dispatches all the complete commands or frames in the buffer. If a request
+    # to change the wire format is received, the parsing stops and the requested wire format is
+    # returned so that the request can be acknowledged. Otherwise, None is returned.
+    #
+    def process(self, controller):
+        while self.count > 0:
+            if self.wire_format == WIRE_FORMAT_BINARY:
+                frame_type = self.buffer[self.tail]
+                frame_size = FRAME_SIZES.get( frame_type, 0 )
+                if frame_size == 0:
+                    # no way to find the start of the next frame, so the connection must be closed
+                    print( 'Unexpected Frame Type: %d, Closing Socket' % frame_type )
+                    raise OSError
+                if self.count < frame_size:
+                    break
+
+                if self.tail + frame_size <= RX_BUFFER_SIZE:
+                    controller.process_frame( self.buffer, self.tail )
+                else:
+                    for index in range(frame_size):
+                        self.frame_buffer[index] = self.buffer[(self.tail + index) & RX_BUFFER_MASK]
+                    controller.process_frame( self.frame_buffer, 0 )
+                self.consume( frame_size )
+            else:
+                length = self.find_newline()
+                if length < 0:
+                    break
+                requested = self.process_line( controller, self.tail, length )
+                self.consume( length + 1 )
+                if requested:
+                    return requested
+        return None
+
+    #
+    # Function returns the length of the line at the tail of the buffer, not including the newline,
+    # or -1 if a complete line has not been received yet
+    #
+    def find_newline(self):
+        while self.scanned < self.count:
+            if self.buffer[(self.tail + self.scanned) & RX_BUFFER_MASK] == NEWLINE:
+                return self.scanned
+            self.scanned += 1
+        return -1
+
+    def find_byte(self, start, length, value):
+        for index in range(length):
+            if self.buffer[(start + index) & RX_BUFFER_MASK] == value:
+                return index
+        return -1
+
+    def matches(self, start, length, expected):
+        if length != len(expected):
+            return False
+        for index in range(length):
+            if self.buffer[(start + index) & RX_BUFFER_MASK] != expected[index]:
+                return False
+        return True
+
+    #
+    # Function decodes the bytes into a new string, used for debug output and unexpected commands
+    #
+    def decode(self, start, length):
+        data = bytearray(length)
+        for index in range(length):
+            data[index] = self.buffer[(start + index) & RX_BUFFER_MASK]
+        return str(data, 'utf-8')
+
+    #
+    # Function returns the control ID for the command name, or None if the name is not in the table
+    #
+    def lookup_name(self, start, length):
+        hash_value = 0
+        for index in range(length):
+            hash_value = name_hash( self.buffer[(start + index) & RX_BUFFER_MASK], hash_value )
+        for encoded, control_id in self.names.get( hash_value, () ):
+            if self.matches( start, length, encoded ):
+                return control_id
+        return None
+
+    #
+    # Function parses a decimal number of the form [-]digits[.digits], returning None if the bytes
+    # are not a valid number. Whole numbers are returned as integers.
+    #
+    def parse_number(self, start, length):
+        if length == 0:
+            return None
+
+        index = 0
+        negative = False
+        first = self.buffer[start & RX_BUFFER_MASK]
+        if first == MINUS or first == PLUS:
+            negative = (first == MINUS)
+            index = 1
+
+        whole = 0
+        fraction = 0
+        divisor = 1
+        digits = 0
+        in_fraction = False
+        while index < length:
+            value = self.buffer[(start + index) & RX_BUFFER_MASK]
+            if value >= DIGIT_ZERO and value <= DIGIT_NINE:
+                if in_fraction:
+                    fraction = fraction * 10 + (value - DIGIT_ZERO)
+                    divisor *= 10
+                else:
+                    whole = whole * 10 + (value - DIGIT_ZERO)
+                digits += 1
+            elif value == PERIOD and not in_fraction:
+                in_fraction = True
+            else:
+                return None
+            index += 1
+
+        if digits == 0:
+            return None
+        if in_fraction:
+            number = whole + fraction / divisor
+        else:
+            number = whole
+        if negative:
+            number = -number
+        return number
+
+    #
+    # Function parses and dispatches a single text command
+    #
+    def process_line(self, controller, start, length):
+        # ignore the carriage return if the line is terminated with \r\n
+        if length > 0 and self.buffer[(start + length - 1) & RX_BUFFER_MASK] == CARRIAGE_RETURN:
+            length -= 1
+        if length == 0:
+            return None
+
+        if self.debug:
+            print( 'Received: %s' % self.decode(start, length) )
+
+        separator = self.find_byte( start, length, COLON )
+        if separator < 0:
+            print( 'Ignoring Unexpected Command: %s' % self.decode(start, length) )
+            return None
+
+        args_start = start + separator + 1
+        args_length = length - separator - 1
+        if self.matches( start, separator, EVENT_COMMANDS[0] ) or self.matches( start, separator, EVENT_COMMANDS[1] ):
+            name_length = self.find_byte( args_start, args_length, COLON )
+            if name_length < 0:
+                name_length = args_length
+                value_length = 0
+            else:
+                value_length = args_length - name_length - 1
+            value_start = args_start + name_length + 1
+
+            control_id = self.lookup_name( args_start, name_length )
+            if control_id is None:
+                if self.debug:
+                    print( 'Ignoring Unknown Control: %s' % self.decode(args_start, name_length) )
+                return None
+
+            value = self.parse_number( value_start, value_length )
+            if value is None and value_length > 0:
+                # pass non-numeric values on as a string
+                value = self.decode( value_start, value_length )
+
+            controller.status = 'Processing Command'
+            controller.dispatch_event( control_id, value )
+        elif self.matches( start, separator, PING_KEYWORD ):
+            sequence_length = self.find_byte( args_start, args_length, COLON )
+            if sequence_length > 0:
+                sequence = self.parse_number( args_start, sequence_length )
+                timestamp = self.parse_number( args_start + sequence_length + 1, args_length - sequence_length - 1 )
+                if sequence is not None and timestamp is not None:
+                    controller.process_ping( int(sequence), int(timestamp) )
+        elif self.matches( start, separator, PROTOCOL_KEYWORD ):
+            if self.matches( args_start, args_length, WIRE_FORMAT_BINARY_KEYWORD ):
+                self.wire_format = WIRE_FORMAT_BINARY
+            else:
+                self.wire_format = WIRE_FORMAT_TEXT
+            return self.wire_format
+        else:
+            print( 'Ignoring Unexpected Command: %s' % self.decode(start, length) )
+        return None
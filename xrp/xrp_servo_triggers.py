@@ -6,8 +6,8 @@ from xrp_control import XrpControl, read_config
 # to the XRP. These events correspond to the Xbox Controller buttons and
 # axis controls.
 #
-# At present, this dictionary is included to define all the expected events. 
-# Additional functionality will be added to make more use of the dictionary.
+# Handlers are only registered for the controls that are enabled in this
+# dictionary, so events for any other controls are ignored when received.
 #
 control_events = {
     'ButtonA':        { 'type': 'BUTTON', 'enabled': True },
@@ -35,27 +35,29 @@ control_events = {
 #
 class XrpServoTriggers(XrpControl):
     def __init__(self, config):
-        super().__init__(config, application='XRP_BasePlusTriggers')
+        super().__init__(config, application='XRP_BasePlusTriggers', control_events=control_events)
         
     #
-    # Function processes the Event command, interpreting the event type and 
-    # invoking the appropriate robot control behavior specified by the event
+    # Function registers the handlers for the control events, with the triggers
+    # moving the servo arm
     #
-    def process_event( self, event, args ):
-        #print( 'Processing Event: %s, Args %s' % (event,str(args)))
-        if event == 'LeftTrigger':
-            # Lower the arm angle based on the trigger input
-            angle = self.max_angle - int(( self.max_angle * float(args[0]) ))
-            if angle < self.get_servo_angle():
-                self.set_servo_angle( angle )
-        elif event == 'RightTrigger':
-            # Raise the arm angle based on the trigger input
-            angle = int(( self.max_angle * float(args[0]) ))
-            if angle > self.get_servo_angle():
-                self.set_servo_angle( angle )
-        else:
-            # add more event handling operations here...
-            super().process_event(event,args)
+    def register_handlers( self ):
+        super().register_handlers()
+        self.register_handler( 'LeftTrigger', self.lower_arm )
+        self.register_handler( 'RightTrigger', self.raise_arm )
+        # add more event handlers here...
+
+    def lower_arm( self, value ):
+        # Lower the arm angle based on the trigger input
+        angle = self.max_angle - int(( self.max_angle * value ))
+        if angle < self.get_servo_angle():
+            self.set_servo_angle( angle )
+
+    def raise_arm( self, value ):
+        # Raise the arm angle based on the trigger input
+        angle = int(( self.max_angle * value ))
+        if angle > self.get_servo_angle():
+            self.set_servo_angle( angle )
 
 
 if __name__ == '__main__':
@@ -8,8 +8,8 @@ from xrp_control import XrpControl, read_config
 # to the XRP. These events correspond to the Xbox Controller buttons and
 # axis controls.
 #
-# At present, this dictionary is included to define all the expected events. 
-# Additional functionality will be added to make more use of the dictionary.
+# Handlers are only registered for the controls that are enabled in this
+# dictionary, so events for any other controls are ignored when received.
 #
 control_events = {
     'ButtonA':        { 'type': 'BUTTON', 'enabled': True },
@@ -37,30 +37,60 @@ control_events = {
 #
 class XrpTank(XrpControl):
     def __init__(self, config):
-        super().__init__(config, application='XRP_Tank')
+        super().__init__(config, application='XRP_Tank', control_events=control_events)
 
-    async def drive_task(self):
-        print( 'Starting Tank Drive Task')
-        while True:
-            # not much to do, as the axis controls set the individual motor effort
-            # directly.
-            
-            # pause to allow other tasks to run
-            await asyncio.sleep_ms(20)
+        # effort of each motor, set directly by the joysticks
+        self.left_effort = 0.0
+        self.right_effort = 0.0
+
+    #
+    # Function performs a single iteration of the drive loop. The joysticks set the effort of
+    # the motors directly, so the motors only need to be updated here when the drive loop runs
+    # on the second core, or when the efforts are slew-rate limited and ramp over several
+    # iterations. Otherwise the efforts are unchanged and nothing is written to the motors.
+    #
+    def drive_step(self):
+        with self.state_lock:
+            left_effort = self.left_effort
+            right_effort = self.right_effort
+        self.kinematics.tank( left_effort, right_effort )
  
     #
-    # Function processes the Event command, interpreting the event type and 
-    # invoking the appropriate robot control behavior specified by the event
+    # Function stops the robot, zeroing the efforts set by the joysticks as well as the speed and
+    # turn used by the other applications, as drive_step() keeps applying the efforts otherwise
+    #
+    def stop_movement(self):
+        super().stop_movement()
+        with self.state_lock:
+            self.left_effort = 0.0
+            self.right_effort = 0.0
+        self.apply_efforts()
+
+    #
+    # Function registers the handlers for the control events, with each joystick
+    # setting the effort of one motor directly
+    #
+    def register_handlers( self ):
+        super().register_handlers()
+        self.register_handler( 'LeftJoystickY', self.set_left_effort )
+        self.register_handler( 'RightJoystickY', self.set_right_effort )
+        # add more event handlers here...
+
+    def set_left_effort( self, value ):
+        self.left_effort = value * -1.0
+        self.apply_efforts()
+
+    def set_right_effort( self, value ):
+        self.right_effort = value * -1.0
+        self.apply_efforts()
+
+    #
+    # Function sets the motors as soon as an effort changes, unless the drive loop is running
+    # on the second core or the efforts are ramped by the drive loop
     #
-    def process_event( self, event, args ):
-        #print( 'Processing Event: %s, Args %s' % (event,str(args)))
-        if event == 'LeftJoystickY':
-            left_motor.set_effort( float(args[0]) * -1.0 )
-        elif event == 'RightJoystickY':
-            right_motor.set_effort( float(args[0]) * -1.0 )
-        else:
-            # add more event handling operations here...
-            super().process_event(event, args)
+    def apply_efforts( self ):
+        if not self.dual_core and not self.kinematics.is_slew_limited():
+            self.kinematics.tank( self.left_effort, self.right_effort )
 
 if __name__ == '__main__':
 
@@ -0,0 +1,100 @@
+import struct
+import time
+
+from xrp_protocol import *
+
+#
+# Telemetry sent from the XRP back to the driver station over the control connection.
+#
+# The telemetry is configured in the 'telemetry' section of the configuration file:
+#
+#   enabled - set to true to send telemetry frames (default false)
+#   rate    - number of frames sent per second (default 10)
+#   fields  - list of the names of the fields to include in each frame, from the telemetry
+#             field table in xrp_protocol.py (default DEFAULT_TELEMETRY_FIELDS)
+#
+# Example:
+#   "telemetry": {
+#       "enabled": true,
+#       "rate": 10,
+#       "fields": [ "left_encoder", "right_encoder", "yaw", "loop_jitter", "battery" ]
+#   }
+#
+# The value of each field is read from a source function provided by the control application.
+# Fields without a source (e.g. the battery voltage on an XRPLib version that does not report
+# it) are left out of the frames. Note that reading the rangefinder distance blocks until the
+# measurement completes, so it is not included by default.
+#
+# Telemetry frames are only sent on connections using the binary wire format.
+#
+DEFAULT_TELEMETRY_RATE = 10
+DEFAULT_TELEMETRY_FIELDS = ( 'left_encoder', 'right_encoder', 'left_effort', 'right_effort', 'yaw',
+                             'loop_jitter', 'loop_overruns' )
+
+# range of the integer values that can be sent with each struct format
+FIELD_LIMITS = {
+    'h': ( -32768, 32767 ),
+    'H': ( 0, 65535 ),
+    'i': ( -2147483648, 2147483647 )
+}
+
+class TelemetrySender():
+    #
+    # The sources are specified as a dictionary mapping each field name to a function returning
+    # the current value of the field, or None if the field is not available
+    #
+    def __init__(self, config, sources):
+        self.enabled = config.get('enabled', False)
+        rate = float(config.get('rate', DEFAULT_TELEMETRY_RATE))
+        if rate <= 0:
+            self.enabled = False
+            rate = DEFAULT_TELEMETRY_RATE
+        self.period_ms = int(1000 / rate)
+
+        names = config.get('fields', DEFAULT_TELEMETRY_FIELDS)
+        for name in names:
+            if name not in sources:
+                print( 'Ignoring Unknown Telemetry Field: %s' % name )
+
+        # the source, scale and limits of each field included in the frames, in field ID order
+        self.fields = list()
+        self.field_mask = 0
+        for field_id, (name, field_format, scale) in enumerate(TELEMETRY_FIELDS):
+            if name in names:
+                source = sources.get( name, None )
+                if source is None:
+                    print( 'Telemetry Field Not Available: %s' % name )
+                    continue
+                low, high = FIELD_LIMITS[field_format]
+                self.fields.append( (source, scale, low, high) )
+                self.field_mask |= (1 << field_id)
+
+        self.frame_format = telemetry_frame_format( self.field_mask )
+        self.frame_size = struct.calcsize( self.frame_format )
+        self.frame = bytearray( self.frame_size )
+        self.values = [0] * len(self.fields)
+        self.frames_sent = 0
+
+        if self.enabled:
+            print( 'Sending %d Byte Telemetry Frames Every %dms' % (self.frame_size, self.period_ms) )
+
+    #
+    # Function reads the current value of each field and encodes them in the telemetry frame,
+    # which is reused for every call
+    #
+    def encode(self):
+        for index, (source, scale, low, high) in enumerate(self.fields):
+            try:
+                value = int(round(source() * scale))
+            except (TypeError, ValueError, OSError):
+                value = 0
+            if value < low:
+                value = low
+            elif value > high:
+                value = high
+            self.values[index] = value
+
+        struct.pack_into( self.frame_format, self.frame, 0, FRAME_TELEMETRY, self.frame_size, self.field_mask,
+                          time.ticks_ms() & 0xFFFFFFFF, *self.values )
+        self.frames_sent += 1
+        return self.frame
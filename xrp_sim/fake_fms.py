@@ -0,0 +1,143 @@
+import hashlib
+import json
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#
+# Minimal stand-in for the FMS web application, implementing the endpoints used by the XRP
+# applications: device registration, status reporting and device configuration retrieval.
+#
+# The connections are kept alive between requests, as they are by the FMS web server, and every
+# response can be delayed to simulate a slow FMS. The device configuration is served with an ETag,
+# as it is by the FMS, and the responses that confirmed a cached configuration are counted.
+#
+DEVICE_CONFIG_FIELDS = ( 'name', 'protocol', 'port', 'alliance' )
+
+class FakeFms():
+    def __init__(self, host='127.0.0.1', port=0, delay=0.0):
+        self.devices = {}
+        self.request_counts = {}
+        self.connections = 0
+        self.not_modified = 0
+        self.delay = delay
+        self.lock = threading.Lock()
+
+        fms = self
+        class Handler(FmsRequestHandler):
+            pass
+        Handler.fms = fms
+
+        self.server = ThreadingHTTPServer( (host, port), Handler )
+        self.url_base = 'http://%s:%d' % self.server.server_address
+        self.thread = threading.Thread( target=self.server.serve_forever, daemon=True )
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def count_request(self, path):
+        with self.lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+        if self.delay > 0.0:
+            time.sleep( self.delay )
+
+    def count_connection(self):
+        with self.lock:
+            self.connections += 1
+
+class FmsRequestHandler(BaseHTTPRequestHandler):
+    fms = None
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.fms.count_connection()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, data, etag=None):
+        content = json.dumps(data).encode('utf-8')
+        try:
+            self.send_response( status )
+            self.send_header( 'Content-Type', 'application/json' )
+            self.send_header( 'Content-Length', str(len(content)) )
+            if etag:
+                self.send_header( 'ETag', etag )
+            self.end_headers()
+            self.wfile.write( content )
+        except (BrokenPipeError, ConnectionResetError):
+            # the XRP gave up waiting for the response
+            self.close_connection = True
+
+    def read_json(self):
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            return json.loads( self.rfile.read(length) )
+        except ValueError:
+            return None
+
+    def do_POST(self):
+        path = urllib.parse.urlparse(self.path).path
+        self.fms.count_request( path )
+        data = self.read_json()
+        if data is None or 'hardware_id' not in data:
+            self.send_json( 400, {'error': 'Invalid request'} )
+            return
+
+        with self.fms.lock:
+            if path == '/register/':
+                device = self.fms.devices.setdefault( data['hardware_id'], {} )
+                device.update( data )
+                device.setdefault( 'name', 'XRP-%s' % data['hardware_id'][-4:] )
+                device.setdefault( 'alliance', 'None' )
+            elif path == '/status/':
+                device = self.fms.devices.get( data['hardware_id'], None )
+                if device is None:
+                    self.send_json( 404, {'error': 'Unknown device'} )
+                    return
+                device['status'] = data.get('status', 'Unknown')
+            else:
+                self.send_json( 404, {'error': 'Unknown endpoint'} )
+                return
+        self.send_json( 200, {'result': 'OK'} )
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        self.fms.count_request( url.path )
+        query = urllib.parse.parse_qs( url.query )
+        if url.path == '/config/':
+            self.send_config( query.get('id', [''])[0] )
+            return
+        if url.path != '/api/devices/':
+            self.send_json( 404, {'error': 'Unknown endpoint'} )
+            return
+
+        with self.fms.lock:
+            devices = list(self.fms.devices.values())
+            if 'id' in query:
+                devices = [ device for device in devices if device['hardware_id'] in query['id'] ]
+        self.send_json( 200, devices )
+
+    def send_config(self, hardware_id):
+        with self.fms.lock:
+            device = self.fms.devices.get( hardware_id, None )
+            if device is None:
+                self.send_json( 404, {'error': 'Unknown device'} )
+                return
+            device_config = { key: device.get(key) for key in DEVICE_CONFIG_FIELDS }
+        etag = '"%s"' % hashlib.sha1( json.dumps(device_config, sort_keys=True).encode('utf-8') ).hexdigest()[:16]
+
+        if self.headers.get('If-None-Match', None) == etag:
+            with self.fms.lock:
+                self.fms.not_modified += 1
+            self.send_response( 304 )
+            self.send_header( 'ETag', etag )
+            self.end_headers()
+            return
+        self.send_json( 200, device_config, etag )
@@ -0,0 +1,59 @@
+import asyncio
+import time
+
+#
+# Adds the MicroPython extensions to the CPython asyncio and time modules that are used by the XRP
+# applications, so that the applications can run unmodified under CPython.
+#
+
+# MicroPython ticks wrap around at this period
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+TICKS_HALFPERIOD = TICKS_PERIOD // 2
+
+def ticks_ms():
+    return int(time.monotonic() * 1000) & TICKS_MAX
+
+def ticks_us():
+    return int(time.monotonic() * 1000000) & TICKS_MAX
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & TICKS_MAX
+
+def ticks_diff(ticks1, ticks2):
+    return ((ticks1 - ticks2 + TICKS_HALFPERIOD) & TICKS_MAX) - TICKS_HALFPERIOD
+
+def sleep_ms(ms):
+    time.sleep( ms / 1000.0 )
+
+def sleep_us(us):
+    time.sleep( us / 1000000.0 )
+
+async def async_sleep_ms(ms):
+    await asyncio.sleep( ms / 1000.0 )
+
+#
+# MicroPython uses a single Stream object for both directions of a connection, so the applications
+# query the connection details from the read stream
+#
+def stream_get_extra_info(stream, name, default=None):
+    return stream._transport.get_extra_info( name, default )
+
+#
+# MicroPython streams can read directly into a buffer
+#
+async def stream_readinto(stream, buf):
+    data = await stream.read( len(buf) )
+    buf[:len(data)] = data
+    return len(data)
+
+def install():
+    time.ticks_ms = ticks_ms
+    time.ticks_us = ticks_us
+    time.ticks_add = ticks_add
+    time.ticks_diff = ticks_diff
+    time.sleep_ms = sleep_ms
+    time.sleep_us = sleep_us
+    asyncio.sleep_ms = async_sleep_ms
+    asyncio.StreamReader.get_extra_info = stream_get_extra_info
+    asyncio.StreamReader.readinto = stream_readinto
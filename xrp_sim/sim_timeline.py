@@ -0,0 +1,49 @@
+import threading
+import time
+
+#
+# Timeline of the values set on the simulated XRP hardware. Each motor effort and servo angle
+# written by the XRP application is recorded with the time it was set, but only when the value
+# changes, so that the timeline shows when the robot actually responded to a command.
+#
+class Timeline():
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.entries = list()
+            self.curr_values = {}
+
+    def record(self, source, value):
+        now = time.monotonic()
+        with self.lock:
+            if self.curr_values.get(source, None) != value:
+                self.curr_values[source] = value
+                self.entries.append( (now, source, value) )
+
+    def get_entries(self, sources=None):
+        with self.lock:
+            if sources is None:
+                return list(self.entries)
+            return [ entry for entry in self.entries if entry[1] in sources ]
+
+    #
+    # Function returns the current value of each of the sources that has been set
+    #
+    def get_values(self, sources):
+        with self.lock:
+            return { source: self.curr_values[source] for source in sources if source in self.curr_values }
+
+    #
+    # Function writes the timeline to a CSV file, with the times relative to the start time
+    #
+    def save_csv(self, filename, start_time=0.0):
+        with open( filename, 'w' ) as fd:
+            fd.write( 'time_ms,source,value\n' )
+            for timestamp, source, value in self.get_entries():
+                fd.write( '%.3f,%s,%s\n' % ((timestamp - start_time) * 1000.0, source, value) )
+
+# timeline shared by all the simulated hardware
+timeline = Timeline()
@@ -0,0 +1,4 @@
+#
+# Simulated XRPLib. Each hardware object records the values written by the XRP application in the
+# simulator timeline instead of driving the hardware.
+#
@@ -0,0 +1,20 @@
+from .encoded_motor import EncodedMotor
+from .differential_drive import DifferentialDrive
+from .servo import Servo
+from .sensors import IMU, Rangefinder, Reflectance, Board, Webserver
+
+#
+# Simulated default XRP hardware, matching the set of objects provided by XRPLib.defaults
+#
+left_motor = EncodedMotor.get_default_encoded_motor(index=1)
+right_motor = EncodedMotor.get_default_encoded_motor(index=2)
+motor_three = EncodedMotor.get_default_encoded_motor(index=3)
+motor_four = EncodedMotor.get_default_encoded_motor(index=4)
+drivetrain = DifferentialDrive(left_motor, right_motor)
+imu = IMU()
+rangefinder = Rangefinder()
+reflectance = Reflectance()
+servo_one = Servo.get_default_servo(index=1)
+servo_two = Servo.get_default_servo(index=2)
+board = Board()
+webserver = Webserver()
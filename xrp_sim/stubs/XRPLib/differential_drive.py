@@ -0,0 +1,17 @@
+from .encoded_motor import EncodedMotor
+
+class DifferentialDrive():
+    def __init__(self, left_motor, right_motor):
+        self.left_motor = left_motor
+        self.right_motor = right_motor
+
+    def set_effort(self, left_effort, right_effort):
+        self.left_motor.set_effort( left_effort )
+        self.right_motor.set_effort( right_effort )
+
+    def stop(self):
+        self.set_effort( 0.0, 0.0 )
+
+    def arcade(self, straight, turn):
+        scale = max( 1.0, abs(straight) + abs(turn) )
+        self.set_effort( (straight - turn) / scale, (straight + turn) / scale )
@@ -0,0 +1,47 @@
+from sim_timeline import timeline
+
+# names used for the motors in the timeline, indexed by the motor index
+MOTOR_NAMES = { 1: 'left_motor', 2: 'right_motor', 3: 'motor_three', 4: 'motor_four' }
+
+# encoder counts per revolution of the XRP motor output shaft
+COUNTS_PER_REVOLUTION = 585
+
+class EncodedMotor():
+    default_motors = {}
+
+    @classmethod
+    def get_default_encoded_motor(cls, index=1):
+        motor = cls.default_motors.get( index, None )
+        if motor is None:
+            motor = EncodedMotor( MOTOR_NAMES.get(index, 'motor_%d' % index) )
+            cls.default_motors[index] = motor
+        return motor
+
+    def __init__(self, name):
+        self.name = name
+        self.effort = 0.0
+        self.speed = 0.0
+        self.position = 0.0
+
+    def set_effort(self, effort):
+        self.effort = max( -1.0, min(1.0, float(effort)) )
+        timeline.record( self.name, self.effort )
+
+    def get_effort(self):
+        return self.effort
+
+    def set_speed(self, speed_rpm=None):
+        self.speed = speed_rpm if speed_rpm else 0.0
+        timeline.record( '%s_speed' % self.name, self.speed )
+
+    def get_speed(self):
+        return self.speed
+
+    def get_position(self):
+        return self.position
+
+    def get_position_counts(self):
+        return int(round(self.position * COUNTS_PER_REVOLUTION))
+
+    def reset_encoder_position(self):
+        self.position = 0.0
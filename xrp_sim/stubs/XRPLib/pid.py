@@ -0,0 +1,19 @@
+class PID():
+    def __init__(self, kp=1.0, ki=0.0, kd=0.0, min_output=0.0, max_output=1.0, max_derivative=None,
+                 max_integral=None, tolerance=0.1, tolerance_count=1):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.max_output = max_output
+        self.prev_error = 0.0
+        self.integral = 0.0
+
+    def update(self, error):
+        self.integral += error
+        derivative = error - self.prev_error
+        self.prev_error = error
+        output = self.kp * error + self.ki * self.integral + self.kd * derivative
+        return max( -self.max_output, min(self.max_output, output) )
+
+    def is_done(self):
+        return abs(self.prev_error) < 0.1
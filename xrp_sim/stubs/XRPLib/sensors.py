@@ -0,0 +1,51 @@
+#
+# Simulated sensors. The readings can be changed by the simulator to exercise the sensor assisted
+# driving modes.
+#
+class IMU():
+    def __init__(self):
+        self.yaw = 0.0
+
+    def get_yaw(self):
+        return self.yaw
+
+    def get_heading(self):
+        return self.yaw % 360
+
+    def reset_yaw(self):
+        self.yaw = 0.0
+
+class Rangefinder():
+    def __init__(self):
+        # no obstacle in range
+        self.range_cm = 65535.0
+
+    def distance(self):
+        return self.range_cm
+
+class Reflectance():
+    def get_left(self):
+        return 0.0
+
+    def get_right(self):
+        return 0.0
+
+class Board():
+    def __init__(self):
+        self.led = False
+
+    def led_on(self):
+        self.led = True
+
+    def led_off(self):
+        self.led = False
+
+    def led_blink(self, frequency=0):
+        self.led = frequency > 0
+
+    def is_button_pressed(self):
+        return False
+
+class Webserver():
+    def start_server(self, *args, **kwargs):
+        pass
@@ -0,0 +1,23 @@
+from sim_timeline import timeline
+
+class Servo():
+    default_servos = {}
+
+    @classmethod
+    def get_default_servo(cls, index=1):
+        servo = cls.default_servos.get( index, None )
+        if servo is None:
+            servo = Servo( 'servo_%d' % index )
+            cls.default_servos[index] = servo
+        return servo
+
+    def __init__(self, name):
+        self.name = name
+        self.angle = 0
+
+    def set_angle(self, angle):
+        self.angle = angle
+        timeline.record( self.name, angle )
+
+    def free(self):
+        timeline.record( self.name, None )
@@ -0,0 +1,11 @@
+#
+# Stub for the MicroPython machine module. The unique ID can be changed by the simulator so that
+# several simulated XRPs can register with the same FMS.
+#
+UNIQUE_ID = b'\xe6\x61\x41\x04\x03\x2b\x5c\x2a'
+
+def unique_id():
+    return UNIQUE_ID
+
+def reset():
+    raise SystemExit(0)
@@ -0,0 +1,30 @@
+#
+# Stub for the MicroPython network module. The simulated WIFI interfaces connect immediately, using
+# the IP address configured by the simulator.
+#
+STA_IF = 0
+AP_IF = 1
+
+IP_ADDRESS = '127.0.0.1'
+
+class WLAN():
+    def __init__(self, interface):
+        self.interface = interface
+        self.is_active = False
+
+    def active(self, is_active=None):
+        if is_active is not None:
+            self.is_active = is_active
+        return self.is_active
+
+    def connect(self, ssid, passcode):
+        self.is_active = True
+
+    def isconnected(self):
+        return self.is_active
+
+    def config(self, **kwargs):
+        pass
+
+    def ifconfig(self):
+        return ( IP_ADDRESS, '255.255.255.0', IP_ADDRESS, IP_ADDRESS )
@@ -0,0 +1,47 @@
+import json
+import urllib.error
+import urllib.request
+
+#
+# Stub for the MicroPython urequests module, implemented with urllib. Connection errors are raised
+# as OSError, as they are on the XRP.
+#
+class Response():
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def close(self):
+        pass
+
+def request(method, url, data=None, json_data=None, headers=None):
+    if headers is None:
+        headers = {}
+    if json_data is not None:
+        data = json.dumps(json_data)
+        headers['Content-type'] = 'application/json'
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    req = urllib.request.Request( url, data=data, headers=headers, method=method )
+    try:
+        with urllib.request.urlopen( req, timeout=5 ) as resp:
+            return Response( resp.status, resp.read() )
+    except urllib.error.HTTPError as err:
+        return Response( err.code, err.read() )
+
+def get(url, **kwargs):
+    return request('GET', url, **kwargs)
+
+def post(url, data=None, json=None, headers=None):
+    return request('POST', url, data=data, json_data=json, headers=headers)
+
+def put(url, data=None, json=None, headers=None):
+    return request('PUT', url, data=data, json_data=json, headers=headers)
@@ -0,0 +1,5 @@
+#
+# Stub for the MicroPython uselect module, which provides the same poll interface as the CPython
+# select module
+#
+from select import *
@@ -0,0 +1,12 @@
+#
+# Stub for the XRP OLED display, which prints the displayed lines instead
+#
+class XrpDisplay():
+    def __init__(self, display_type='medium'):
+        self.display_type = display_type
+
+    def print_ln(self, text):
+        print( 'Display: %s' % text )
+
+    def clear_display(self):
+        pass
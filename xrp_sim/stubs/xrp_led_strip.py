@@ -0,0 +1,15 @@
+from sim_timeline import timeline
+
+#
+# Stub for the XRP LED strip, recording the color settings in the timeline
+#
+class XrpLedStrip():
+    def __init__(self):
+        self.color = None
+
+    def set_color(self, color, toggle=False):
+        if toggle and self.color == color:
+            self.color = None
+        else:
+            self.color = color
+        timeline.record( 'led_strip', self.color )
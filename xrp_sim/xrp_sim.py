@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import bisect
+import contextlib
+import importlib
+import math
+import os
+import socket
+import struct
+import sys
+import tempfile
+import time
+
+#
+# Simulator that runs the XRP control applications under CPython on a development machine. The
+# MicroPython-only modules used by the applications (XRPLib, machine, network, urequests, uselect)
+# are replaced by the stubs in the stubs directory, and the MicroPython extensions to the asyncio
+# and time modules are added by the micropython_compat module. The application classes in the xrp
+# directory are run unmodified.
+#
+# The simulator starts a fake FMS for the application to register with, runs the application's
+# run() loop, and connects a simulated driver station over a loopback socket that sends a stream of
+# commands. Every motor effort set by the application is recorded in a timeline, which is used to
+# measure the latency from the time each command is sent to the time the motors respond, and the
+# iterations of the drive loop are timed to measure the drive loop jitter.
+#
+# Note that the timings are for CPython on the development machine, so they are useful for
+# comparing changes and application classes against each other, rather than as absolute numbers
+# for the XRP.
+#
+SIM_DIR = os.path.dirname( os.path.abspath(__file__) )
+sys.path.insert( 0, os.path.join(SIM_DIR, '..', 'xrp') )
+sys.path.insert( 0, os.path.join(SIM_DIR, 'stubs') )
+
+import micropython_compat
+micropython_compat.install()
+
+from fake_fms import FakeFms
+from sim_timeline import timeline
+from xrp_protocol import *
+from xrp_control import READ_TIMEOUT, UDP_STALE_MS
+
+# XRP application classes that can be simulated, keyed by the name used at the command line
+APPLICATIONS = {
+    'base':           ( 'xrp_control',        'XrpControl' ),
+    'tank':           ( 'xrp_tank',           'XrpTank' ),
+    'mecanum':        ( 'xrp_mecanum',        'XrpMecanum' ),
+    'servo_triggers': ( 'xrp_servo_triggers', 'XrpServoTriggers' )
+}
+
+# timeline sources that represent the drive motors
+MOTOR_SOURCES = ( 'left_motor', 'right_motor', 'motor_three', 'motor_four' )
+
+# the control moved by the simulated driver station, and the steps it is moved through. The value
+# changes with every command so that every command results in a change to the motor efforts.
+COMMAND_CONTROL = 'LeftJoystickY'
+COMMAND_STEPS = [ step / 10.0 for step in list(range(-10, 11)) + list(range(9, -10, -1)) ]
+
+# the period of the drive loop in the XRP applications, in milliseconds
+DRIVE_LOOP_PERIOD_MS = 20
+
+# interval at which the application is checked for its server having started, and the time
+# allowed for the last command to take effect, in seconds
+STARTUP_POLL = 0.01
+SETTLE_WAIT = 0.2
+
+# interval between the pings sent to the application to measure the round trip time, in seconds
+PING_INTERVAL = 0.5
+
+# length of the synthetic datagram stream fed to the application by the clock drift check, in hours,
+# the interval at which a datagram in the stream is sent late, and the address that it is sent from
+CLOCK_DRIFT_HOURS = 2
+CLOCK_DRIFT_LATE_INTERVAL = 500
+CLOCK_DRIFT_ADDRESS = ('127.0.0.2', 0)
+
+#
+# Simulated driver station that sends a stream of commands to the XRP application over a loopback
+# socket, using the same wire formats as the driver station application.
+#
+class SimDriverStation():
+    def __init__(self, host, port, socket_type, wire_format, snapshot, rate):
+        self.host = host
+        self.port = port
+        self.socket_type = socket_type
+        self.wire_format = wire_format
+        # UDP connections always send snapshots
+        self.snapshot = snapshot or socket_type == 'UDP'
+        self.period = 1.0 / float(rate)
+        self.sequence = 0
+        self.state = [0] * NUM_CONTROLS
+
+        # time each command was sent, and the value sent
+        self.commands = list()
+
+        # number of telemetry frames received from the application, and the latest values
+        self.telemetry_frames = 0
+        self.telemetry = {}
+
+        # round trip times (in milliseconds) measured by pinging the application
+        self.ping_sequence = 0
+        self.round_trips = list()
+
+        # motor efforts before and after the driver station stopped sending, for the read timeout check
+        self.hold_efforts = None
+
+    def encode_command(self, name, value):
+        control_id = CONTROL_IDS.index( name )
+        if self.snapshot:
+            self.state[control_id] = int(round(value * VALUE_SCALE))
+            frame = struct.pack( SNAPSHOT_FRAME_FORMAT, FRAME_SNAPSHOT, *self.state )
+        elif self.wire_format == WIRE_FORMAT_BINARY:
+            frame = struct.pack( EVENT_FRAME_FORMAT, FRAME_EVENT, control_id, int(round(value * VALUE_SCALE)) )
+        else:
+            frame = ('Event:%s:%f\n' % (name, value)).encode('utf-8')
+
+        return self.encode_datagram( frame )
+
+    def encode_ping(self):
+        self.ping_sequence += 1
+        if self.socket_type == 'UDP' or self.wire_format == WIRE_FORMAT_BINARY:
+            frame = struct.pack( PING_FRAME_FORMAT, FRAME_PING, self.ping_sequence, time.ticks_ms() & 0xFFFFFFFF )
+        else:
+            frame = ('%s:%d:%d\n' % (PING_COMMAND, self.ping_sequence, time.ticks_ms() & 0xFFFFFFFF)).encode('utf-8')
+        return self.encode_datagram( frame )
+
+    def encode_datagram(self, frame):
+        if self.socket_type == 'UDP':
+            self.sequence += 1
+            header = struct.pack( DATAGRAM_HEADER_FORMAT, self.sequence & 0xFFFFFFFF, time.ticks_ms() & 0xFFFFFFFF )
+            frame = header + frame
+        return frame
+
+    #
+    # Function records the round trip time of a ping, excluding the time the application took to reply
+    #
+    def process_pong(self, sequence, sent, received, transmitted):
+        round_trip = diff32( time.ticks_ms() & 0xFFFFFFFF, sent ) - diff32( transmitted, received )
+        self.round_trips.append( round_trip )
+
+    #
+    # Function decodes a telemetry or pong frame sent back by the application
+    #
+    def process_telemetry(self, frame):
+        if len(frame) >= PONG_FRAME_SIZE and frame[0] == FRAME_PONG:
+            self.process_pong( *struct.unpack_from(PONG_FRAME_FORMAT, frame, 0)[2:] )
+            return
+        if len(frame) < TELEMETRY_HEADER_SIZE or frame[0] != FRAME_TELEMETRY:
+            return
+        header = struct.unpack_from( TELEMETRY_HEADER_FORMAT, frame, 0 )
+        fields = struct.unpack_from( telemetry_frame_format(header[2]), frame, 0 )[len(header):]
+        names = [ field for field_id, field in enumerate(TELEMETRY_FIELDS) if header[2] & (1 << field_id) ]
+        self.telemetry = { name: value / scale for (name, field_format, scale), value in zip(names, fields) }
+        self.telemetry_frames += 1
+
+    async def read_telemetry(self, reader):
+        try:
+            while True:
+                header = await reader.readexactly( 2 )
+                self.process_telemetry( header + await reader.readexactly(header[1] - 2) )
+        except (asyncio.IncompleteReadError, OSError):
+            pass
+
+    async def read_lines(self, reader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                fields = str(line, 'utf-8').strip().split(':')
+                if len(fields) == 5 and fields[0] == PONG_COMMAND:
+                    self.process_pong( *[int(field) for field in fields[1:]] )
+        except (ValueError, OSError):
+            pass
+
+    #
+    # Task that polls the UDP socket for the datagrams sent back by the application, often enough
+    # that the polling does not add noticeably to the measured round trip times
+    #
+    async def read_telemetry_datagrams(self, udp_socket):
+        while True:
+            try:
+                self.process_telemetry( udp_socket.recv(256) )
+            except (BlockingIOError, OSError):
+                await asyncio.sleep( 0.001 )
+
+    #
+    # Function sends the stream of commands for the duration. If a hold time is specified, the
+    # driver station then drives at full effort and stops sending anything for the hold time
+    # without closing the connection, as if the link to the XRP had been lost.
+    #
+    async def run(self, duration, hold=0.0):
+        writer = None
+        udp_socket = None
+        telemetry_task = None
+        if self.socket_type == 'UDP':
+            udp_socket = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+            udp_socket.connect( (self.host, self.port) )
+            udp_socket.setblocking( False )
+            telemetry_task = asyncio.create_task( self.read_telemetry_datagrams(udp_socket) )
+        else:
+            reader, writer = await asyncio.open_connection( self.host, self.port )
+            if self.wire_format == WIRE_FORMAT_BINARY:
+                request = protocol_command( WIRE_FORMAT_BINARY ).encode('utf-8')
+                writer.write( request )
+                await writer.drain()
+                response = await asyncio.wait_for( reader.readline(), 2.0 )
+                if response != request:
+                    print( 'XRP did not accept the binary wire format' )
+                    writer.close()
+                    return
+                telemetry_task = asyncio.create_task( self.read_telemetry(reader) )
+            else:
+                telemetry_task = asyncio.create_task( self.read_lines(reader) )
+
+        start = time.monotonic()
+        next_send = start
+        next_ping = start + PING_INTERVAL
+        step = 0
+        while time.monotonic() - start < duration:
+            value = COMMAND_STEPS[step % len(COMMAND_STEPS)]
+            step += 1
+
+            # the ping is encoded first so that it carries an earlier datagram sequence number
+            ping = b''
+            if time.monotonic() >= next_ping:
+                next_ping += PING_INTERVAL
+                ping = self.encode_ping()
+            data = self.encode_command( COMMAND_CONTROL, value )
+            if udp_socket and ping:
+                udp_socket.send( ping )
+            else:
+                data = ping + data
+            self.commands.append( (time.monotonic(), value) )
+            if udp_socket:
+                udp_socket.send( data )
+            else:
+                writer.write( data )
+                await writer.drain()
+
+            next_send += self.period
+            await asyncio.sleep( max(0.0, next_send - time.monotonic()) )
+
+        if hold > 0.0:
+            data = self.encode_command( COMMAND_CONTROL, 1.0 )
+            if udp_socket:
+                udp_socket.send( data )
+            else:
+                writer.write( data )
+                await writer.drain()
+            await asyncio.sleep( SETTLE_WAIT )
+            before = timeline.get_values( MOTOR_SOURCES )
+            await asyncio.sleep( hold )
+            self.hold_efforts = ( before, timeline.get_values(MOTOR_SOURCES) )
+
+        # allow the last command to take effect before closing the connection
+        await asyncio.sleep( SETTLE_WAIT )
+        if telemetry_task:
+            telemetry_task.cancel()
+        if udp_socket:
+            udp_socket.close()
+        else:
+            writer.close()
+
+#
+# Function returns the requested percentile (0-100) of the sorted list of values
+#
+def percentile(sorted_values, percent):
+    if not sorted_values:
+        return 0.0
+    index = min( len(sorted_values) - 1, int(math.ceil(len(sorted_values) * percent / 100.0)) - 1 )
+    return sorted_values[max(0, index)]
+
+def format_stats(label, values_ms):
+    values_ms = sorted(values_ms)
+    if not values_ms:
+        return '%s: no samples' % label
+    mean = sum(values_ms) / len(values_ms)
+    return '%s: samples=%d, mean=%.2fms, p50=%.2fms, p99=%.2fms, max=%.2fms' % \
+           (label, len(values_ms), mean, percentile(values_ms, 50), percentile(values_ms, 99), values_ms[-1])
+
+#
+# Function matches each command sent by the simulated driver station with the first change to the
+# motor efforts that follows it, returning the list of latencies in milliseconds and the number of
+# commands that the motors did not respond to before the next command was sent
+#
+def get_command_latencies(commands):
+    motor_changes = [ entry[0] for entry in timeline.get_entries(MOTOR_SOURCES) ]
+    latencies = list()
+    missed = 0
+    for index, (sent, value) in enumerate(commands):
+        next_sent = commands[index+1][0] if index+1 < len(commands) else float('inf')
+        change_index = bisect.bisect_left( motor_changes, sent )
+        if change_index < len(motor_changes) and motor_changes[change_index] < next_sent:
+            latencies.append( (motor_changes[change_index] - sent) * 1000.0 )
+        else:
+            missed += 1
+    return latencies, missed
+
+#
+# Function feeds the UDP datagram validation of the application a synthetic stream of datagrams,
+# timestamped by a driver station clock that drifts by the given parts per million relative to the
+# XRP clock, for CLOCK_DRIFT_HOURS at the command rate. Every CLOCK_DRIFT_LATE_INTERVAL datagram is
+# sent late, and only those are expected to be dropped as stale. Returns the number of datagrams
+# that were accepted, dropped as stale while on time, and dropped as stale while late.
+#
+def check_clock_drift(controller, ppm, rate):
+    frame = struct.pack( SNAPSHOT_FRAME_FORMAT, FRAME_SNAPSHOT, *([0] * NUM_CONTROLS) )
+    period_ms = 1000.0 / float(rate)
+    accepted, stale, late_stale = 0, 0, 0
+    for sequence in range(1, int(CLOCK_DRIFT_HOURS * 3600 * 1000 / period_ms) + 1):
+        now = int(sequence * period_ms)
+        remote_ms = now + int(now * ppm / 1000000.0)
+        late = sequence % CLOCK_DRIFT_LATE_INTERVAL == 0
+        if late:
+            remote_ms -= 2 * UDP_STALE_MS
+        header = struct.pack( DATAGRAM_HEADER_FORMAT, sequence, remote_ms & 0xFFFFFFFF )
+        stale_count = controller.udp_stats['stale']
+        if controller.process_datagram( header + frame, CLOCK_DRIFT_ADDRESS, now ):
+            accepted += 1
+        elif controller.udp_stats['stale'] != stale_count:
+            if late:
+                late_stale += 1
+            else:
+                stale += 1
+    return accepted, stale, late_stale
+
+def build_config(options, fms, cache_file):
+    config = {
+        'networks': [ { 'network_type': 'STA', 'ssid': 'xrp_sim', 'wifi_passcode': '', 'enabled': True } ],
+        'fms': [ { 'url_base': fms.url_base, 'enabled': not options.no_fms } ],
+        'fms_cache': cache_file,
+        'server': { 'socket_type': options.socket_type.upper(), 'listening_port': int(options.port) },
+        'telemetry': { 'enabled': True, 'rate': 10 }
+    }
+    if options.dual_core or float(options.slew_rate) > 0.0:
+        config['settings'] = { 'imu_assist': {'enabled': False}, 'proximity_assist': {'enabled': False, 'distance': 10},
+                               'dual_core': options.dual_core, 'slew_rate': float(options.slew_rate) }
+    if options.application == 'mecanum':
+        config['led_strip'] = { 'enabled': True }
+    return config
+
+async def simulate(controller, options):
+    start = time.monotonic()
+    run_task = asyncio.create_task( controller.run() )
+
+    # the server is started as soon as the network is up, without waiting for the FMS
+    while controller.status != 'Waiting For Connection':
+        await asyncio.sleep( STARTUP_POLL )
+    controller.startup_time = (time.monotonic() - start) * 1000.0
+
+    # the driver station connects with the socket type and port that the server was started with,
+    # which come from the cached FMS configuration when there is one
+    socket_type = controller.config['server']['socket_type'].upper()
+    driver_station = SimDriverStation( '127.0.0.1', controller.my_port, socket_type,
+                                       options.wire_format.upper(), options.snapshot, options.rate )
+    # the read timeout check holds the connection open without sending until after the read timeout
+    hold = READ_TIMEOUT + 1.0 if options.read_timeout else 0.0
+    await driver_station.run( float(options.duration), hold )
+
+    # give the application a chance to see the connection close before it is stopped
+    await asyncio.sleep( SETTLE_WAIT )
+    controller.shutdown = True
+    run_task.cancel()
+    return driver_station
+
+def run_simulation(options):
+    fms = FakeFms( delay=float(options.fms_delay) )
+    fms.start()
+
+    module_name, class_name = APPLICATIONS[options.application]
+    application_class = getattr( importlib.import_module(module_name), class_name )
+
+    # the output from the XRP application is discarded unless requested, as the per-command
+    # output would otherwise swamp the results
+    robot_output = sys.stdout if options.verbose else open( os.devnull, 'w' )
+    # the FMS configuration cache is discarded after the run unless a cache file is specified, in
+    # which case it is kept to simulate the next power-on of the XRP
+    cache_dir = tempfile.TemporaryDirectory()
+    cache_file = options.fms_cache or os.path.join( cache_dir.name, 'fms_cache.json' )
+    with contextlib.redirect_stdout( robot_output ):
+        controller = application_class( build_config(options, fms, cache_file) )
+
+        # time each iteration of the drive loop, which calls drive_step() once per iteration in
+        # every application class, whether it runs as a task or on its own thread
+        drive_loop_times = list()
+        drive_step = controller.drive_step
+        def timed_drive_step():
+            drive_loop_times.append( time.monotonic() )
+            drive_step()
+        controller.drive_step = timed_drive_step
+
+        timeline.reset()
+        start_time = time.monotonic()
+        driver_station = asyncio.run( simulate(controller, options) )
+        udp_stats = dict(controller.udp_stats)
+        if options.clock_drift is not None:
+            drift_results = check_clock_drift( controller, float(options.clock_drift), options.rate )
+    fms.stop()
+    cache_dir.cleanup()
+
+    latencies, missed = get_command_latencies( driver_station.commands )
+    drive_loop_times = [ t for t in drive_loop_times if t >= driver_station.commands[0][0] ] if driver_station.commands else []
+    periods = [ (t2 - t1) * 1000.0 for t1, t2 in zip(drive_loop_times, drive_loop_times[1:]) ]
+    jitter = [ abs(period - DRIVE_LOOP_PERIOD_MS) for period in periods ]
+
+    # UDP connections always send binary snapshots, whatever wire format is requested
+    wire_format = WIRE_FORMAT_BINARY if driver_station.socket_type == 'UDP' else options.wire_format.upper()
+    print( 'Application: %s, Socket: %s, Wire Format: %s, Snapshots: %s, Rate: %s commands/s, Dual Core: %s' % \
+           (class_name, driver_station.socket_type, wire_format, driver_station.snapshot, options.rate,
+            options.dual_core) )
+    print( 'Startup Time: %.1fms, Registered With FMS: %s' % (controller.startup_time, controller.registered) )
+    print( 'Commands Sent: %d, Motor Responses: %d, Missed: %d' % (len(driver_station.commands), len(latencies), missed) )
+    print( format_stats('Command-To-Motor Latency', latencies) )
+    print( format_stats('Drive Loop Period', periods) )
+    print( format_stats('Drive Loop Jitter', jitter) )
+    print( 'Drive Loop Timer: %s' % str(controller.drive_timer.get_stats()) )
+    print( 'Motor Writes: %d (%.2f per drive loop iteration)' % \
+           (controller.kinematics.writes, controller.kinematics.writes / max(len(drive_loop_times), 1)) )
+    if driver_station.socket_type == 'UDP':
+        print( 'UDP Datagrams: %s' % str(udp_stats) )
+    print( 'Telemetry Frames: %d, Latest: %s' % (driver_station.telemetry_frames, str(driver_station.telemetry)) )
+    print( format_stats('Ping Round Trip', driver_station.round_trips) )
+    print( 'FMS Requests: %s, Connections: %d, Not Modified: %d' % (str(fms.request_counts), fms.connections,
+                                                                    fms.not_modified) )
+
+    if driver_station.hold_efforts:
+        before, after = driver_station.hold_efforts
+        stopped = any([ value != 0.0 for value in before.values() ]) and all([ value == 0.0 for value in after.values() ])
+        print( 'Read Timeout Stop: %s, Efforts Before: %s, After: %s' % \
+               ('Stopped' if stopped else 'FAILED', str(before), str(after)) )
+
+    if options.clock_drift is not None:
+        accepted, stale, late_stale = drift_results
+        print( 'Clock Drift Check: %s, Drift: %sppm over %d hours, Accepted: %d, Stale On Time: %d, Stale Late: %d' % \
+               ('Passed' if stale == 0 and late_stale > 0 else 'FAILED', options.clock_drift, CLOCK_DRIFT_HOURS,
+                accepted, stale, late_stale) )
+
+    if options.output:
+        timeline.save_csv( options.output, start_time )
+        print( 'Motor effort timeline saved to %s' % options.output )
+
+if __name__ == '__main__':
+
+    #
+    # parse out the command arguments
+    #
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-a', '--application', action='store', dest='application', default='base', choices=sorted(APPLICATIONS.keys()))
+    parser.add_argument('-s', '--socket', action='store', dest='socket_type', default='TCP')
+    parser.add_argument('-w', '--wire_format', action='store', dest='wire_format', default=WIRE_FORMAT_TEXT)
+    parser.add_argument('-S', '--snapshot', action='store_true', dest='snapshot', default=False)
+    parser.add_argument('-r', '--rate', action='store', dest='rate', default='20')
+    parser.add_argument('-t', '--duration', action='store', dest='duration', default='10')
+    parser.add_argument('-p', '--port', action='store', dest='port', default='9999')
+    parser.add_argument('-o', '--output', action='store', dest='output', default=None)
+    parser.add_argument('-c', '--dual_core', action='store_true', dest='dual_core', default=False)
+    parser.add_argument('-d', '--fms_delay', action='store', dest='fms_delay', default='0')
+    parser.add_argument('-l', '--slew_rate', action='store', dest='slew_rate', default='0')
+    parser.add_argument('-k', '--fms_cache', action='store', dest='fms_cache', default=None)
+    parser.add_argument('-T', '--read_timeout', action='store_true', dest='read_timeout', default=False)
+    parser.add_argument('-D', '--clock_drift', action='store', dest='clock_drift', default=None)
+    parser.add_argument('-n', '--no_fms', action='store_true', dest='no_fms', default=False)
+    parser.add_argument('-v', '--verbose', action='store_true', dest='verbose', default=False)
+    options = parser.parse_args()
+
+    run_simulation( options )